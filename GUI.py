@@ -3,7 +3,9 @@ from dash import dcc, html
 from dash.dependencies import Input, Output, State
 import datetime
 
-from main import download_station_data_logic, process_stream_logic, detect_phases_logic, download_catalogue_logic, match_events_logic, generate_report_logic, send_email_logic
+from main import download_station_data_logic, process_stream_logic, detect_phases_logic, download_catalogue_logic, match_events_logic, generate_report_logic, send_email_logic, \
+    bandpass_config, load_config
+from model_registry import warm_up_models
 from station import Station
 from stream_processing import save_stream
 
@@ -18,6 +20,9 @@ global_catalog = None
 global_report = None
 global_p_only = None
 
+# Preprocessing options the page has no controls for come from the config file
+default_config = load_config()
+
 # 获取今天的日期的前一天
 yesterday = (datetime.date.today() - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
 
@@ -248,7 +253,13 @@ def process_stream_callback(n_clicks, processing_options_1, processing_options_2
             taper = 'taper' in processing_options_2
             denoise = 'denoise' in processing_options_2
 
-            process_stream_logic(global_station, detrend_demean, detrend_linear, remove_outliers, bandpass_filter, taper, denoise)
+            # The stream is saved below, so process_stream_logic does not save it
+            process_stream_logic(global_station, detrend_demean, detrend_linear, remove_outliers, bandpass_filter, taper,
+                                 denoise, False, outlier_method=default_config.get('outlier_method', 'threshold'),
+                                 outlier_window=default_config.get('outlier_window', 10),
+                                 preprocessing_stages=default_config.get('preprocessing_stages') or None,
+                                 bandpass_options=bandpass_config(default_config),
+                                 preprocessing_workers=default_config.get('preprocessing_workers', 1))
 
             if 'save' in save_processed:
                 save_stream(global_station, global_station.processed_stream, "processed")
@@ -376,4 +387,6 @@ def send_email_callback(nclicks, email_recipient):
     return ""
 
 if __name__ == '__main__':
+    # Load pretrained models once before serving requests
+    warm_up_models()
     GUI.run_server(debug=True)
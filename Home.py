@@ -5,9 +5,20 @@ import plotly.graph_objects as go
 import streamlit as st
 
 from main import load_config, read_total_events_summary
+from model_registry import warm_up_models
+from report_asset_generation import format_time_error
+
+
+# Load pretrained models once per server process, shared by all sessions and pages
+@st.cache_resource
+def load_models():
+    warm_up_models()
+    return True
+
 
 # Load default settings
 default_config = load_config()
+load_models()
 # Initialize session state variables
 for key, value in default_config.items():
     if key not in st.session_state:
@@ -23,7 +34,9 @@ if 'df' not in st.session_state:
     st.session_state.df = read_total_events_summary(
         network=st.session_state.network,
         code=st.session_state.station_code,
-        url=st.session_state.data_provider_url
+        url=st.session_state.data_provider_url,
+        columns=["date", "unique_id", "time", "lat", "long", "mag", "mag_type", "depth", "epi_distance",
+                 "p_confidence", "s_confidence", "p_error", "s_error", "catalogued", "detected"]
     )
 
 # Page title
@@ -121,13 +134,9 @@ with scatterplot_container:
         df['detected'] = df['detected'].astype(bool)
         df['catalogued'] = df['catalogued'].astype(bool)
 
-        # Ensure 'p_error' and 's_error' are string
-        df['p_error'] = df['p_error'].astype(str)
-        df['s_error'] = df['s_error'].astype(str)
-
-        # Replace NaN values in 'p_error' and 's_error' with 'N/A'
-        df.loc[:, 'p_error'] = df['p_error'].replace('nan', 'N/A')
-        df.loc[:, 's_error'] = df['s_error'].replace('nan', 'N/A')
+        # Residuals are stored in seconds, format them for the tooltips ('N/A' where missing)
+        df['p_error'] = df['p_error'].map(format_time_error)
+        df['s_error'] = df['s_error'].map(format_time_error)
 
         # Replace NaN values in 's_confidence' with 'N/A'
         df.loc[:, 's_confidence'] = df['s_confidence'].fillna('N/A')
@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from obspy import Stream, UTCDateTime, read
+from obspy.clients.filesystem.sds import Client as SDSClient, SDS_FMTSTR
+
+# Stations of one process share the archive, and neighbouring days write into the same day files
+_archive_lock = threading.Lock()
+# Seconds. Shorter gaps between the stored traces and the requested span are sample alignment, not missing data.
+MIN_GAP = 1.0
+# Spans the provider answered with no data are recorded too. Data of recent days may still arrive, so such an
+# answer is trusted for NO_DATA_TTL seconds; once given after the span settled it is kept for good.
+NO_DATA_TTL = 3600
+NO_DATA_SETTLE_DAYS = 7
+# Index entry holding the [start, end, queried_at] no-data answers of each request key
+NO_DATA = "no_data"
+
+
+@contextmanager
+def file_lock(path):
+    # Exclusive lock between processes, e.g. the scheduler's workers sharing one archive
+    with open(path, 'a+') as file:
+        if fcntl:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def merge_intervals(intervals, tolerance=1e-6):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + tolerance:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def covers(stream, starttime, endtime):
+    # Whether the traces of stream reach from starttime to endtime, up to MIN_GAP at either end
+    if not len(stream):
+        return False
+    first = min(trace.stats.starttime for trace in stream)
+    last = max(trace.stats.endtime + trace.stats.delta for trace in stream)
+    return first - UTCDateTime(starttime) < MIN_GAP and UTCDateTime(endtime) - last < MIN_GAP
+
+
+# Local SDS archive of downloaded waveforms with an index of the time spans held for each
+# (network, station, location, channel) request, so only the gaps have to be requested from the provider.
+# Spans are those of the traces stored, so data the provider did not have yet is requested again next time,
+# unless the provider answered that it has none.
+class WaveformArchive:
+    def __init__(self, root=None, no_data_ttl=NO_DATA_TTL, settle_days=NO_DATA_SETTLE_DAYS):
+        self.root = root or os.path.join(os.getcwd(), "data", "archive")
+        self.no_data_ttl = no_data_ttl
+        self.settle_days = settle_days
+        self.index_path = os.path.join(self.root, "index.json")
+        self.lock_path = os.path.join(self.root, "archive.lock")
+        os.makedirs(self.root, exist_ok=True)
+        self.client = SDSClient(self.root)
+
+    @staticmethod
+    def make_key(network, station, location, channel):
+        return f"{network}.{station}.{location}.{channel}"
+
+    def load_index(self):
+        if not os.path.isfile(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable archive index {self.index_path}: {e}")
+            return {}
+
+    def save_index(self, index):
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(index, file)
+        os.replace(temp_path, self.index_path)
+
+    def coverage(self, key):
+        return self.load_index().get(key, [])
+
+    def is_fresh(self, record):
+        # Answered after the span settled: valid for good. Otherwise only within the TTL.
+        _, end, queried_at = record
+        return queried_at >= end + self.settle_days * 86400 or time.time() - queried_at <= self.no_data_ttl
+
+    def known(self, key):
+        # Spans held in the archive or answered with no data recently enough to trust
+        index = self.load_index()
+        no_data = [record[:2] for record in index.get(NO_DATA, {}).get(key, []) if self.is_fresh(record)]
+        return merge_intervals(index.get(key, []) + no_data)
+
+    def missing(self, key, starttime, endtime):
+        # Gaps of [starttime, endtime] neither downloaded nor answered with no data before
+        start = UTCDateTime(starttime).timestamp
+        end = UTCDateTime(endtime).timestamp
+        gaps = []
+        for covered_start, covered_end in self.known(key):
+            if covered_end <= start:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start - start >= MIN_GAP:
+                gaps.append((UTCDateTime(start), UTCDateTime(covered_start)))
+            start = max(start, covered_end)
+        if end - start >= MIN_GAP:
+            gaps.append((UTCDateTime(start), UTCDateTime(end)))
+        return gaps
+
+    def day_file(self, trace, time):
+        stats = trace.stats
+        return os.path.join(self.root, SDS_FMTSTR.format(
+            year=time.year, doy=time.julday, network=stats.network, station=stats.station,
+            location=stats.location, channel=stats.channel, sds_type="D"))
+
+    def add(self, stream, key, starttime, endtime):
+        # Store the stream in SDS day files and record the spans of its traces within [starttime, endtime]
+        with _archive_lock, file_lock(self.lock_path):
+            day_files = {}
+            for trace in stream:
+                day = UTCDateTime(trace.stats.starttime.date)
+                while day <= trace.stats.endtime:
+                    piece = trace.slice(day, day + 86400 - trace.stats.delta)
+                    if piece.stats.npts:
+                        day_files.setdefault(self.day_file(trace, day), Stream()).append(piece)
+                    day += 86400
+
+            for path, day_stream in day_files.items():
+                if os.path.isfile(path):
+                    day_stream += read(path)
+                day_stream.merge(method=1)
+                # Keep real gaps as separate records instead of filling them
+                day_stream = day_stream.split()
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                day_stream.write(path, format='MSEED')
+
+            start = UTCDateTime(starttime).timestamp
+            end = UTCDateTime(endtime).timestamp
+            spans = [[max(start, trace.stats.starttime.timestamp),
+                      min(end, trace.stats.endtime.timestamp + trace.stats.delta)] for trace in stream]
+            index = self.load_index()
+            index[key] = merge_intervals(index.get(key, []) + [span for span in spans if span[0] < span[1]])
+            self.save_index(index)
+
+    def add_no_data(self, key, starttime, endtime):
+        # Record that the provider had no data for [starttime, endtime], replacing stale answers
+        start = UTCDateTime(starttime).timestamp
+        end = UTCDateTime(endtime).timestamp
+        with _archive_lock, file_lock(self.lock_path):
+            index = self.load_index()
+            records = index.setdefault(NO_DATA, {}).get(key, [])
+            records = [record for record in records
+                       if self.is_fresh(record) and not (start <= record[0] and record[1] <= end)]
+            index[NO_DATA][key] = records + [[start, end, time.time()]]
+            self.save_index(index)
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime):
+        with _archive_lock, file_lock(self.lock_path):
+            return self.client.get_waveforms(network, station, location, channel, starttime, endtime)
@@ -0,0 +1,563 @@
+import os
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from obspy import Stream, Trace, UTCDateTime
+from obspy.signal.filter import bandpass
+from scipy.optimize import linear_sum_assignment
+
+from model_registry import get_model
+from parallel_preprocessing import ParallelPreprocessor
+from preprocessing import FilterBank, PreprocessingPipeline
+from stream import StreamData, predict_and_annotate
+from streaming_preprocessing import StreamingPreprocessor
+from catalog import Catalog
+from earthquake import Earthquake
+from earthquake_table import EarthquakeTable
+from matching import _UNASSIGNED_COST, PickIndex, _ns, greedy_match, optimal_match
+from stream_processing import remove_outliers_rolling, remove_outliers_threshold, remove_outliers_window
+from travel_times import accuracy_report, load_travel_time_table, predict_arrivals_batch
+
+
+# Build a synthetic vertical-component stream with a few impulsive arrivals on top of noise
+def synthetic_stream(duration=3600, sampling_rate=100.0, starttime="2024-04-23T00:00:00", seed=0):
+    rng = np.random.default_rng(seed)
+    npts = int(duration * sampling_rate)
+    data = rng.normal(0, 1, npts).astype(np.float32)
+
+    for onset in rng.uniform(0.05, 0.95, size=max(1, int(duration // 600))) * npts:
+        onset = int(onset)
+        length = min(int(20 * sampling_rate), npts - onset)
+        envelope = np.exp(-np.arange(length) / (3 * sampling_rate))
+        data[onset:onset + length] += (20 * envelope * np.sin(np.arange(length) * 0.6)).astype(np.float32)
+
+    trace = Trace(data=data)
+    trace.stats.network = "AM"
+    trace.stats.station = "SYNTH"
+    trace.stats.channel = "EHZ"
+    trace.stats.sampling_rate = sampling_rate
+    trace.stats.starttime = UTCDateTime(starttime)
+    return Stream([trace])
+
+
+# Check the single-pass phase picker against the former classify + annotate path
+def compare_single_pass(stream, time_tolerance=None, atol=1e-5):
+    model = get_model("EQTransformer", "original")
+
+    start = time.time()
+    reference_output = model.classify(stream)
+    reference_annotated = model.annotate(stream)
+    two_pass_time = time.time() - start
+
+    start = time.time()
+    picks, annotated = predict_and_annotate(stream)
+    single_pass_time = time.time() - start
+
+    reference_picks = [(pick.peak_time, pick.peak_value, pick.phase) for pick in reference_output.picks]
+    if time_tolerance is None:
+        time_tolerance = 1 / stream[0].stats.sampling_rate
+
+    picks_match = len(picks) == len(reference_picks) and all(
+        pick['phase'] == phase and
+        abs(pick['peak_time'] - peak_time) <= time_tolerance and
+        abs(pick['peak_confidence'] - peak_value) <= atol
+        for pick, (peak_time, peak_value, phase) in zip(picks, reference_picks)
+    )
+    annotations_match = len(annotated) == len(reference_annotated) and all(
+        tr.stats.starttime == ref.stats.starttime and np.allclose(tr.data, ref.data, atol=atol)
+        for tr, ref in zip(annotated, reference_annotated)
+    )
+
+    return {
+        "picks_match": picks_match,
+        "annotations_match": annotations_match,
+        "pick_count": len(picks),
+        "two_pass_time": two_pass_time,
+        "single_pass_time": single_pass_time,
+    }
+
+
+def compare_travel_times(n_events=300, station_latitude=51.5, station_longitude=-0.1, seed=0):
+    # Predicted arrivals for random events from TauP per event and from the travel time table
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(-60, 60, n_events)
+    longs = rng.uniform(-180, 180, n_events)
+    depths = rng.uniform(0, 700, n_events)
+    times = [UTCDateTime(2024, 1, 1)] * n_events
+    load_travel_time_table()
+
+    start = time.perf_counter()
+    exact_p, exact_s = predict_arrivals_batch(lats, longs, depths, times, station_latitude, station_longitude,
+                                              mode="exact")
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table_p, table_s = predict_arrivals_batch(lats, longs, depths, times, station_latitude, station_longitude,
+                                              mode="table")
+    table_time = time.perf_counter() - start
+
+    errors = [abs(table - exact) for table, exact in zip(table_p + table_s, exact_p + exact_s)
+              if table is not None and exact is not None]
+    return {
+        "exact_time": exact_time,
+        "table_time": table_time,
+        "max_error": max(errors) if errors else 0.0,
+        "existence_match": [t is None for t in table_p + table_s] == [e is None for e in exact_p + exact_s],
+        "accuracy": accuracy_report(n_events, seed=seed),
+    }
+
+
+# The nested loop Catalog.match_and_merge used before greedy_match, kept to check the assignments
+def legacy_match(p_predicted, s_predicted, detections, tolerance_p, tolerance_s, p_only=False):
+    assignments = []
+    for p_time, s_time in zip(p_predicted, s_predicted):
+        highest_p_confidence = 0
+        highest_s_confidence = 0
+        best_p_detection = None
+        best_s_detection = None
+
+        for detection in detections:
+            detected_time = UTCDateTime(detection['peak_time'])
+            if detection['phase'] == 'P' and p_time and abs(detected_time - UTCDateTime(p_time)) <= tolerance_p:
+                if detection['peak_confidence'] > highest_p_confidence:
+                    highest_p_confidence = detection['peak_confidence']
+                    best_p_detection = detection['peak_time']
+            if not p_only and detection['phase'] == 'S' and s_time and abs(
+                    detected_time - UTCDateTime(s_time)) <= tolerance_s:
+                if detection['peak_confidence'] > highest_s_confidence:
+                    highest_s_confidence = detection['peak_confidence']
+                    best_s_detection = detection['peak_time']
+
+        assignments.append((best_p_detection, best_s_detection))
+        detections = [d for d in detections if
+                      not (d['peak_time'] == best_p_detection or (
+                              not p_only and d['peak_time'] == best_s_detection))]
+    return assignments, detections
+
+
+def synthetic_matching_day(n_events=300, n_picks=5000, seed=0, duration=86400):
+    # Catalogued events with predicted arrivals over duration seconds of one day and low-threshold picks, some
+    # of them close to the predictions and some sharing a time
+    rng = np.random.default_rng(seed)
+    day = UTCDateTime(2024, 4, 23)
+    origins = np.sort(rng.uniform(0, duration, n_events))
+    p_predicted = [day + float(t) for t in origins]
+    s_predicted = [day + float(t) + float(rng.uniform(5, 600)) if rng.random() < 0.9 else None for t in origins]
+
+    times = rng.uniform(0, duration, n_picks)
+    near = rng.random(n_picks) < 0.3
+    times[near] = origins[rng.integers(0, n_events, near.sum())] + rng.normal(0, 5, near.sum())
+    times = np.round(times, 2)
+    detections = [{
+        "peak_time": day + float(t),
+        "peak_confidence": float(np.round(rng.uniform(0, 1), 2)),
+        "phase": "P" if rng.random() < 0.6 else "S"
+    } for t in times]
+    return p_predicted, s_predicted, detections
+
+
+def compare_matching(n_events=300, n_picks=5000, tolerance_p=10.0, tolerance_s=20.0, p_only=False, seed=0):
+    p_predicted, s_predicted, detections = synthetic_matching_day(n_events, n_picks, seed)
+
+    start = time.perf_counter()
+    legacy_assignments, legacy_unmatched = legacy_match(p_predicted, s_predicted, detections, tolerance_p,
+                                                        tolerance_s, p_only)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assignments, unmatched = greedy_match(p_predicted, s_predicted, detections, tolerance_p, tolerance_s, p_only)
+    indexed_time = time.perf_counter() - start
+
+    assigned_times = [(detections[p]['peak_time'] if p is not None else None,
+                       detections[s]['peak_time'] if s is not None else None) for p, s in assignments]
+    return {
+        "legacy_time": legacy_time,
+        "indexed_time": indexed_time,
+        "assignments_match": assigned_times == legacy_assignments,
+        "unmatched_match": [detections[i] for i in unmatched] == legacy_unmatched,
+    }
+
+
+def dense_phase_match(index, predicted_times, tolerance):
+    # The dense assignment optimal_match used before its sparse matching: one events by picks cost matrix,
+    # kept to check the assignments and the time saved
+    cost_matrix = np.full((len(predicted_times), len(index.ns)), _UNASSIGNED_COST)
+    for event, predicted in enumerate(predicted_times):
+        if not predicted:
+            continue
+        candidates = index.window(predicted, tolerance)
+        candidates = candidates[index.confidences[candidates] > 0]
+        residuals = np.abs(index.ns[candidates] - _ns(predicted)) / 1e9
+        cost_matrix[event, candidates] = residuals / max(tolerance, 1e-9) + 1 - index.confidences[candidates]
+    assigned = [None] * len(predicted_times)
+    for row, col in zip(*linear_sum_assignment(cost_matrix)):
+        if cost_matrix[row, col] < _UNASSIGNED_COST:
+            assigned[row] = int(index.positions[col])
+    return assigned, cost_matrix
+
+
+def compare_optimal_matching(n_events=2000, n_picks=10000, duration=3600, tolerance_p=10.0, seed=0):
+    # A dense sequence, like the hours after a large earthquake, where many events compete for the same picks
+    p_predicted, _, detections = synthetic_matching_day(n_events, n_picks, seed, duration)
+
+    start = time.perf_counter()
+    index = PickIndex(detections, 'P')
+    dense, cost_matrix = dense_phase_match(index, p_predicted, tolerance_p)
+    dense_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assignments, _ = optimal_match(p_predicted, [None] * n_events, detections, tolerance_p, 0.0, p_only=True)
+    sparse_time = time.perf_counter() - start
+
+    # Ties can be broken differently, the total cost of the assignment is what both minimise
+    columns = {int(position): k for k, position in enumerate(index.positions)}
+
+    def total_cost(assigned):
+        return sum(_UNASSIGNED_COST if position is None else cost_matrix[event, columns[position]]
+                   for event, position in enumerate(assigned))
+
+    sparse = [p for p, _ in assignments]
+    return {
+        "dense_time": dense_time,
+        "sparse_time": sparse_time,
+        "matched": sum(position is not None for position in sparse),
+        "cost_match": bool(np.isclose(total_cost(sparse), total_cost(dense))),
+    }
+
+
+def synthetic_events_frame(n_events=50000, seed=0):
+    # Lifetime events in the layout of the event store
+    rng = np.random.default_rng(seed)
+    start = UTCDateTime(2021, 1, 1).timestamp
+    times = np.sort(rng.uniform(start, start + 3 * 365 * 86400, n_events))
+    detected = rng.random(n_events) < 0.3
+    p_predicted = times + rng.uniform(10, 600, n_events)
+    p_detected = np.where(detected, p_predicted + rng.normal(0, 2, n_events), np.nan)
+    return pd.DataFrame({
+        "date": [UTCDateTime(t).strftime('%Y-%m-%d') for t in times],
+        "unique_id": [f"{UTCDateTime(t).strftime('%Y-%m-%d')}_{i % 100:02d}" for i, t in enumerate(times)],
+        "provider": "IRIS",
+        "event_id": [f"smi:local/{i}" for i in range(n_events)],
+        "time": [UTCDateTime(t).isoformat() for t in times],
+        "lat": rng.uniform(-90, 90, n_events),
+        "long": rng.uniform(-180, 180, n_events),
+        "mag": rng.uniform(0, 7, n_events),
+        "mag_type": "mb",
+        "depth": rng.uniform(0, 700, n_events),
+        "epi_distance": rng.uniform(0, 10000, n_events),
+        "p_predicted": [UTCDateTime(t).isoformat() for t in p_predicted],
+        "s_predicted": None,
+        "p_detected": [UTCDateTime(t).isoformat() if not np.isnan(t) else None for t in p_detected],
+        "s_detected": None,
+        "p_confidence": np.where(detected, rng.uniform(0, 1, n_events), np.nan),
+        "s_confidence": np.nan,
+        "p_error": None,
+        "s_error": None,
+        "catalogued": True,
+        "detected": detected,
+    })
+
+
+def list_summary(earthquakes):
+    # The list comprehensions html_overall_stats and print_summary used
+    return {
+        "total_detected": len([eq for eq in earthquakes if eq.detected]),
+        "total_catalogued": len([eq for eq in earthquakes if eq.catalogued]),
+        "catalogued_detected": len([eq for eq in earthquakes if eq.catalogued and eq.detected]),
+        "detected_not_catalogued": len([eq for eq in earthquakes if eq.detected and not eq.catalogued]),
+        "p_detected": len([eq for eq in earthquakes if eq.catalogued and eq.p_detected]),
+        "s_detected": len([eq for eq in earthquakes if eq.catalogued and eq.s_detected]),
+    }
+
+
+def compare_earthquake_table(n_events=50000, n_day_events=5000):
+    frame = synthetic_events_frame(n_events)
+    records = frame.replace({np.nan: None}).to_dict('records')
+
+    tracemalloc.start()
+    earthquakes = [Earthquake(**{key: value for key, value in record.items() if key != "date"})
+                   for record in records]
+    list_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    table = EarthquakeTable.from_frame(frame)
+    table_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for eq in earthquakes:
+        eq.update_errors()
+    expected = list_summary(earthquakes)
+    list_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table.update_errors()
+    summary = table.summary()
+    table_time = time.perf_counter() - start
+
+    # The production path: print_summary and html_overall_stats count the day's Earthquake list
+    catalog = Catalog(SimpleNamespace(latitude=0.0, longitude=0.0, report_date=UTCDateTime(2024, 4, 23)),
+                      0, 180, 0, 10, [], travel_time_mode="exact")
+    catalog.all_day_earthquakes = earthquakes[:n_day_events]
+    start = time.perf_counter()
+    day_counts = catalog.print_summary()
+    day_time = time.perf_counter() - start
+    day_expected = list_summary(catalog.all_day_earthquakes)
+
+    # A table built for every summary, as print_summary did before
+    start = time.perf_counter()
+    EarthquakeTable.from_earthquakes(catalog.all_day_earthquakes).summary()
+    day_table_time = time.perf_counter() - start
+
+    return {
+        "list_bytes_per_event": list_memory / n_events,
+        "table_bytes_per_event": table_memory / n_events,
+        "list_summary_time": list_time,
+        "table_summary_time": table_time,
+        "summary_match": summary == expected,
+        "day_events": n_day_events,
+        "day_summary_time": day_time,
+        "day_table_time": day_table_time,
+        "day_summary_match": day_counts == (day_expected["catalogued_detected"],
+                                            day_expected["detected_not_catalogued"]),
+    }
+
+
+# Earthquake as it was before __slots__, with an instance __dict__ and a StreamData made in __init__
+class EagerEarthquake(Earthquake):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._event_stream = StreamData(self)
+
+
+def compare_earthquake_memory(n_detections=5000, seed=0):
+    # One day of unmatched detections, as match_and_merge turns them into Earthquake objects
+    rng = np.random.default_rng(seed)
+    start = UTCDateTime(2024, 4, 23)
+    records = [dict(unique_id=f"{start.strftime('%Y-%m-%d')}_{i:04d}", provider="Detection", event_id="N/A",
+                    time=start + t, lat=None, long=None, mag=None, mag_type=None, depth=None, epi_distance=None,
+                    p_detected=start + t, p_confidence=float(c), catalogued=False, detected=True)
+               for i, (t, c) in enumerate(zip(np.sort(rng.uniform(0, 86400, n_detections)),
+                                              rng.uniform(0.3, 1, n_detections)))]
+
+    memory = {}
+    for name, cls in (("eager", EagerEarthquake), ("slotted", Earthquake)):
+        tracemalloc.start()
+        earthquakes = [cls(**record) for record in records]
+        memory[name] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del earthquakes
+
+    return {
+        "eager_bytes_per_event": memory["eager"] / n_detections,
+        "slotted_bytes_per_event": memory["slotted"] / n_detections,
+        "reduction": 1 - memory["slotted"] / memory["eager"],
+    }
+
+
+def compare_outlier_removal(duration=86400, sampling_rate=100.0, window_size=10, loop_samples=50000):
+    # The per-sample loop only runs on the first loop_samples samples and its time is scaled to the whole day
+    trace = synthetic_stream(duration, sampling_rate)[0]
+    trace.data[::997] *= 50  # Spikes for the filter to find
+
+    start = time.perf_counter()
+    expected = remove_outliers_window(trace.copy().trim(trace.stats.starttime, trace.stats.starttime +
+                                                        (loop_samples - 1) / sampling_rate), window_size).data
+    loop_time = (time.perf_counter() - start) * trace.stats.npts / loop_samples
+
+    start = time.perf_counter()
+    filtered = remove_outliers_rolling(trace.copy(), window_size).data
+    rolling_time = time.perf_counter() - start
+
+    # The first loop_samples samples only see their own data, apart from the last window_size // 2
+    compared = loop_samples - window_size // 2
+    return {
+        "samples": trace.stats.npts,
+        "loop_time_estimate": loop_time,
+        "rolling_time": rolling_time,
+        "replaced": int((filtered != trace.data).sum()),
+        "match": bool(np.array_equal(filtered[:compared], expected[:compared])),
+    }
+
+
+# The preprocessing StreamData.process_stream ran before the pipeline, one ObsPy call per step
+def legacy_preprocess(stream):
+    processed = stream.copy()
+    processed.detrend("demean")
+    processed.detrend("linear")
+    for trace in processed:
+        remove_outliers_threshold(trace)
+        trace.data = bandpass(trace.data, freqmin=1, freqmax=40, df=trace.stats.sampling_rate, corners=5)
+    for trace in processed:
+        trace.taper(max_percentage=0.05, type="hann")
+    return processed
+
+
+def compare_preprocessing(duration=86400, sampling_rate=100.0):
+    stream = synthetic_stream(duration, sampling_rate)
+    stream[0].data[::997] *= 50
+
+    def measure(function):
+        tracemalloc.start()
+        start = time.perf_counter()
+        processed = function(stream)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return processed, elapsed, peak
+
+    expected, legacy_time, legacy_peak = measure(legacy_preprocess)
+    pipeline = PreprocessingPipeline.from_flags()
+    processed, pipeline_time, pipeline_peak = measure(pipeline.run)
+    scale = np.abs(expected[0].data).max()
+    return {
+        "legacy_time": legacy_time,
+        "pipeline_time": pipeline_time,
+        "legacy_peak_mb": legacy_peak / 1e6,
+        "pipeline_peak_mb": pipeline_peak / 1e6,
+        "stage_times": pipeline.timing_summary(),
+        "max_relative_error": float(np.abs(processed[0].data - expected[0].data).max() / scale),
+    }
+
+
+def compare_filter_bank(n_traces=90, duration=600, sampling_rate=100.0):
+    # Short traces, e.g. three channels over a month of event windows, where designing the filter is a large
+    # part of the work
+    rng = np.random.default_rng(0)
+    data = rng.normal(0, 1, (n_traces, int(duration * sampling_rate))).astype(np.float32)
+
+    start = time.perf_counter()
+    expected = np.array([bandpass(row, freqmin=1, freqmax=40, df=sampling_rate, corners=5) for row in data])
+    per_trace_time = time.perf_counter() - start
+
+    bank = FilterBank()
+    start = time.perf_counter()
+    filtered = bank.filter(data.astype(np.float64), sampling_rate)
+    bank_time = time.perf_counter() - start
+    return {
+        "traces": n_traces,
+        "per_trace_time": per_trace_time,
+        "bank_time": bank_time,
+        "designs": len(bank),
+        "match": bool(np.array_equal(filtered, expected)),
+    }
+
+
+def compare_streaming(duration=7200, sampling_rate=100.0, packet_length=5.0):
+    # Feeds the trace in packets, as from a live station, and compares with the pipeline on the whole trace:
+    # exactly for rolling outliers and the bandpass, and after the bandpass settled with the running mean and
+    # trend in front of it (see StreamingPreprocessor)
+    trace = synthetic_stream(duration, sampling_rate)[0]
+    trace.data[::997] *= 50
+    packet = int(packet_length * sampling_rate)
+
+    def stream_packets(stages):
+        preprocessor = StreamingPreprocessor(stages, sampling_rate)
+        output = [preprocessor.process(trace.data[i:i + packet]) for i in range(0, trace.stats.npts, packet)]
+        output.append(preprocessor.flush())
+        return np.concatenate(output), len(output) - 1
+
+    exact_stages = [{"name": "outliers", "method": "rolling"}, "bandpass"]
+    expected = PreprocessingPipeline(exact_stages).run(Stream([trace]))[0].data
+    start = time.perf_counter()
+    streamed, packets = stream_packets(exact_stages)
+    streaming_time = time.perf_counter() - start
+
+    running_stages = ["demean", "linear", "bandpass"]
+    running_expected = PreprocessingPipeline(running_stages).run(Stream([trace]))[0].data
+    running, _ = stream_packets(running_stages)
+    settled = slice(int(0.1 * len(running_expected)), None)
+    return {
+        "packets": packets,
+        "streaming_time": streaming_time,
+        "match": bool(np.array_equal(streamed, expected)),
+        "max_relative_error": float(np.abs(running[settled] - running_expected[settled]).max() /
+                                    np.abs(running_expected[settled]).max()),
+    }
+
+
+def compare_parallel_preprocessing(duration=86400, sampling_rate=100.0, workers=None, outlier_method="rolling"):
+    stream = synthetic_stream(duration, sampling_rate)
+    stream[0].data[::997] *= 50
+    workers = workers or os.cpu_count()
+
+    start = time.perf_counter()
+    expected = PreprocessingPipeline.from_flags(outlier_method=outlier_method).run(stream)
+    serial_time = time.perf_counter() - start
+
+    preprocessor = ParallelPreprocessor(PreprocessingPipeline.from_flags(outlier_method=outlier_method), workers)
+    preprocessor.run(stream)  # Starts the worker processes
+    start = time.perf_counter()
+    processed = preprocessor.run(stream)
+    parallel_time = time.perf_counter() - start
+    return {
+        "workers": workers,
+        "serial_time": serial_time,
+        "parallel_time": parallel_time,
+        "match": all(np.array_equal(a.data, b.data) for a, b in zip(expected, processed)),
+    }
+
+
+if __name__ == '__main__':
+    test_stream = synthetic_stream()
+
+    result = compare_single_pass(test_stream)
+    print(f"Single-pass picking: {result['pick_count']} picks, "
+          f"picks match: {result['picks_match']}, annotations match: {result['annotations_match']}")
+    print(f"Two-pass time: {result['two_pass_time']:.2f}s, single-pass time: {result['single_pass_time']:.2f}s")
+
+    result = compare_travel_times()
+    print(f"Travel times: exact {result['exact_time']:.2f}s, table {result['table_time']:.3f}s, "
+          f"max error {result['max_error']:.2f}s, same phases predicted: {result['existence_match']}")
+    for phase, report in result['accuracy'].items():
+        print(f"{phase} table error on the grid: mean {report['mean_error']:.3f}s, "
+              f"95th percentile {report['p95_error']:.3f}s, max {report['max_error']:.3f}s, "
+              f"{report['fallback']} queries left to TauP, {report['missed']} arrivals missed")
+
+    for n_events, n_picks in ((100, 1000), (300, 5000)):
+        result = compare_matching(n_events, n_picks)
+        print(f"Matching {n_events} events to {n_picks} picks: nested loop {result['legacy_time']:.2f}s, "
+              f"sorted index {result['indexed_time']:.3f}s, assignments match: {result['assignments_match']}, "
+              f"unmatched match: {result['unmatched_match']}")
+
+    result = compare_optimal_matching()
+    print(f"Optimal matching on a dense sequence: dense cost matrix {result['dense_time']:.2f}s, sparse "
+          f"{result['sparse_time']:.2f}s, {result['matched']} events matched, same total cost: {result['cost_match']}")
+
+    result = compare_earthquake_table()
+    print(f"Earthquake list: {result['list_bytes_per_event']:.0f} bytes per event, summary "
+          f"{result['list_summary_time']:.2f}s; EarthquakeTable: {result['table_bytes_per_event']:.0f} bytes per "
+          f"event, summary {result['table_summary_time']:.3f}s; summaries match: {result['summary_match']}")
+    print(f"Summary of a day of {result['day_events']} earthquakes: print_summary {result['day_summary_time']:.4f}s, "
+          f"table built per call {result['day_table_time']:.3f}s; counts match: {result['day_summary_match']}")
+
+    result = compare_earthquake_memory()
+    print(f"Earthquake objects: {result['eager_bytes_per_event']:.0f} bytes per event with an eager StreamData, "
+          f"{result['slotted_bytes_per_event']:.0f} slotted and lazy ({result['reduction']:.0%} less)")
+
+    result = compare_outlier_removal()
+    print(f"Rolling outlier removal on {result['samples']} samples: per-sample loop about "
+          f"{result['loop_time_estimate']:.0f}s, strided {result['rolling_time']:.2f}s, "
+          f"{result['replaced']} samples replaced, results match: {result['match']}")
+
+    result = compare_preprocessing()
+    print(f"Preprocessing a day: ObsPy steps {result['legacy_time']:.2f}s, peak {result['legacy_peak_mb']:.0f} MB; "
+          f"pipeline {result['pipeline_time']:.2f}s, peak {result['pipeline_peak_mb']:.0f} MB "
+          f"({result['stage_times']}); max relative difference {result['max_relative_error']:.1e}")
+
+    result = compare_filter_bank()
+    print(f"Bandpass of {result['traces']} traces: designed per trace {result['per_trace_time']:.2f}s, "
+          f"filter bank {result['bank_time']:.2f}s with {result['designs']} design, results match: {result['match']}")
+
+    result = compare_streaming()
+    print(f"Streaming preprocessing of {result['packets']} packets: {result['streaming_time']:.2f}s, rolling outliers "
+          f"and bandpass match the whole trace: {result['match']}; running mean and trend, max relative "
+          f"difference {result['max_relative_error']:.1e}")
+
+    result = compare_parallel_preprocessing()
+    print(f"Preprocessing a day with rolling outliers: serial {result['serial_time']:.2f}s, "
+          f"{result['workers']} processes {result['parallel_time']:.2f}s, results match: {result['match']}")
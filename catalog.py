@@ -1,26 +1,40 @@
 import os
-import time
 
 import matplotlib.colors as mcolors
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from obspy.clients.fdsn import Client
 from obspy.clients.fdsn.header import FDSNNoDataException, FDSNException
 from obspy.core import UTCDateTime
+from obspy.core.event import Catalog as EventCatalog
 
+from catalog_cache import catalog_cache, event_rows, rows_to_catalog
+from catalog_providers import PROVIDER_TIMEOUT, fetch_events, query_provider
 from earthquake import Earthquake
+from earthquake_table import EarthquakeTable, summarize
+from event_store import EventStore
+from matching import greedy_match, optimal_match, cluster_detections, merge_detections_pairwise
 from report_asset_generation import plot_catalogue
+from travel_times import distances_and_azimuths, predict_arrivals_batch
 
 
 class Catalog:
-    def __init__(self, station, radmin, radmax, minmag, maxmag, catalogue_providers):
+    def __init__(self, station, radmin, radmax, minmag, maxmag, catalogue_providers, rate_limiter=None,
+                 travel_time_mode="table", catalogue_mode="first", provider_timeout=PROVIDER_TIMEOUT,
+                 catalog_cache=catalog_cache):
         self.radmin = radmin
         self.radmax = radmax
         self.minmag = minmag
         self.maxmag = maxmag
         self.catalogue_providers = catalogue_providers
+        self.rate_limiter = rate_limiter
+        self.travel_time_mode = travel_time_mode
+        self.catalogue_mode = catalogue_mode  # 'first' answer with events or 'merge' all providers
+        self.provider_timeout = provider_timeout
+        self.catalog_cache = catalog_cache  # CatalogCache of parsed answers, None to always download
 
         self.station = station
         self.latitude = station.latitude
@@ -30,12 +44,24 @@ class Catalog:
         self.provider = None
         self.event_counter = 1
 
-        self.original_catalog = None
+        self.catalogue_rows = None
+        self._original_catalog = None
         self.original_catalog_earthquakes = []
         self.all_day_earthquakes = []
 
         self.catalog_plot_path = None
 
+    @property
+    def original_catalog(self):
+        # Built from the cached rows when first needed, only the catalogue plot uses it
+        if self._original_catalog is None and self.catalogue_rows is not None:
+            self._original_catalog = rows_to_catalog(self.catalogue_rows)
+        return self._original_catalog
+
+    @original_catalog.setter
+    def original_catalog(self, catalog):
+        self._original_catalog = catalog
+
     def __str__(self):
         if self.all_day_earthquakes and self.provider:
             return f"Catalog retrieved from {self.provider}. {len(self.all_day_earthquakes)} earthquakes found."
@@ -85,54 +111,63 @@ class Catalog:
 
 
     def request_catalogue(self):
+        # True once the providers answered, with events or without; False when no answer could be had
         starttime = self.station.report_date - 30 * 60  # 30 minutes before midnight on the day before
         endtime = self.station.report_date + (24 * 3600) + 30 * 60  # 30 minutes after midnight on the day after
+        query = self.event_query(starttime, endtime)
+
+        key = None
+        if self.catalog_cache:
+            key = self.catalog_cache.make_key(self.catalogue_providers, self.catalogue_mode, query)
+            rows = self.catalog_cache.get(key)
+            if rows is not None:
+                print(f"Catalog loaded from the local cache. Number of events: {len(rows['time'])}.")
+                if rows['time']:
+                    self.load_rows(rows)
+                return True
+
+        # All providers are queried concurrently, see catalog_providers.fetch_events. There is no blind retry:
+        # each provider already had provider_timeout seconds, a failed day is queried again on the next run.
+        results, failed = fetch_events(self.catalogue_providers, query, self.catalogue_mode,
+                                       self.provider_timeout, self.rate_limiter)
+
+        rows = event_rows(results)
+        if key and not failed:
+            # Only complete answers are cached, an answer without events from every provider too. With a
+            # provider missing the answer could still change, so it is downloaded again next time.
+            self.catalog_cache.put(key, endtime, rows)
+
+        if results:
+            self.load_rows(rows)
+            self.original_catalog = EventCatalog(events=[event for _, event in results])
+            if self.catalogue_mode == "merge":
+                print(f"Catalog merged from {self.provider}. Number of events: {len(results)}.")
+            return True
+
+        if not failed:
+            # Every provider answered, there are no events for the day
+            print("No catalogued events for this day.")
+            return True
 
-        attempts = 0
-        while attempts < 2:  # 尝试两次，首次和重试一次
-            for i, provider in enumerate(self.catalogue_providers):
-                try:
-                    client = Client(provider)
-                    catalog = client.get_events(
-                        latitude=self.station.latitude,
-                        longitude=self.station.longitude,
-                        minradius=self.radmin,
-                        maxradius=self.radmax,
-                        starttime=starttime,
-                        endtime=endtime,
-                        minmagnitude=self.minmag,
-                        maxmagnitude=self.maxmag
-                    )
-
-                    if catalog.events:
-                        self.provider = provider
-                        self.original_catalog_earthquakes = self.process_catalogue(catalog.events)
-                        self.original_catalog = catalog
-                        print(f"Catalog downloaded successfully from {provider}.")
-                        return None
-
-                except FDSNNoDataException as e:
-                    next_provider = self.catalogue_providers[i + 1] if i + 1 < len(
-                        self.catalogue_providers) else 'no more providers'
-                    print(f"No data available from {provider}. Trying {next_provider}")
-                except FDSNException as e:
-                    next_provider = self.catalogue_providers[i + 1] if i + 1 < len(
-                        self.catalogue_providers) else 'no more providers'
-                    print(f"Error fetching earthquake data from {provider}. Trying {next_provider}")
-                except Exception as e:
-                    next_provider = self.catalogue_providers[i + 1] if i + 1 < len(
-                        self.catalogue_providers) else 'no more providers'
-                    print(f"Unexpected error occurred when connecting to {provider}. Trying {next_provider}")
-
-            if attempts == 0:
-                print("Failed to retrieve earthquake data on first attempt. Retrying in 60 seconds...")
-                time.sleep(60)  # 休眠 60 秒后重试
-            attempts += 1
-
-        print("Failed to retrieve earthquake data from all provided catalog sources after retry.")
-        return None
+        print("Failed to retrieve earthquake data from all provided catalog sources.")
+        return False
+
+    def load_rows(self, rows):
+        # Use a catalogue given as rows of event_rows, downloaded or from the cache
+        self.provider = ", ".join(p for p in self.catalogue_providers if p in set(rows['provider']))
+        self.catalogue_rows = rows
+        self.original_catalog = None
+        self.original_catalog_earthquakes = self.process_catalogue_rows(rows)
 
-    def request_recent_catalogue(self, query_duration):
+    def event_query(self, starttime, endtime):
+        # get_events parameters of this catalogue for a time window
+        return dict(latitude=self.station.latitude, longitude=self.station.longitude, minradius=self.radmin,
+                    maxradius=self.radmax, starttime=starttime, endtime=endtime, minmagnitude=self.minmag,
+                    maxmagnitude=self.maxmag)
+
+    def request_recent_catalogue(self, query_duration, providers=None, updated_after=None):
+        # Events of the first provider with any in the last query_duration minutes. updated_after only asks
+        # for events created or changed since then, see CatalogPoller.
         endtime = UTCDateTime()  # Now
         starttime = endtime - query_duration * 60  # query_duration minutes ago
 
@@ -140,29 +175,17 @@ class Catalog:
 
         print(f"Querying from {starttime} to {endtime}")
 
-        for provider in self.catalogue_providers:
+        for provider in providers or self.catalogue_providers:
             try:
-                client = Client(provider)
-                latest_catalog = client.get_events(
-                    latitude=self.station.latitude,
-                    longitude=self.station.longitude,
-                    minradius=self.radmin,
-                    maxradius=self.radmax,
-                    starttime=starttime,
-                    endtime=endtime,
-                    minmagnitude=self.minmag,
-                    maxmagnitude=self.maxmag
-                )
+                events = query_provider(provider, self.event_query(starttime, endtime), self.provider_timeout,
+                                        self.rate_limiter, updated_after)
 
-                if latest_catalog.events:
+                if events:
                     self.provider = provider
-                    latest_earthquake = self.process_catalogue(latest_catalog.events)
-                    print(
-                        f"Catalog downloaded successfully from {self.provider}. Number of events: {len(latest_catalog.events)}.")
+                    latest_earthquake = self.process_catalogue(events)
+                    print(f"Catalog downloaded successfully from {self.provider}. Number of events: {len(events)}.")
                     return latest_earthquake
 
-            except FDSNNoDataException:
-                continue  # Skip to the next provider
             except FDSNException as e:
                 print(f"Error fetching earthquake data from {provider}. {str(e)}")
                 continue  # Skip to the next provider
@@ -178,23 +201,20 @@ class Catalog:
         self.event_counter += 1  # Increment the counter for the next event
         return unique_id
 
-    def process_catalogue(self, events):
+    def process_catalogue(self, events, providers=None):
+        # providers: the provider of each event when the catalogue was merged from several
         if not events:
             print("No events to process.")
             return []
+        return self.process_catalogue_rows(event_rows(zip(providers or [self.provider] * len(events), events)))
 
+    def process_catalogue_rows(self, rows):
         earthquakes = []
 
-        for event in events:
+        for i in range(len(rows['time'])):
             # Extract event information
-            event_id = str(event.resource_id)
-            event_time = event.origins[0].time
+            event_time = UTCDateTime(rows['time'][i])
             event_date = event_time.strftime("%Y-%m-%d")
-            event_latitude = event.origins[0].latitude
-            event_longitude = event.origins[0].longitude
-            event_magnitude = event.magnitudes[0].mag
-            event_mag_type = event.magnitudes[0].magnitude_type.lower()
-            event_depth = event.origins[0].depth / 1000  # Convert depth to kilometers if needed
 
             # Generate a unique ID using the new function
             unique_id = self.generate_unique_id(event_date)
@@ -202,78 +222,109 @@ class Catalog:
             # Create an Earthquake object
             earthquake = Earthquake(
                 unique_id=unique_id,
-                provider=self.provider,
-                event_id=event_id,
+                provider=rows['provider'][i],
+                event_id=rows['event_id'][i],
                 time=event_time.isoformat(),
-                lat=event_latitude,
-                long=event_longitude,
-                mag=event_magnitude,
-                mag_type=event_mag_type,
-                depth=event_depth,
+                lat=rows['latitude'][i],
+                long=rows['longitude'][i],
+                mag=rows['mag'][i],
+                mag_type=rows['mag_type'][i].lower(),
+                depth=rows['depth'][i] / 1000,  # Convert depth to kilometers if needed
                 epi_distance=None,
                 catalogued=True,
                 detected=False
             )
 
-            # Update predicted arrivals
-            earthquake.update_predicted_arrivals(self.station.latitude, self.station.longitude)
-
-            # Update epicentral distance
-            earthquake.update_distance(self.station.latitude, self.station.longitude)
-
             # Append the earthquake object to the list
             earthquakes.append(earthquake)
 
-        return earthquakes
+        # Epicentral distances and azimuths for all events at once
+        self.update_distances(earthquakes)
 
-    def match_and_merge(self, detections, tolerance_p, tolerance_s, p_only=False):
+        # Predict arrivals for all events at once from the travel time table
+        p_arrivals, s_arrivals = predict_arrivals_batch(
+            [eq.lat for eq in earthquakes], [eq.long for eq in earthquakes], [eq.depth for eq in earthquakes],
+            [eq.time for eq in earthquakes], self.station.latitude, self.station.longitude,
+            mode=self.travel_time_mode)
+        for earthquake, p_arrival, s_arrival in zip(earthquakes, p_arrivals, s_arrivals):
+            earthquake.p_predicted = p_arrival
+            earthquake.s_predicted = s_arrival
 
-        self.all_day_earthquakes = []
+        return earthquakes
 
-        event_counter = len(self.original_catalog_earthquakes) + 1  # Start counter for the new unique IDs
+    def update_distances(self, earthquakes=None):
+        # Epicentral distance in km and azimuth from the station, in one pass over the whole catalogue
+        earthquakes = self.all_day_earthquakes if earthquakes is None else earthquakes
+        if not earthquakes:
+            return
+        lats = np.array([np.nan if eq.lat is None else eq.lat for eq in earthquakes], dtype=float)
+        longs = np.array([np.nan if eq.long is None else eq.long for eq in earthquakes], dtype=float)
+        distances, azimuths = distances_and_azimuths(lats, longs, self.station.latitude, self.station.longitude)
+        distances *= 111.195  # Convert to km
+
+        for earthquake, distance, azimuth in zip(earthquakes, distances.tolist(), azimuths.tolist()):
+            earthquake.epi_distance = None if np.isnan(distance) else distance
+            earthquake.azimuth = None if np.isnan(azimuth) else azimuth
+
+    def update_errors(self, earthquakes=None):
+        # Numeric P and S residuals (detected - predicted, seconds) for all events, None where a time is missing
+        earthquakes = self.all_day_earthquakes if earthquakes is None else earthquakes
+        if not earthquakes:
+            return
+        residuals = {}
+        for phase in ("p", "s"):
+            predicted = [getattr(eq, f"{phase}_predicted") for eq in earthquakes]
+            detected = [getattr(eq, f"{phase}_detected") for eq in earthquakes]
+            known = np.array([bool(p and d) for p, d in zip(predicted, detected)])
+            # Integer nanoseconds, so the residuals equal the UTCDateTime differences
+            predicted_ns = np.array([UTCDateTime(p)._ns if k else 0 for p, k in zip(predicted, known)], dtype=np.int64)
+            detected_ns = np.array([UTCDateTime(d)._ns if k else 0 for d, k in zip(detected, known)], dtype=np.int64)
+            residuals[phase] = np.where(known, (detected_ns - predicted_ns) / 1e9, np.nan).tolist()
+
+        for earthquake, p_error, s_error in zip(earthquakes, residuals["p"], residuals["s"]):
+            earthquake.p_error = None if np.isnan(p_error) else p_error
+            earthquake.s_error = None if np.isnan(s_error) else s_error
+
+    def match_catalogued(self, detections, tolerance_p, tolerance_s, p_only=False, assignment_mode="greedy"):
+        # Give each catalogued earthquake a P and S detection within tolerance and return the detections left
+        # unmatched. "greedy" takes the most confident detection in catalogue order, "optimal" assigns all
+        # detections of the day at once.
+        if assignment_mode == "greedy":
+            match = greedy_match
+        elif assignment_mode == "optimal":
+            match = optimal_match
+        else:
+            raise ValueError(f"Unknown assignment mode: {assignment_mode}")
 
-        for earthquake in self.original_catalog_earthquakes:
-            highest_p_confidence = 0
-            highest_s_confidence = 0
-            best_p_detection = None
-            best_s_detection = None
-
-            for detection in detections:
-                detected_time = UTCDateTime(detection['peak_time'])
-                detected_phase = detection['phase']
-                detected_confidence = detection['peak_confidence']
-
-                if detected_phase == 'P' and earthquake.p_predicted and abs(
-                        detected_time - UTCDateTime(earthquake.p_predicted)) <= tolerance_p:
-                    if detected_confidence > highest_p_confidence:
-                        highest_p_confidence = detected_confidence
-                        best_p_detection = detection['peak_time']
-
-                if not p_only and detected_phase == 'S' and earthquake.s_predicted and abs(
-                        detected_time - UTCDateTime(earthquake.s_predicted)) <= tolerance_s:
-                    if detected_confidence > highest_s_confidence:
-                        highest_s_confidence = detected_confidence
-                        best_s_detection = detection['peak_time']
+        earthquakes = self.original_catalog_earthquakes
+        assignments, unmatched = match([eq.p_predicted for eq in earthquakes], [eq.s_predicted for eq in earthquakes],
+                                       detections, tolerance_p, tolerance_s, p_only)
 
+        for earthquake, (best_p, best_s) in zip(earthquakes, assignments):
             # Update earthquake with the best detected times and confidences
-            if best_p_detection:
-                earthquake.p_detected = best_p_detection
-                earthquake.p_confidence = highest_p_confidence
+            if best_p is not None:
+                earthquake.p_detected = detections[best_p]['peak_time']
+                earthquake.p_confidence = detections[best_p]['peak_confidence']
                 earthquake.detected = True
 
-            if not p_only and best_s_detection:
-                earthquake.s_detected = best_s_detection
-                earthquake.s_confidence = highest_s_confidence
+            if best_s is not None:
+                earthquake.s_detected = detections[best_s]['peak_time']
+                earthquake.s_confidence = detections[best_s]['peak_confidence']
                 earthquake.detected = True
 
-            # Filter out the matched detections to avoid re-matching
-            detections = [d for d in detections if
-                          not (d['peak_time'] == best_p_detection or (
-                                  not p_only and d['peak_time'] == best_s_detection))]
-
             # 将处理过的地震对象添加到 all_day_earthquakes
             self.all_day_earthquakes.append(earthquake)
 
+        return [detections[i] for i in unmatched]
+
+    def match_and_merge(self, detections, tolerance_p, tolerance_s, p_only=False, assignment_mode="greedy"):
+
+        self.all_day_earthquakes = []
+
+        event_counter = len(self.original_catalog_earthquakes) + 1  # Start counter for the new unique IDs
+
+        detections = self.match_catalogued(detections, tolerance_p, tolerance_s, p_only, assignment_mode)
+
         # Add unmatched detections as new earthquake objects
         for detection in detections:
             unique_id = f"{self.station.report_date.strftime('%Y-%m-%d')}_{event_counter:02d}"
@@ -306,70 +357,22 @@ class Catalog:
 
         return self.all_day_earthquakes
 
-    def match_and_merge2(self, detections, tolerance_p, tolerance_s, p_only=False, detected_merging_threshold=3.0):
+    def match_and_merge2(self, detections, tolerance_p, tolerance_s, p_only=False, detected_merging_threshold=3.0,
+                         merge_strategy="sweep", assignment_mode="greedy"):
 
         self.all_day_earthquakes = []
 
         event_counter = len(self.original_catalog_earthquakes) + 1  # Start counter for the new unique IDs
 
-        for earthquake in self.original_catalog_earthquakes:
-            highest_p_confidence = 0
-            highest_s_confidence = 0
-            best_p_detection = None
-            best_s_detection = None
-
-            for detection in detections:
-                detected_time = UTCDateTime(detection['peak_time'])
-                detected_phase = detection['phase']
-                detected_confidence = detection['peak_confidence']
-
-                if detected_phase == 'P' and earthquake.p_predicted and abs(
-                        detected_time - UTCDateTime(earthquake.p_predicted)) <= tolerance_p:
-                    if detected_confidence > highest_p_confidence:
-                        highest_p_confidence = detected_confidence
-                        best_p_detection = detection['peak_time']
-
-                if not p_only and detected_phase == 'S' and earthquake.s_predicted and abs(
-                        detected_time - UTCDateTime(earthquake.s_predicted)) <= tolerance_s:
-                    if detected_confidence > highest_s_confidence:
-                        highest_s_confidence = detected_confidence
-                        best_s_detection = detection['peak_time']
-
-            # Update earthquake with the best detected times and confidences
-            if best_p_detection:
-                earthquake.p_detected = best_p_detection
-                earthquake.p_confidence = highest_p_confidence
-                earthquake.detected = True
-
-            if not p_only and best_s_detection:
-                earthquake.s_detected = best_s_detection
-                earthquake.s_confidence = highest_s_confidence
-                earthquake.detected = True
-
-            # Filter out the matched detections to avoid re-matching
-            detections = [d for d in detections if
-                          not (d['peak_time'] == best_p_detection or (
-                                  not p_only and d['peak_time'] == best_s_detection))]
-
-            # 将处理过的地震对象添加到 all_day_earthquakes
-            self.all_day_earthquakes.append(earthquake)
+        detections = self.match_catalogued(detections, tolerance_p, tolerance_s, p_only, assignment_mode)
 
         # Merge unmatched detections before adding them as new earthquake objects
-        merged_detections = []
-        for detection in detections:
-            merged = False
-            for merged_detection in merged_detections:
-                if (abs(UTCDateTime(detection['peak_time']) - UTCDateTime(merged_detection['peak_time'])) <= detected_merging_threshold and
-                        detection['phase'] == merged_detection['phase']):
-                    # Merge the detections
-                    merged_detection['peak_time'] = min(UTCDateTime(detection['peak_time']),
-                                                        UTCDateTime(merged_detection['peak_time'])).isoformat()
-                    merged_detection['peak_confidence'] = max(detection['peak_confidence'],
-                                                              merged_detection['peak_confidence'])
-                    merged = True
-                    break
-            if not merged:
-                merged_detections.append(detection)
+        if merge_strategy == "sweep":
+            merged_detections = cluster_detections(detections, detected_merging_threshold)
+        elif merge_strategy == "pairwise":
+            merged_detections = merge_detections_pairwise(detections, detected_merging_threshold)
+        else:
+            raise ValueError(f"Unknown merge strategy: {merge_strategy}")
 
         # Add the merged detections as new earthquake objects
         for detection in merged_detections:
@@ -451,64 +454,25 @@ class Catalog:
         daily_filename = f"{date_str}.processed_events.csv"
         daily_full_path = os.path.join(path, daily_filename)
 
-        # 定义CSV文件的表头
-        headers = ["date", "unique_id", "provider", "event_id", "time", "lat", "long", "mag", "mag_type",
-                   "depth", "epi_distance", "p_predicted", "s_predicted", "p_detected", "s_detected",
-                   "p_confidence", "s_confidence", "p_error", "s_error", "catalogued", "detected"]
-
         # 创建新数据的DataFrame
-        new_data = pd.DataFrame([{
-            "date": date_str,  # 直接使用符合格式的 date_str
-            "unique_id": eq.unique_id,
-            "provider": eq.provider,
-            "event_id": eq.event_id,
-            "time": eq.time.isoformat(),
-            "lat": eq.lat,
-            "long": eq.long,
-            "mag": eq.mag,
-            "mag_type": eq.mag_type,
-            "depth": eq.depth,
-            "epi_distance": eq.epi_distance,
-            "p_predicted": eq.p_predicted.isoformat() if eq.p_predicted else None,
-            "s_predicted": eq.s_predicted.isoformat() if eq.s_predicted else None,
-            "p_detected": eq.p_detected.isoformat() if eq.p_detected else None,
-            "s_detected": eq.s_detected.isoformat() if eq.s_detected else None,
-            "p_confidence": eq.p_confidence,
-            "s_confidence": eq.s_confidence,
-            "p_error": eq.p_error,
-            "s_error": eq.s_error,
-            "catalogued": eq.catalogued,
-            "detected": eq.detected
-        } for eq in self.all_day_earthquakes], columns=headers)
+        new_data = self.earthquake_table().to_frame(date_str)
 
         # 写入每日数据
         new_data.to_csv(daily_full_path, index=False)
 
-        # 总结文件的路径
-        total_file_path = os.path.join(self.station.station_folder, "total_events_summary.csv")
-
-        # 读取现有数据
-        if os.path.exists(total_file_path):
-            existing_data = pd.read_csv(total_file_path)
-            # 删除相同日期的旧记录
-            existing_data = existing_data[existing_data['date'] != new_data['date'].iloc[0]]
-        else:
-            existing_data = pd.DataFrame(columns=headers)
-
-        # 将新数据添加到现有数据
-        updated_data = pd.concat([existing_data, new_data], ignore_index=True)
-        updated_data.to_csv(total_file_path, index=False)
+        # 更新该站点的事件库，只替换当天的记录
+        EventStore(self.station.station_folder).upsert_day(date_str, new_data)
 
         print(f"Daily list saved to {daily_full_path}")
-        print(f"Total summary updated in {total_file_path}")
+        print(f"Total summary updated in {self.station.station_folder}")
 
-    def print_summary(self):
-        total_catalogued = len([eq for eq in self.all_day_earthquakes if eq.catalogued])
-        detected_catalogued = len([eq for eq in self.all_day_earthquakes if eq.catalogued and eq.detected])
-        detected_not_catalogued_count = len(
-            [eq for eq in self.all_day_earthquakes if eq.detected and not eq.catalogued])
+    def earthquake_table(self):
+        # Column view of the day's earthquakes for counts and filters
+        return EarthquakeTable.from_earthquakes(self.all_day_earthquakes)
 
-        return detected_catalogued, detected_not_catalogued_count
+    def print_summary(self):
+        summary = summarize(self.all_day_earthquakes)
+        return summary["catalogued_detected"], summary["detected_not_catalogued"]
 
     def generate_catalogue_plot(self, station, fill_map=True, create_gif=True):
         self.catalog_plot_path = plot_catalogue(station, self, fill_map, create_gif)
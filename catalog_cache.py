@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from obspy import UTCDateTime
+from obspy.core.event import Catalog as EventCatalog, Event, Magnitude, Origin, ResourceIdentifier
+
+# Catalogues of recent days still change as providers review events, so they are refetched after this many
+# seconds. Once the whole query window is older than the settle period a fetched catalogue is kept for good.
+CATALOG_CACHE_TTL = 3600
+CATALOG_SETTLE_DAYS = 7
+
+# Columns of the cached catalogues, one list per column
+ROW_COLUMNS = ["provider", "event_id", "time", "latitude", "longitude", "depth", "mag", "mag_type"]
+
+
+def event_rows(results):
+    # The fields process_catalogue uses from (provider, event) pairs, by column. Depth stays in metres.
+    rows = {column: [] for column in ROW_COLUMNS}
+    for provider, event in results:
+        origin = event.origins[0]
+        magnitude = event.magnitudes[0]
+        rows["provider"].append(provider)
+        rows["event_id"].append(str(event.resource_id))
+        rows["time"].append(origin.time.isoformat())
+        rows["latitude"].append(origin.latitude)
+        rows["longitude"].append(origin.longitude)
+        rows["depth"].append(origin.depth)
+        rows["mag"].append(magnitude.mag)
+        rows["mag_type"].append(magnitude.magnitude_type)
+    return rows
+
+
+def rows_to_catalog(rows):
+    # ObsPy catalogue with the cached fields only, for plotting
+    events = []
+    for i in range(len(rows["time"])):
+        event = Event(resource_id=ResourceIdentifier(rows["event_id"][i]))
+        event.origins.append(Origin(time=UTCDateTime(rows["time"][i]), latitude=rows["latitude"][i],
+                                    longitude=rows["longitude"][i], depth=rows["depth"][i]))
+        event.magnitudes.append(Magnitude(mag=rows["mag"][i], magnitude_type=rows["mag_type"][i]))
+        events.append(event)
+    return EventCatalog(events=events)
+
+
+# Parsed catalogue answers on disk, one file per query, so re-running a past date does not download and
+# parse the QuakeML again
+class CatalogCache:
+    def __init__(self, path=None, ttl=CATALOG_CACHE_TTL, settle_days=CATALOG_SETTLE_DAYS):
+        self._path = path
+        self.ttl = ttl
+        self.settle_days = settle_days
+
+    @property
+    def path(self):
+        # Resolved on use, like the station folders, so it follows the working directory
+        return self._path or os.path.join(os.getcwd(), "data", "catalog_cache")
+
+    @staticmethod
+    def make_key(providers, mode, query):
+        parameters = {key: str(value) if isinstance(value, UTCDateTime) else value for key, value in query.items()}
+        return json.dumps({"providers": list(providers), "mode": mode, "query": parameters}, sort_keys=True)
+
+    def file_path(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def is_fresh(self, entry):
+        # Fetched after the window settled: valid for good. Otherwise only within the TTL.
+        settled_at = UTCDateTime(entry["endtime"]).timestamp + self.settle_days * 86400
+        return entry["fetched_at"] >= settled_at or time.time() - entry["fetched_at"] <= self.ttl
+
+    def get(self, key):
+        # Cached rows of the query, None when missing or stale
+        path = self.file_path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'r') as file:
+                entry = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable catalog cache entry {path}: {e}")
+            return None
+        if entry.get("key") != key or not self.is_fresh(entry):
+            return None
+        return entry["rows"]
+
+    def put(self, key, endtime, rows):
+        os.makedirs(self.path, exist_ok=True)
+        path = self.file_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({"key": key, "endtime": str(endtime), "fetched_at": time.time(), "rows": rows}, file)
+        os.replace(temp_path, path)
+
+
+catalog_cache = CatalogCache()
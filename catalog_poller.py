@@ -0,0 +1,129 @@
+import queue
+import threading
+import time
+
+from obspy import UTCDateTime
+
+from catalog_providers import deduplicate_events, get_client, query_provider
+
+# Polls start at this many seconds apart, slower providers are polled less often
+POLL_INTERVAL = 60
+MAX_POLL_INTERVAL = 600
+# A provider is polled no more often than this many times its smoothed response time
+LATENCY_FACTOR = 10
+# Overlap of successive updatedafter windows, for clock differences with the provider
+HIGH_WATER_OVERLAP = 60
+
+
+# Long-running version of Catalog.request_recent_catalogue for monitoring. Every provider is polled in its own
+# thread; after the first poll only events created or updated since the provider's high-water mark are
+# requested where the provider supports updatedafter, otherwise the look-back window is queried again. Events
+# are recognised by event id and put on the queue as Earthquake objects when new, and again when their origin
+# or magnitude changed, for the waveform download to pick up. An event another provider already reported, by
+# deduplicate_events, is not put on the queue again. Events are forgotten once their origin leaves the
+# look-back window.
+class CatalogPoller:
+    def __init__(self, catalog, look_back=60, interval=POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL, events=None):
+        self.catalog = catalog
+        self.look_back = look_back  # Minutes, like query_duration of request_recent_catalogue
+        self.interval = interval
+        self.max_interval = max_interval
+        self.events = events if events is not None else queue.Queue()
+
+        self.high_water = {}  # Provider -> start of its last successful poll
+        self.latency = {}  # Provider -> smoothed response time in seconds
+        self.seen = {}  # Event id -> (origin and magnitude last put on the queue, provider, event)
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @staticmethod
+    def version(event):
+        origin = event.origins[0]
+        return str(origin.time), origin.latitude, origin.longitude, origin.depth, event.magnitudes[0].mag
+
+    def poll(self, provider):
+        # One request to the provider, returns the number of events put on the queue
+        started = UTCDateTime()
+        updated_after = self.high_water.get(provider)
+        if updated_after is not None:
+            updated_after = updated_after - HIGH_WATER_OVERLAP
+        query = self.catalog.event_query(started - self.look_back * 60, started)
+
+        get_client(provider, self.catalog.provider_timeout)  # Service discovery does not count as latency
+        request_start = time.monotonic()
+        events = query_provider(provider, query, self.catalog.provider_timeout, self.catalog.rate_limiter,
+                                updated_after)
+        latency = time.monotonic() - request_start
+        previous = self.latency.get(provider)
+        self.latency[provider] = latency if previous is None else 0.7 * previous + 0.3 * latency
+
+        with self._lock:
+            # Events whose origin left the look-back window are no longer asked for
+            window_start = started - self.look_back * 60
+            for event_id in [event_id for event_id, (_, _, event) in self.seen.items()
+                             if event.origins[0].time < window_start]:
+                del self.seen[event_id]
+
+            changed = []
+            for event in events:
+                if not event.origins or not event.magnitudes:
+                    continue  # process_catalogue needs both
+                event_id = str(event.resource_id)
+                if event_id not in self.seen or self.seen[event_id][0] != self.version(event):
+                    changed.append(event)
+
+            # Reports of an earthquake another provider already put on the queue are dropped. Each event is
+            # checked on its own, close events of one provider are separate earthquakes.
+            others = [event for _, seen_provider, event in self.seen.values() if seen_provider != provider]
+            if others:
+                changed = [event for event in changed
+                           if any(kept_provider == provider for kept_provider, _ in
+                                  deduplicate_events([(None, others), (provider, [event])]))]
+
+            earthquakes = self.catalog.process_catalogue(changed, [provider] * len(changed)) if changed else []
+            # Only once the events made it into Earthquake objects, a failed poll asks for them again
+            for event in changed:
+                self.seen[str(event.resource_id)] = (self.version(event), provider, event)
+            self.high_water[provider] = started
+        for earthquake in earthquakes:
+            self.events.put(earthquake)
+        return len(earthquakes)
+
+    def next_interval(self, provider):
+        return min(max(self.interval, LATENCY_FACTOR * self.latency.get(provider, 0.0)), self.max_interval)
+
+    def run_provider(self, provider):
+        delay = 0
+        failures = 0
+        while not self._stop.wait(delay):
+            try:
+                count = self.poll(provider)
+                failures = 0
+                delay = self.next_interval(provider)
+                if count:
+                    print(f"{count} new or updated events from {provider}.")
+            except Exception as e:
+                # Back off from a provider that keeps failing
+                failures += 1
+                delay = min(self.interval * 2 ** failures, self.max_interval)
+                print(f"Error polling {provider}: {e}. Next attempt in {delay:.0f} seconds.")
+
+    def start(self):
+        if self._threads:
+            return self
+        self._stop.clear()
+        for provider in self.catalog.catalogue_providers:
+            thread = threading.Thread(target=self.run_provider, args=(provider,), name=f"poller-{provider}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
@@ -0,0 +1,130 @@
+import bisect
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from obspy.clients.fdsn import Client
+from obspy.clients.fdsn.header import FDSNNoDataException
+from obspy.geodetics import gps2dist_azimuth
+
+# Seconds allowed to each provider, for the service discovery and the event query
+PROVIDER_TIMEOUT = 60
+# Reports of one earthquake by different providers have origins at least this close
+DUPLICATE_TIME_TOLERANCE = 16.0
+DUPLICATE_DISTANCE_KM = 100.0
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(provider, timeout=PROVIDER_TIMEOUT):
+    # Creating a Client queries the provider for its services, so keep one per provider and timeout
+    key = (provider, timeout)
+    with _clients_lock:
+        client = _clients.get(key)
+    if client is None:
+        client = Client(provider, timeout=timeout)
+        with _clients_lock:
+            _clients[key] = client
+    return client
+
+
+def supports_updated_after(provider, timeout=PROVIDER_TIMEOUT):
+    return "updatedafter" in get_client(provider, timeout).services.get("event", {})
+
+
+def query_provider(provider, query, timeout=PROVIDER_TIMEOUT, rate_limiter=None, updated_after=None):
+    # Events of one provider, an empty list when it has none for the query. updated_after limits the answer to
+    # events created or changed since then, on providers whose event service supports it.
+    if rate_limiter:
+        rate_limiter.wait(provider)
+    client = get_client(provider, timeout)
+    if updated_after is not None and supports_updated_after(provider, timeout):
+        query = dict(query, updatedafter=updated_after)
+    try:
+        return list(client.get_events(**query).events)
+    except FDSNNoDataException:
+        print(f"No data available from {provider}.")
+        return []
+
+
+def _origin(event):
+    # The origin process_catalogue uses
+    return event.origins[0] if event.origins else None
+
+
+def deduplicate_events(results, time_tolerance=DUPLICATE_TIME_TOLERANCE, distance_km=DUPLICATE_DISTANCE_KM):
+    # results: (provider, events) pairs in order of preference. An event is dropped when a preferred provider
+    # already reported an origin within time_tolerance seconds and distance_km of it, events without an
+    # origin are dropped. Returns (provider, event) pairs sorted by origin time.
+    kept_times = []
+    kept = []
+    for provider, events in results:
+        for event in events:
+            origin = _origin(event)
+            if origin is None:
+                continue
+            timestamp = origin.time.timestamp
+            lo = bisect.bisect_left(kept_times, timestamp - time_tolerance)
+            hi = bisect.bisect_right(kept_times, timestamp + time_tolerance)
+            duplicate = any(
+                gps2dist_azimuth(origin.latitude, origin.longitude, other.latitude, other.longitude)[0] / 1000.0
+                <= distance_km for other in (_origin(kept[k][1]) for k in range(lo, hi)))
+            if not duplicate:
+                k = bisect.bisect_right(kept_times, timestamp)
+                kept_times.insert(k, timestamp)
+                kept.insert(k, (provider, event))
+    return kept
+
+
+# Query all providers at once. In "first" mode the first provider to answer with events wins and the others
+# are abandoned; in "merge" mode the answers of every provider are combined without duplicate events.
+# Returns (provider, event) pairs and the providers that failed or did not answer within timeout.
+# Abandoned queries cannot be interrupted: the executor is shut down with wait=False, so their threads finish in
+# the background and the answers are dropped. Each of them is capped by the timeout of its provider's Client,
+# the same timeout seconds, so a slow provider holds at most a thread and a connection for that long.
+def fetch_events(providers, query, mode="first", timeout=PROVIDER_TIMEOUT, rate_limiter=None):
+    if mode not in ("first", "merge"):
+        raise ValueError(f"Unknown catalogue mode: {mode}")
+    if not providers:
+        return [], []
+
+    executor = ThreadPoolExecutor(max_workers=len(providers))
+    futures = {executor.submit(query_provider, provider, query, timeout, rate_limiter): provider
+               for provider in providers}
+    answers = {}
+    failed = []
+    deadline = time.monotonic() + timeout
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+
+            # Providers finishing together are taken in the configured order
+            for future in sorted(done, key=lambda f: providers.index(futures[f])):
+                provider = futures[future]
+                try:
+                    answers[provider] = future.result()
+                except Exception as e:
+                    print(f"Error fetching earthquake data from {provider}: {e}")
+                    failed.append(provider)
+                    continue
+
+                if mode == "first" and answers[provider]:
+                    print(f"Catalog downloaded successfully from {provider}.")
+                    return [(provider, event) for event in answers[provider]], failed
+
+        for future in pending:
+            print(f"No answer from {futures[future]} within {timeout} seconds.")
+            failed.append(futures[future])
+    finally:
+        # Queries still running are left to finish in the background within their Client timeout
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if mode == "first":
+        return [], failed
+    results = [(provider, answers[provider]) for provider in providers if answers.get(provider)]
+    return deduplicate_events(results), failed
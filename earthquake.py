@@ -5,41 +5,28 @@ from obspy import UTCDateTime
 from obspy.clients.fdsn import Client
 from obspy.geodetics import gps2dist_azimuth
 from obspy.geodetics.base import locations2degrees
-from obspy.taup import TauPyModel
 
 from stream import StreamData
+from travel_times import exact_travel_times
 
 
 def calculate_time_error(predicted, detected):
+    # Residual detected - predicted in seconds, None when either time is missing. Formatted for display by
+    # report_asset_generation.format_time_error.
     if not predicted or not detected:
-        return 'N/A'
-    try:
-        predicted_dt = UTCDateTime(predicted)
-        detected_dt = UTCDateTime(detected)
-
-        # Calculate the time difference in seconds
-        delta = detected_dt - predicted_dt
-        sign = '+' if delta > 0 else '-' if delta < 0 else ''
-
-        return f"{sign}{abs(delta):.2f}s"
-    except Exception as e:
-        return f"Error: {str(e)}"
+        return None
+    return UTCDateTime(detected) - UTCDateTime(predicted)
 
 
 def predict_arrivals(lat, long, depth, time, station_latitude, station_longitude):
-    model = TauPyModel(model="iasp91")
     distance_deg = gps2dist_azimuth(lat, long, station_latitude, station_longitude)[
                        0] / 1000.0 / 111.195  # Convert meters to degrees
 
-    arrivals = model.get_ray_paths(source_depth_in_km=depth / 1000.0, distance_in_degree=distance_deg,
-                                   phase_list=["P", "S"])
+    # Exact TauP calculation with the model kept for the whole process
+    p_time, s_time = exact_travel_times(distance_deg, depth / 1000.0)
 
-    p_arrival, s_arrival = None, None
-    for arrival in arrivals:
-        if arrival.name == "P":
-            p_arrival = time + arrival.time
-        elif arrival.name == "S":
-            s_arrival = time + arrival.time
+    p_arrival = time + p_time if p_time is not None else None
+    s_arrival = time + s_time if s_time is not None else None
 
     return p_arrival, s_arrival
 
@@ -223,9 +210,16 @@ def plot_detected_p_only(stream, annotated_stream, earthquake, path=None, simpli
 
 
 class Earthquake:
+    # A day can hold thousands of detections, so instances carry no __dict__
+    __slots__ = ("unique_id", "provider", "event_id", "time", "lat", "long", "mag", "mag_type", "depth",
+                 "epi_distance", "p_predicted", "s_predicted", "p_detected", "s_detected", "p_confidence",
+                 "s_confidence", "p_error", "s_error", "catalogued", "detected", "azimuth", "plot_path",
+                 "_event_stream")
+
     def __init__(self, unique_id, provider, event_id, time, lat, long, mag, mag_type, depth, epi_distance,
                  p_predicted=None, s_predicted=None, p_detected=None, s_detected=None,
-                 p_confidence=None, s_confidence=None, p_error=None, s_error=None, catalogued=True, detected=False):
+                 p_confidence=None, s_confidence=None, p_error=None, s_error=None, catalogued=True, detected=False,
+                 azimuth=None):
 
         self.unique_id = unique_id
         self.provider = provider
@@ -247,9 +241,17 @@ class Earthquake:
         self.s_error = float(s_error) if s_error is not None else None
         self.catalogued = catalogued
         self.detected = detected
+        self.azimuth = float(azimuth) if azimuth is not None else None  # From the station, degrees
         self.plot_path = None
 
-        self.event_stream = StreamData(self)  # Create a StreamData object for this earthquake
+        self._event_stream = None  # StreamData for this earthquake, created on first use
+
+    @property
+    def event_stream(self):
+        # Only monitoring mode downloads event streams, so most earthquakes never need one
+        if self._event_stream is None:
+            self._event_stream = StreamData(self)
+        return self._event_stream
 
     def __str__(self):
         return (f"Earthquake ID: {self.unique_id}\n"
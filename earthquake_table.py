@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+from obspy import UTCDateTime
+
+from event_store import EVENT_COLUMNS, parse_time_error
+
+# Times are kept as float epoch seconds, NaN where there is none
+TIME_COLUMNS = ["time", "p_predicted", "s_predicted", "p_detected", "s_detected"]
+FLOAT_COLUMNS = ["lat", "long", "mag", "depth", "epi_distance", "azimuth", "p_confidence", "s_confidence"]
+BOOLEAN_COLUMNS = ["catalogued", "detected"]
+TEXT_COLUMNS = ["unique_id", "provider", "event_id", "mag_type", "plot_path"]
+# Text columns with few distinct values, stored once per value
+CATEGORY_COLUMNS = ["provider", "mag_type"]
+# Residuals detected - predicted in seconds, formatted only for display
+ERROR_COLUMNS = ["p_error", "s_error"]
+
+TABLE_COLUMNS = TEXT_COLUMNS + TIME_COLUMNS + FLOAT_COLUMNS + ERROR_COLUMNS + BOOLEAN_COLUMNS
+
+
+def _epoch(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value == "":
+        return np.nan
+    return UTCDateTime(value).timestamp
+
+
+# Read-only view of one row with the attributes of an Earthquake, for code written against Earthquake lists
+class EarthquakeRow:
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getattr__(self, name):
+        if name not in TABLE_COLUMNS:
+            raise AttributeError(name)
+        value = self._table.data[name].iat[self._index]
+        if name in TIME_COLUMNS:
+            return UTCDateTime(value) if not np.isnan(value) else None
+        if name in FLOAT_COLUMNS or name in ERROR_COLUMNS:
+            return float(value) if not np.isnan(value) else None
+        if name in BOOLEAN_COLUMNS:
+            return bool(value)
+        return value if not pd.isna(value) else None
+
+    def __setattr__(self, name, value):
+        if name in self.__slots__:
+            object.__setattr__(self, name, value)
+        elif name == "plot_path":
+            self._table.data.iat[self._index, self._table.data.columns.get_loc(name)] = value
+        else:
+            raise AttributeError(f"{name} is read-only on table rows")
+
+
+# Struct-of-arrays table of earthquakes with vectorized filters, counts and residuals
+class EarthquakeTable:
+    def __init__(self, data=None):
+        if data is None:
+            data = pd.DataFrame({column: pd.Series(dtype=self._dtype(column)) for column in TABLE_COLUMNS})
+        self.data = data.reset_index(drop=True)
+
+    @staticmethod
+    def _dtype(column):
+        if column in BOOLEAN_COLUMNS:
+            return bool
+        if column in TEXT_COLUMNS:
+            return object
+        return np.float64
+
+    @classmethod
+    def from_earthquakes(cls, earthquakes):
+        columns = {}
+        for column in TEXT_COLUMNS:
+            columns[column] = [getattr(eq, column, None) for eq in earthquakes]
+        for column in TIME_COLUMNS:
+            columns[column] = np.array([_epoch(getattr(eq, column)) for eq in earthquakes], dtype=np.float64)
+        for column in FLOAT_COLUMNS:
+            columns[column] = np.array([getattr(eq, column) for eq in earthquakes], dtype=np.float64)
+        for column in BOOLEAN_COLUMNS:
+            columns[column] = np.array([bool(getattr(eq, column)) for eq in earthquakes], dtype=bool)
+        table = cls(pd.DataFrame(columns, columns=[c for c in TABLE_COLUMNS if c not in ERROR_COLUMNS]))
+        table.update_errors()
+        return table
+
+    @classmethod
+    def from_frame(cls, frame):
+        # Rows as stored by save_results / EventStore, with ISO times
+        data = pd.DataFrame(index=frame.index)
+        for column in TABLE_COLUMNS:
+            if column not in frame:
+                data[column] = pd.Series(index=frame.index, dtype=cls._dtype(column))
+            elif column in TIME_COLUMNS:
+                times = pd.to_datetime(frame[column], errors='coerce', utc=True, format='ISO8601')
+                epoch = times.astype('int64').astype(np.float64) / 1e9
+                data[column] = epoch.where(times.notna(), np.nan)
+            elif column in ERROR_COLUMNS:
+                data[column] = frame[column].map(parse_time_error).astype(np.float64)
+            elif column in FLOAT_COLUMNS:
+                data[column] = pd.to_numeric(frame[column], errors='coerce').astype(np.float64)
+            elif column in BOOLEAN_COLUMNS:
+                data[column] = frame[column].fillna(False).astype(bool)
+            elif column in CATEGORY_COLUMNS:
+                data[column] = frame[column].astype('category')
+            else:
+                data[column] = frame[column].astype(object)
+        if "date" in frame:
+            data["date"] = frame["date"].values
+        return cls(data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return EarthquakeRow(self, index)
+
+    def __iter__(self):
+        return (EarthquakeRow(self, i) for i in range(len(self.data)))
+
+    def mask(self, catalogued=None, detected=None, p_detected=None, s_detected=None):
+        mask = np.ones(len(self.data), dtype=bool)
+        if catalogued is not None:
+            mask &= self.data["catalogued"].to_numpy() == catalogued
+        if detected is not None:
+            mask &= self.data["detected"].to_numpy() == detected
+        if p_detected is not None:
+            mask &= ~np.isnan(self.data["p_detected"].to_numpy()) == p_detected
+        if s_detected is not None:
+            mask &= ~np.isnan(self.data["s_detected"].to_numpy()) == s_detected
+        return mask
+
+    def filter(self, **conditions):
+        return EarthquakeTable(self.data[self.mask(**conditions)])
+
+    def count(self, **conditions):
+        return int(self.mask(**conditions).sum())
+
+    def update_errors(self):
+        self.data["p_error"] = self.data["p_detected"] - self.data["p_predicted"]
+        self.data["s_error"] = self.data["s_detected"] - self.data["s_predicted"]
+
+    def summary(self):
+        total_catalogued = self.count(catalogued=True)
+        catalogued_detected = self.count(catalogued=True, detected=True)
+        return {
+            "total_detected": self.count(detected=True),
+            "total_catalogued": total_catalogued,
+            "catalogued_detected": catalogued_detected,
+            "detected_not_catalogued": self.count(catalogued=False, detected=True),
+            "p_detected": self.count(catalogued=True, p_detected=True),
+            "s_detected": self.count(catalogued=True, s_detected=True),
+        }
+
+    def to_frame(self, date=None):
+        # Rows in the layout of save_results, with ISO times and residuals in seconds
+        frame = pd.DataFrame(index=self.data.index)
+        for column in EVENT_COLUMNS:
+            if column == "date":
+                frame[column] = date if date is not None else self.data.get("date")
+            elif column in TIME_COLUMNS:
+                frame[column] = [UTCDateTime(value).isoformat() if not np.isnan(value) else None
+                                 for value in self.data[column]]
+            else:
+                frame[column] = self.data[column]
+        return frame
+
+
+def summarize(earthquakes):
+    # The counts of EarthquakeTable.summary for a table or an Earthquake list. A list is counted directly,
+    # building a table for a single summary costs far more than the counting.
+    if isinstance(earthquakes, EarthquakeTable):
+        return earthquakes.summary()
+    catalogued = [eq for eq in earthquakes if eq.catalogued]
+    total_detected = sum(1 for eq in earthquakes if eq.detected)
+    catalogued_detected = sum(1 for eq in catalogued if eq.detected)
+    return {
+        "total_detected": total_detected,
+        "total_catalogued": len(catalogued),
+        "catalogued_detected": catalogued_detected,
+        "detected_not_catalogued": total_detected - catalogued_detected,
+        "p_detected": sum(1 for eq in catalogued if eq.p_detected),
+        "s_detected": sum(1 for eq in catalogued if eq.s_detected),
+    }
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+
+import pandas as pd
+
+# Columns of the processed events, in the order of the daily CSV files
+EVENT_COLUMNS = ["date", "unique_id", "provider", "event_id", "time", "lat", "long", "mag", "mag_type",
+                 "depth", "epi_distance", "p_predicted", "s_predicted", "p_detected", "s_detected",
+                 "p_confidence", "s_confidence", "p_error", "s_error", "catalogued", "detected"]
+
+_COLUMN_TYPES = {
+    "lat": "REAL", "long": "REAL", "mag": "REAL", "depth": "REAL", "epi_distance": "REAL",
+    "p_confidence": "REAL", "s_confidence": "REAL", "p_error": "REAL", "s_error": "REAL",
+    "catalogued": "INTEGER", "detected": "INTEGER"
+}
+
+_BOOLEAN_COLUMNS = ["catalogued", "detected"]
+_ERROR_COLUMNS = ["p_error", "s_error"]
+
+
+def parse_time_error(value):
+    # Residual in seconds. Earlier versions stored formatted text such as '+1.25s' or 'N/A'.
+    if value is None or isinstance(value, (int, float)):
+        return float('nan') if value is None else float(value)
+    try:
+        return float(str(value).rstrip('s'))
+    except ValueError:
+        return float('nan')
+
+
+# Lifetime events of one station in SQLite, indexed by date so a day can be replaced without touching the
+# rest and readers only load the columns and dates they need
+class EventStore:
+    def __init__(self, station_folder):
+        self.station_folder = station_folder
+        self.path = os.path.join(station_folder, "events.sqlite")
+        os.makedirs(station_folder, exist_ok=True)
+        self._create()
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _create(self):
+        columns = ", ".join(f'"{column}" {_COLUMN_TYPES.get(column, "TEXT")}' for column in EVENT_COLUMNS)
+        with self.connect() as connection:
+            exists = connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name='events'").fetchone()
+            connection.execute(f"CREATE TABLE IF NOT EXISTS events ({columns})")
+            connection.execute("CREATE INDEX IF NOT EXISTS events_date ON events (date)")
+        connection.close()
+
+        # Earlier versions kept everything in one CSV file, import it once
+        csv_path = os.path.join(self.station_folder, "total_events_summary.csv")
+        if not exists and os.path.isfile(csv_path):
+            self.import_csv(csv_path)
+
+    def import_csv(self, csv_path):
+        data = pd.read_csv(csv_path)
+        for date, day in data.groupby('date', sort=False):
+            self.upsert_day(date, day)
+        print(f"Imported {len(data)} events from {csv_path}")
+
+    def upsert_day(self, date, events):
+        # Replace all events of one date in a single transaction
+        events = events.reindex(columns=EVENT_COLUMNS).copy()
+        events['date'] = date
+        for column in _BOOLEAN_COLUMNS:
+            events[column] = events[column].astype(bool).astype(int)
+        for column in _ERROR_COLUMNS:
+            events[column] = events[column].map(parse_time_error)
+        events = events.astype(object).where(events.notna(), None)
+
+        placeholders = ", ".join("?" for _ in EVENT_COLUMNS)
+        names = ", ".join(f'"{column}"' for column in EVENT_COLUMNS)
+        with self.connect() as connection:
+            connection.execute("DELETE FROM events WHERE date = ?", (date,))
+            connection.executemany(f"INSERT INTO events ({names}) VALUES ({placeholders})",
+                                   events.itertuples(index=False, name=None))
+        connection.close()
+
+    def read(self, columns=None, start_date=None, end_date=None):
+        # Events between start_date and end_date (inclusive, 'YYYY-MM-DD'), ordered by date and time
+        columns = [column for column in (columns or EVENT_COLUMNS) if column in EVENT_COLUMNS]
+        names = ", ".join(f'"{column}"' for column in columns)
+        query = f"SELECT {names} FROM events"
+        conditions, parameters = [], []
+        if start_date is not None:
+            conditions.append("date >= ?")
+            parameters.append(str(start_date))
+        if end_date is not None:
+            conditions.append("date <= ?")
+            parameters.append(str(end_date))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY date, rowid"
+
+        connection = self.connect()
+        try:
+            data = pd.read_sql_query(query, connection, params=parameters)
+        finally:
+            connection.close()
+
+        for column in _BOOLEAN_COLUMNS:
+            if column in data:
+                data[column] = data[column].astype(bool)
+        for column in _ERROR_COLUMNS:
+            if column in data:
+                data[column] = data[column].map(parse_time_error).astype(float)
+        return data
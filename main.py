@@ -3,43 +3,47 @@ import os
 import streamlit as st
 
 from catalog import Catalog
+from catalog_cache import CatalogCache, catalog_cache
+from catalog_poller import CatalogPoller
 from report import Report
+from report_asset_generation import format_time_error
 
 import os
 import pandas as pd
 from datetime import datetime
+from event_store import EventStore
 from station import Station
+from threshold_sweep import sweep_catalog
 
 
-def read_total_events_summary(network, code, url, date=None):
+def read_total_events_summary(network, code, url, date=None, columns=None, start_date=None):
     if date is None:
         date = datetime.today().strftime('%Y-%m-%d')
 
-    # Construct the path to the 'total_events_summary.csv' file using os.getcwd() as the base directory
+    # The station's event store lives in its folder under os.getcwd()
     base_dir = os.getcwd()
     station_folder = os.path.join(base_dir, "data", f"{network}.{code}")
-    file_path = os.path.join(station_folder, 'total_events_summary.csv')
 
-    # Read the CSV file into a DataFrame
+    # Read only the requested columns for the days up to date
     try:
-        df = pd.read_csv(file_path)
+        df = EventStore(station_folder).read(columns=columns, start_date=start_date, end_date=date)
         return df
-    except FileNotFoundError:
-        print(f"File not found: {file_path}")
-        return None
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         return None
 
 
-def download_station_data_logic(network, station_code, data_provider_url, report_date, overwrite):
+def download_station_data_logic(network, station_code, data_provider_url, report_date, overwrite, parts=3,
+                                max_retries=2):
     station = Station(network, station_code, data_provider_url, report_date)
-    result = station.download_day_stream(overwrite=overwrite)
+    result = station.download_day_stream(overwrite=overwrite, parts=parts, max_retries=max_retries)
     status = result.get('status')
 
     if status == 'success' or status == 'exists':
         try:
-            station.fetch_coordinates()
+            # Coordinates come from the station cache when the constructor already fetched them
+            if station.latitude is None or station.longitude is None:
+                station.fetch_coordinates()
             coordinates_message = f"{station.latitude:.2f}, {station.longitude:.2f}"
         except Exception as e:
             coordinates_message = f"Failed to fetch coordinates: {str(e)}"
@@ -60,22 +64,42 @@ def download_station_data_logic(network, station_code, data_provider_url, report
         }
 
 
+def bandpass_config(config):
+    # Arguments of the bandpass stage from the config, the previous fixed filter by default
+    return {
+        'freqmin': config.get('bandpass_freqmin', 1.0),
+        'freqmax': config.get('bandpass_freqmax', 40.0),
+        'corners': config.get('bandpass_corners', 5),
+        'zerophase': config.get('bandpass_zerophase', False),
+    }
+
+
 def process_stream_logic(station, detrend_demean, detrend_linear, remove_outliers, apply_bandpass, taper, denoise,
-                         save_processed):
+                         save_processed, chunk_length=None, chunk_overlap=120, outlier_method="threshold",
+                         outlier_window=10, preprocessing_stages=None,
+                         bandpass_options=None, preprocessing_workers=1):
     station.stream.process_stream(
         detrend_demean=detrend_demean,
         detrend_linear=detrend_linear,
         remove_outliers=remove_outliers,
         apply_bandpass=apply_bandpass,
         taper=taper,
-        denoise=denoise
+        denoise=denoise,
+        chunk_length=chunk_length,
+        chunk_overlap=chunk_overlap,
+        outlier_method=outlier_method,
+        outlier_window=outlier_window,
+        stages=preprocessing_stages,
+        bandpass_options=bandpass_options,
+        workers=preprocessing_workers
     )
     if save_processed:
         station.stream.save_stream(station, stream_to_save=station.stream.processed_stream, identifier="processed")
 
 
-def detect_phases_logic(station, p_threshold, s_threshold, p_only, save_annotated):
-    station.stream.predict_and_annotate()
+def detect_phases_logic(station, p_threshold, s_threshold, p_only, save_annotated, use_cache=True,
+                        chunk_length=None, chunk_overlap=120):
+    station.stream.predict_and_annotate(use_cache=use_cache, chunk_length=chunk_length, chunk_overlap=chunk_overlap)
     station.stream.filter_confidence(p_threshold, s_threshold)
     p_count = sum(1 for pred in station.stream.picked_signals if pred['phase'] == 'P')
     s_count = sum(1 for pred in station.stream.picked_signals if pred['phase'] == 'S')
@@ -87,26 +111,47 @@ def detect_phases_logic(station, p_threshold, s_threshold, p_only, save_annotate
     return station.stream.picked_signals, station.stream.annotated_stream, p_count, s_count
 
 
-def download_catalogue_logic(station, radmin, radmax, minmag, maxmag, catalogue_providers):
+def download_catalogue_logic(station, radmin, radmax, minmag, maxmag, catalogue_providers, travel_time_mode="table",
+                             catalogue_mode="first", provider_timeout=60, catalog_cache=catalog_cache):
     catalog = Catalog(station, radmin=radmin, radmax=radmax, minmag=minmag, maxmag=maxmag,
-                      catalogue_providers=catalogue_providers)
-    catalog.request_catalogue()
+                      catalogue_providers=catalogue_providers, travel_time_mode=travel_time_mode,
+                      catalogue_mode=catalogue_mode, provider_timeout=provider_timeout, catalog_cache=catalog_cache)
+    if not catalog.request_catalogue():
+        return None, "Failed to download catalog data."
     if catalog.original_catalog_earthquakes:
         return catalog, f"Catalog downloaded from {catalog.provider}. Number of events: {len(catalog.original_catalog_earthquakes)}."
+    return catalog, "No catalogued events for this day."
+
+
+def start_catalog_poller_logic(catalog, look_back=60, interval=60, max_interval=600):
+    # Put new and updated events of the last look_back minutes on poller.events until poller.stop()
+    poller = CatalogPoller(catalog, look_back=look_back, interval=interval, max_interval=max_interval)
+    return poller.start()
+
+
+def match_events_logic(catalog, tolerance_p, tolerance_s, p_only, save_results, merge_detections=False,
+                       merge_strategy="sweep", detected_merging_threshold=3.0, assignment_mode="greedy"):
+    if merge_detections:
+        # Merge uncatalogued detections of the same phase that are close in time into one event
+        catalog.all_day_earthquakes = catalog.match_and_merge2(
+            catalog.station.stream.picked_signals,
+            tolerance_p=tolerance_p,
+            tolerance_s=tolerance_s,
+            p_only=p_only,
+            detected_merging_threshold=detected_merging_threshold,
+            merge_strategy=merge_strategy,
+            assignment_mode=assignment_mode
+        )
     else:
-        return None, "Failed to download catalog data."
+        catalog.all_day_earthquakes = catalog.match_and_merge(
+            catalog.station.stream.picked_signals,
+            tolerance_p=tolerance_p,
+            tolerance_s=tolerance_s,
+            p_only=p_only,
+            assignment_mode=assignment_mode
+        )
 
-
-def match_events_logic(catalog, tolerance_p, tolerance_s, p_only, save_results):
-    catalog.all_day_earthquakes = catalog.match_and_merge(
-        catalog.station.stream.picked_signals,
-        tolerance_p=tolerance_p,
-        tolerance_s=tolerance_s,
-        p_only=p_only
-    )
-
-    for eq in catalog.all_day_earthquakes:
-        eq.update_errors()
+    catalog.update_errors()
 
     if save_results:
         catalog.save_results()
@@ -117,6 +162,18 @@ def match_events_logic(catalog, tolerance_p, tolerance_s, p_only, save_results):
     return detected_catalogued, detected_not_catalogued_count
 
 
+def sweep_thresholds_logic(catalog, p_thresholds, s_thresholds, tolerances_p, tolerances_s, p_only):
+    # Evaluate a grid of thresholds and tolerances on the cached picks without rerunning the models
+    results = sweep_catalog(catalog, p_thresholds, s_thresholds, tolerances_p, tolerances_s, p_only=p_only)
+    if results.empty:
+        return results, "No threshold and tolerance combinations to evaluate."
+    best = results.iloc[0]
+    message = (f"Best of {len(results)} combinations: P threshold {best['p_threshold']:.2f}, "
+               f"S threshold {best['s_threshold']:.2f}, P tolerance {best['tolerance_p']:.1f}s, "
+               f"S tolerance {best['tolerance_s']:.1f}s, detection rate {best['detection_rate'] * 100:.2f}%")
+    return results, message
+
+
 def generate_report_logic(station, catalog, simplified, p_only, fill_map, create_gif):
     report = Report(station, catalog, simplified=simplified, p_only=p_only, fill_map=fill_map, create_gif=create_gif)
     report.construct_email()
@@ -176,7 +233,7 @@ def display_matched_earthquakes(catalog, simplified, p_only):
                 with col8:
                     st.write(f"**P Detected:** {earthquake.p_detected.strftime('%Y-%m-%d %H:%M:%S')}")
                 with col9:
-                    st.write(f"**P Error:** {earthquake.p_error}")
+                    st.write(f"**P Error:** {format_time_error(earthquake.p_error)}")
 
                 # Fourth line: P Confidence (if not
 
@@ -208,9 +265,12 @@ if __name__ == '__main__':
     #report_date_str = default_config['report_date']
     report_date_str = '2024-03-03'
     overwrite = default_config['overwrite']
+    download_parts = default_config.get('download_parts', 3)
+    download_retries = default_config.get('download_retries', 2)
 
     # Download station data
-    result = download_station_data_logic(network, station_code, data_provider_url, report_date_str, overwrite)
+    result = download_station_data_logic(network, station_code, data_provider_url, report_date_str, overwrite,
+                                         download_parts, download_retries)
     if result['status'] == 'success':
         station = result['data']
         print("Station data downloaded successfully.")
@@ -223,9 +283,16 @@ if __name__ == '__main__':
         radmax = default_config['radmax']
         minmag = default_config['minmag']
         maxmag = default_config['maxmag']
+        travel_time_mode = default_config.get('travel_time_mode', 'table')
+        catalog_mode = default_config.get('catalog_mode', 'first')
+        catalog_timeout = default_config.get('catalog_timeout', 60)
+        cache = CatalogCache(ttl=default_config.get('catalog_cache_ttl', 3600),
+                             settle_days=default_config.get('catalog_settle_days', 7)) \
+            if default_config.get('catalog_cache', True) else None
 
         # Download catalog data
-        catalog, message = download_catalogue_logic(station, radmin, radmax, minmag, maxmag, catalog_providers)
+        catalog, message = download_catalogue_logic(station, radmin, radmax, minmag, maxmag, catalog_providers,
+                                                    travel_time_mode, catalog_mode, catalog_timeout, cache)
         if not catalog:
             print(f"Failed to download catalog data: {message}")
         else:
@@ -239,10 +306,18 @@ if __name__ == '__main__':
             taper = default_config['taper']
             denoise = default_config['denoise']
             save_processed = default_config['save_processed']
+            chunk_length = default_config['chunk_length'] if default_config.get('streaming_inference') else None
+            chunk_overlap = default_config.get('chunk_overlap', 120)
+            outlier_method = default_config.get('outlier_method', 'threshold')
+            outlier_window = default_config.get('outlier_window', 10)
+            preprocessing_stages = default_config.get('preprocessing_stages') or None
+            bandpass_options = bandpass_config(default_config)
+            preprocessing_workers = default_config.get('preprocessing_workers', 1)
 
             # Process stream data
             process_stream_logic(station, detrend_demean, detrend_linear, remove_outliers, apply_bandpass, taper,
-                                 denoise, save_processed)
+                                 denoise, save_processed, chunk_length, chunk_overlap, outlier_method, outlier_window,
+                                 preprocessing_stages, bandpass_options, preprocessing_workers)
             print("Stream processing completed and saved.")
 
             # Step 4: Detect Phases
@@ -253,18 +328,34 @@ if __name__ == '__main__':
 
             # Detect phases
             picked_signals, annotated_stream, p_count, s_count = detect_phases_logic(station, p_threshold, s_threshold,
-                                                                                     p_only, save_annotated)
+                                                                                     p_only, save_annotated,
+                                                                                     chunk_length=chunk_length,
+                                                                                     chunk_overlap=chunk_overlap)
             print(f"P waves detected: {p_count}, S waves detected: {s_count}")
 
             # Step 5: Match Events
             tolerance_p = default_config['tolerance_p']
             tolerance_s = default_config['tolerance_s']
             save_results = default_config['save_results']
+            merge_detections = default_config.get('merge_detections', False)
+            merge_strategy = default_config.get('merge_strategy', 'sweep')
+            detected_merging_threshold = default_config.get('detected_merging_threshold', 3.0)
+            assignment_mode = default_config.get('assignment_mode', 'greedy')
 
             # Match events
-            summary = match_events_logic(catalog, tolerance_p, tolerance_s, p_only, save_results)
+            summary = match_events_logic(catalog, tolerance_p, tolerance_s, p_only, save_results, merge_detections,
+                                         merge_strategy, detected_merging_threshold, assignment_mode)
             print(summary)
 
+            # Optional: sweep the thresholds and tolerances on the picks of this run
+            if default_config.get('threshold_sweep', False):
+                sweep_results, message = sweep_thresholds_logic(catalog, default_config['sweep_p_thresholds'],
+                                                                default_config['sweep_s_thresholds'],
+                                                                default_config['sweep_tolerances_p'],
+                                                                default_config['sweep_tolerances_s'], p_only)
+                print(message)
+                print(sweep_results.head(10).to_string(index=False))
+
             # Step 6: Generate Report
             simplified = default_config['simplified']
             fill_map = default_config['fill_map']
@@ -0,0 +1,206 @@
+import numpy as np
+from obspy import UTCDateTime
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components, min_weight_full_bipartite_matching
+
+# Picks within this many nanoseconds of the tolerance edge are checked with the exact UTCDateTime arithmetic
+_EDGE_NS = 1000
+
+
+def _ns(value):
+    return value._ns if isinstance(value, UTCDateTime) else UTCDateTime(value)._ns
+
+
+class PickIndex:
+    # Picks of one phase sorted by time, as integer nanoseconds so every window lookup is a binary search
+    def __init__(self, detections, phase):
+        self.positions = np.array([i for i, detection in enumerate(detections) if detection['phase'] == phase],
+                                  dtype=np.int64)
+        ns = [_ns(detections[i]['peak_time']) for i in self.positions]
+        order = np.argsort(np.array(ns, dtype=np.int64), kind='stable')
+
+        self.positions = self.positions[order]
+        self.ns = np.array(ns, dtype=np.int64)[order]
+        # UTCDateTime equality compares times rounded to microseconds
+        self.keys = np.array([round(ns[i], -3) for i in order], dtype=np.int64)
+        self.confidences = np.array([detections[i]['peak_confidence'] for i in self.positions], dtype=float)
+        self.available = np.ones(len(self.positions), dtype=bool)
+
+    def window(self, predicted, tolerance):
+        # Sorted positions of the picks within tolerance of the prediction, compared like UTCDateTime does
+        predicted_ns = _ns(predicted)
+        tolerance_ns = int(tolerance * 1e9)
+        lo = np.searchsorted(self.ns, predicted_ns - tolerance_ns - _EDGE_NS, side='left')
+        hi = np.searchsorted(self.ns, predicted_ns + tolerance_ns + _EDGE_NS, side='right')
+
+        distance = np.abs(self.ns[lo:hi] - predicted_ns)
+        within = distance <= tolerance_ns - _EDGE_NS
+        for k in np.flatnonzero((distance > tolerance_ns - _EDGE_NS) & (distance <= tolerance_ns + _EDGE_NS)):
+            within[k] = abs(round(int(self.ns[lo + k] - predicted_ns) / 1e9, 6)) <= tolerance
+        return np.arange(lo, hi)[within]
+
+    def best(self, predicted, tolerance):
+        # Position of the most confident available pick within tolerance of the prediction, the earliest
+        # in the original list on ties, or None
+        candidates = self.window(predicted, tolerance)
+
+        # Only confidences above zero can beat the initial best of the greedy matcher
+        candidates = candidates[self.available[candidates] & (self.confidences[candidates] > 0)]
+        if len(candidates) == 0:
+            return None
+        confidences = self.confidences[candidates]
+        best = candidates[confidences == confidences.max()]
+        return int(self.positions[best].min())
+
+    def remove_time(self, key):
+        lo = np.searchsorted(self.keys, key, side='left')
+        hi = np.searchsorted(self.keys, key, side='right')
+        self.available[lo:hi] = False
+
+
+# Greedy matching of picks to catalogued events in catalogue order, with the same assignments as the original
+# nested loop: each event takes its most confident P and S pick within tolerance, and every pick at one of
+# the taken times is then unavailable to later events. Returns the (p, s) pick positions for each event and
+# the positions of the picks left unmatched.
+def greedy_match(p_predicted, s_predicted, detections, tolerance_p, tolerance_s, p_only=False):
+    p_index = PickIndex(detections, 'P')
+    s_index = PickIndex(detections, 'S')
+    indexes = (p_index, s_index)
+
+    assignments = []
+    removed_keys = set()
+    for p_time, s_time in zip(p_predicted, s_predicted):
+        best_p = p_index.best(p_time, tolerance_p) if p_time else None
+        best_s = s_index.best(s_time, tolerance_s) if not p_only and s_time else None
+
+        for best in (best_p, best_s):
+            if best is not None:
+                key = round(_ns(detections[best]['peak_time']), -3)
+                removed_keys.add(key)
+                for index in indexes:
+                    index.remove_time(key)
+        assignments.append((best_p, best_s))
+
+    # Picks sharing a time with a matched pick are dropped whatever their phase
+    unmatched = [i for i, detection in enumerate(detections)
+                 if not removed_keys or round(_ns(detection['peak_time']), -3) not in removed_keys]
+    return assignments, unmatched
+
+
+# Cost of leaving an event without a pick, larger than any set of real pairs so the most events get a pick
+_UNASSIGNED_COST = 1e6
+
+
+def _optimal_phase_match(index, predicted_times, tolerance):
+    # Pick position for each prediction from a minimum cost bipartite matching. Only pairs within tolerance
+    # are considered; the problem splits into independent groups of events that compete for picks, which
+    # are solved one by one on sparse matrices of their candidate pairs.
+    assigned = [None] * len(predicted_times)
+    rows, cols, costs = [], [], []
+    for event, predicted in enumerate(predicted_times):
+        if not predicted:
+            continue
+        candidates = index.window(predicted, tolerance)
+        candidates = candidates[index.confidences[candidates] > 0]
+        # Cost grows with the time residual relative to the tolerance and falls with the pick confidence
+        residuals = np.abs(index.ns[candidates] - _ns(predicted)) / 1e9
+        rows.extend([event] * len(candidates))
+        cols.extend(candidates.tolist())
+        costs.extend((residuals / max(tolerance, 1e-9) + 1 - index.confidences[candidates]).tolist())
+
+    if not rows:
+        return assigned
+
+    n_events = len(predicted_times)
+    rows = np.array(rows)
+    cols = np.array(cols)
+    costs = np.array(costs)
+    graph = coo_matrix((np.ones(len(rows)), (rows, n_events + cols)),
+                       shape=(n_events + len(index.ns), n_events + len(index.ns)))
+    _, labels = connected_components(graph, directed=False)
+
+    edge_labels = labels[rows]
+    order = np.argsort(edge_labels, kind='stable')
+    boundaries = np.flatnonzero(np.diff(edge_labels[order])) + 1
+    for edges in np.split(order, boundaries):
+        events, event_rows = np.unique(rows[edges], return_inverse=True)
+        picks, pick_cols = np.unique(cols[edges], return_inverse=True)
+        # Only the pairs within tolerance are stored, plus one "unassigned" column per event so every event
+        # can be matched. Each event is matched exactly once, so shifting all costs by one changes no
+        # assignment and keeps perfect pairs from being zeros the sparse matrix would drop.
+        n_group = len(events)
+        graph = csr_matrix((np.concatenate([costs[edges], np.full(n_group, _UNASSIGNED_COST)]) + 1.0,
+                            (np.concatenate([event_rows, np.arange(n_group)]),
+                             np.concatenate([pick_cols, len(picks) + np.arange(n_group)]))),
+                           shape=(n_group, len(picks) + n_group))
+
+        for row, col in zip(*min_weight_full_bipartite_matching(graph)):
+            if col < len(picks):
+                assigned[events[row]] = int(index.positions[picks[col]])
+    return assigned
+
+
+# Globally consistent alternative to greedy_match: P and S picks are each assigned to events by one minimum
+# cost matching over the whole day, so an earlier event cannot take a pick that fits a later one better.
+# Returns the same (p, s) pick positions per event and unmatched pick positions as greedy_match.
+def optimal_match(p_predicted, s_predicted, detections, tolerance_p, tolerance_s, p_only=False):
+    best_p = _optimal_phase_match(PickIndex(detections, 'P'), p_predicted, tolerance_p)
+    if p_only:
+        best_s = [None] * len(best_p)
+    else:
+        best_s = _optimal_phase_match(PickIndex(detections, 'S'), s_predicted, tolerance_s)
+
+    assigned = {position for position in best_p + best_s if position is not None}
+    unmatched = [i for i in range(len(detections)) if i not in assigned]
+    return list(zip(best_p, best_s)), unmatched
+
+
+# Merge detections of the same phase that follow the earliest detection of their group within threshold
+# seconds, keeping the earliest time and the highest confidence. Picks are swept in time order, so each
+# group is found with one binary search.
+def cluster_detections(detections, threshold):
+    merged = []
+    threshold_ns = int(threshold * 1e9)
+    for phase in sorted({detection['phase'] for detection in detections}):
+        selected = [detection for detection in detections if detection['phase'] == phase]
+        ns = np.array([_ns(detection['peak_time']) for detection in selected], dtype=np.int64)
+        order = np.argsort(ns, kind='stable')
+        ns = ns[order]
+        confidences = np.array([selected[i]['peak_confidence'] for i in order], dtype=float)
+
+        starts = []
+        start = 0
+        while start < len(ns):
+            starts.append(start)
+            start = int(np.searchsorted(ns, ns[start] + threshold_ns, side='right'))
+
+        for start, confidence in zip(starts, np.maximum.reduceat(confidences, starts) if starts else []):
+            merged.append({
+                "peak_time": UTCDateTime(ns=int(ns[start])),
+                "peak_confidence": float(confidence),
+                "phase": phase
+            })
+
+    merged.sort(key=lambda detection: detection['peak_time'])
+    return merged
+
+
+# The original merging of match_and_merge2: each detection joins the first merged detection of the same
+# phase within threshold, in list order
+def merge_detections_pairwise(detections, threshold):
+    merged_detections = []
+    for detection in detections:
+        merged = False
+        for merged_detection in merged_detections:
+            if (abs(UTCDateTime(detection['peak_time']) - UTCDateTime(merged_detection['peak_time'])) <= threshold and
+                    detection['phase'] == merged_detection['phase']):
+                # Merge the detections
+                merged_detection['peak_time'] = min(UTCDateTime(detection['peak_time']),
+                                                    UTCDateTime(merged_detection['peak_time'])).isoformat()
+                merged_detection['peak_confidence'] = max(detection['peak_confidence'],
+                                                          merged_detection['peak_confidence'])
+                merged = True
+                break
+        if not merged:
+            merged_detections.append(detection)
+    return merged_detections
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+import seisbench.models as sbm
+import torch
+
+
+# Models used by the pipeline, resolved by name so callers and config files can refer to them as strings
+MODEL_CLASSES = {
+    "EQTransformer": sbm.EQTransformer,
+    "DeepDenoiser": sbm.DeepDenoiser,
+}
+
+# Models loaded by the daily pipeline, used when warming up long-running entry points
+DEFAULT_MODELS = [("DeepDenoiser", "original"), ("EQTransformer", "original")]
+
+
+def default_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class ModelRegistry:
+    def __init__(self, max_models=4):
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def make_key(self, model_class, weights="original", device=None, dtype=torch.float32):
+        if isinstance(model_class, str):
+            model_class = MODEL_CLASSES[model_class]
+        device = device or default_device()
+        return model_class.__name__, weights, str(device), str(dtype)
+
+    def get(self, model_class, weights="original", device=None, dtype=torch.float32):
+        if isinstance(model_class, str):
+            model_class = MODEL_CLASSES[model_class]
+        device = device or default_device()
+        key = self.make_key(model_class, weights, device, dtype)
+
+        with self._lock:
+            if key in self._models:
+                # Mark as most recently used
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            model = self._load(model_class, weights, device, dtype)
+            self._models[key] = model
+
+            # Evict least recently used models beyond capacity
+            while len(self._models) > self.max_models:
+                evicted_key, _ = self._models.popitem(last=False)
+                print(f"Model {evicted_key[0]} ({evicted_key[1]}) evicted from registry.")
+
+            return model
+
+    def _load(self, model_class, weights, device, dtype):
+        model = model_class.from_pretrained(weights)
+
+        # Enable GPU processing if available
+        if str(device).startswith("cuda"):
+            torch.backends.cudnn.enabled = False
+            print(f"CUDA available. {model_class.__name__} loaded on GPU")
+        else:
+            print(f"CUDA not available. {model_class.__name__} loaded on CPU")
+
+        model.to(device=device, dtype=dtype)
+        model.eval()
+        return model
+
+    def warm_up(self, models=None, device=None, dtype=torch.float32):
+        # Load the given (model class, weights) pairs ahead of the first request
+        for model_class, weights in (models or DEFAULT_MODELS):
+            self.get(model_class, weights, device=device, dtype=dtype)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+# Process-wide registry shared by StreamData and the entry points
+registry = ModelRegistry()
+
+
+def get_model(model_class, weights="original", device=None, dtype=torch.float32):
+    return registry.get(model_class, weights, device=device, dtype=dtype)
+
+
+def warm_up_models(models=None, device=None, dtype=torch.float32):
+    registry.warm_up(models, device=device, dtype=dtype)
@@ -9,7 +9,7 @@ import plotly.graph_objects as go
 import pandas as pd
 import matplotlib.colors as mcolors
 from main import download_station_data_logic, process_stream_logic, detect_phases_logic, download_catalogue_logic, \
-    match_events_logic, generate_report_logic, send_email_logic, display_matched_earthquakes
+    match_events_logic, generate_report_logic, send_email_logic, display_matched_earthquakes, bandpass_config
 
 config = {
     'report_date': '2024-04-23'
@@ -183,7 +183,7 @@ with catalog_settings_container:
             st.session_state.global_catalog = catalog
             st.session_state.catalog_downloaded = True
             st.session_state.event_count = len(catalog.original_catalog_earthquakes)
-            st.session_state.catalog_provider = catalog.provider
+            st.session_state.catalog_provider = catalog.provider or "No events"
         else:
             st.session_state.catalog_downloaded = False
             st.session_state.event_count = 0
@@ -253,7 +253,14 @@ with process_stream_container:
         process_stream_logic(st.session_state.global_station, st.session_state.detrend_demean,
                              st.session_state.detrend_linear, st.session_state.remove_outliers,
                              st.session_state.apply_bandpass, st.session_state.taper, st.session_state.denoise,
-                             st.session_state.save_processed)
+                             st.session_state.save_processed,
+                             st.session_state.chunk_length if st.session_state.get('streaming_inference') else None,
+                             st.session_state.get('chunk_overlap', 120),
+                             st.session_state.get('outlier_method', 'threshold'),
+                             st.session_state.get('outlier_window', 10),
+                             st.session_state.get('preprocessing_stages') or None,
+                             bandpass_config(st.session_state),
+                             st.session_state.get('preprocessing_workers', 1))
         st.session_state.stream_processed = True
 
         # 保存绘图数据以便后续重新绘制
@@ -307,7 +314,9 @@ with detect_phases_container:
                                                                                  st.session_state.p_threshold,
                                                                                  st.session_state.s_threshold,
                                                                                  st.session_state.p_only,
-                                                                                 st.session_state.save_annotated)
+                                                                                 st.session_state.save_annotated,
+                                                                                 chunk_length=st.session_state.chunk_length if st.session_state.get('streaming_inference') else None,
+                                                                                 chunk_overlap=st.session_state.get('chunk_overlap', 120))
         st.session_state.phases_detected = True
         st.session_state.p_count = p_count
         st.session_state.s_count = s_count
@@ -0,0 +1,174 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from obspy import Stream, Trace
+
+from preprocessing import Bandpass, PreprocessingPipeline, RemoveOutliers
+
+# Data before (and for zero-phase after) every segment that the bandpass runs over and then discards, in units
+# of corners / freqmin seconds. The transient of starting the filter at rest falls below 1e-9 of its impulse
+# response after about two of them, far below float32 precision; twelve give 60 s for the default 1 Hz, 5 corners.
+TRANSIENT_PERIODS = 12
+# Segments are at least this many overlaps long, shorter traces are split into fewer segments
+MIN_SEGMENT_OVERLAPS = 10
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(workers):
+    # Worker processes are started once per process and number of workers, and kept for the next days
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pools[workers] = pool
+        return pool
+
+
+def discard_pool(workers, pool):
+    # A pool whose worker died (killed, out of memory) refuses all new work, the next get_pool starts a new one
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def bandpass_overlap(stage):
+    # Seconds the bandpass needs to settle, longer for lower freqmin and steeper filters
+    return TRANSIENT_PERIODS * stage.corners / stage.freqmin
+
+
+def stage_context(stage, sampling_rate, overlap=None):
+    # Samples a segment needs before and after itself to give the serial result. overlap replaces the bandpass
+    # overlap in seconds.
+    if isinstance(stage, Bandpass):
+        samples = int(np.ceil((bandpass_overlap(stage) if overlap is None else overlap) * sampling_rate))
+        return samples, samples if stage.zerophase else 0
+    if isinstance(stage, RemoveOutliers) and stage.method == "rolling":
+        half = stage.window_size // 2
+        return half, half
+    return 0, 0
+
+
+def _apply_segment(source_name, target_name, total, stage, params, trace_start, trace_stop, start, stop, left, right):
+    # Runs in a worker. Applies the stage to buffer[start:stop], which lies in the trace at
+    # buffer[trace_start:trace_stop]. Without context the segment is changed in place; otherwise the segment
+    # with its context is copied out of the source buffer and the segment is written to the target buffer.
+    source_memory = SharedMemory(name=source_name)
+    target_memory = SharedMemory(name=target_name) if target_name else None
+    try:
+        source = np.ndarray((total,), dtype=np.float32, buffer=source_memory.buf)
+        if target_memory is None:
+            stage.apply(source[start:stop], params, start - trace_start)
+        else:
+            target = np.ndarray((total,), dtype=np.float32, buffer=target_memory.buf)
+            first = max(trace_start, start - left)
+            last = min(trace_stop, stop + right)
+            data = source[first:last].copy()
+            stage.apply(data, params, first - trace_start)
+            target[start:stop] = data[start - first:stop - first]
+            del target
+        del source
+    finally:
+        source_memory.close()
+        if target_memory is not None:
+            target_memory.close()
+
+
+# PreprocessingPipeline with the stages applied to segments of the traces in a pool of worker processes. All
+# traces share one float32 buffer in shared memory; each stage is fitted on the whole trace here and applied to
+# the segments by the workers. Stages that look at neighbouring samples, the rolling outlier filter and the
+# bandpass, read their segment with an overlap from one buffer and write it to a second one, so no segment sees
+# data another worker already changed. The result matches the serial pipeline: exactly for the rolling filter,
+# within float32 rounding for the bandpass, which starts every segment bandpass_overlap seconds early. When a
+# worker process dies the pool is replaced and the stream processed again, once.
+class ParallelPreprocessor:
+    def __init__(self, pipeline, workers=None, overlap=None):
+        self.pipeline = pipeline if isinstance(pipeline, PreprocessingPipeline) else PreprocessingPipeline(pipeline)
+        self.workers = workers or os.cpu_count()
+        self.overlap = overlap  # Seconds, None for the overlap of each bandpass
+
+    @property
+    def timings(self):
+        return self.pipeline.timings
+
+    def segments(self, npts, context):
+        # (start, stop) of the segments of one trace, each at least MIN_SEGMENT_OVERLAPS times the context
+        count = max(1, min(self.workers, npts // max(1, MIN_SEGMENT_OVERLAPS * context)))
+        bounds = np.linspace(0, npts, count + 1).astype(int)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def run(self, stream):
+        # New stream with the processed data, like PreprocessingPipeline.run
+        if self.workers <= 1 or sum(trace.stats.npts for trace in stream) == 0:
+            return self.pipeline.run(stream)
+        for attempt in range(2):
+            pool = get_pool(self.workers)
+            try:
+                return self._run(stream, pool)
+            except BrokenProcessPool:
+                discard_pool(self.workers, pool)
+                if attempt:
+                    raise
+                print("A preprocessing worker process died, starting new ones and preprocessing again.")
+
+    def _run(self, stream, pool):
+        offsets = np.concatenate([[0], np.cumsum([trace.stats.npts for trace in stream])]).astype(int)
+        total = int(offsets[-1])
+        stats = [trace.stats.copy() for trace in stream]
+        contexts = [[stage_context(stage, trace_stats.sampling_rate, self.overlap) for trace_stats in stats]
+                    for stage in self.pipeline.stages]
+        # The segments are the same for every stage, long enough for the widest context
+        segments = [self.segments(int(offsets[i + 1] - offsets[i]),
+                                  max([max(stage_contexts[i]) for stage_contexts in contexts], default=0))
+                    for i in range(len(stats))]
+
+        memories = [SharedMemory(create=True, size=total * 4)]
+        source = None
+        try:
+            source = np.ndarray((total,), dtype=np.float32, buffer=memories[0].buf)
+            for trace, start in zip(stream, offsets):
+                source[start:start + trace.stats.npts] = trace.data  # The working copy
+
+            for stage, stage_contexts in zip(self.pipeline.stages, contexts):
+                started = time.perf_counter()
+                target_name = None
+                if any(left or right for left, right in stage_contexts):
+                    if len(memories) == 1:
+                        memories.append(SharedMemory(create=True, size=total * 4))
+                    target_name = memories[1].name
+
+                futures = []
+                for i, (trace_stats, (left, right)) in enumerate(zip(stats, stage_contexts)):
+                    trace_start, trace_stop = int(offsets[i]), int(offsets[i + 1])
+                    params = stage.fit(source[trace_start:trace_stop], trace_stats)
+                    for start, stop in segments[i]:
+                        futures.append(pool.submit(_apply_segment, memories[0].name, target_name, total, stage,
+                                                   params, trace_start, trace_stop, trace_start + start,
+                                                   trace_start + stop, left, right))
+                for future in futures:
+                    future.result()
+
+                if target_name:
+                    # The stage was written to the second buffer, which becomes the source of the next stage
+                    memories.reverse()
+                    source = np.ndarray((total,), dtype=np.float32, buffer=memories[0].buf)
+                self.pipeline.timings[stage.name] = (self.pipeline.timings.get(stage.name, 0.0) +
+                                                     time.perf_counter() - started)
+
+            processed = Stream()
+            for i, trace_stats in enumerate(stats):
+                processed.append(Trace(data=source[offsets[i]:offsets[i + 1]].copy(), header=trace_stats))
+            return processed
+        finally:
+            source = None  # Shared memory cannot be closed while arrays point into it
+            for memory in memories:
+                memory.close()
+                memory.unlink()
@@ -0,0 +1,105 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import seisbench
+from obspy import read, UTCDateTime
+
+
+# Content hash of a stream: trace ids, timing and raw sample bytes
+def stream_hash(stream):
+    digest = hashlib.sha256()
+    for trace in sorted(stream, key=lambda tr: (tr.id, tr.stats.starttime)):
+        digest.update(trace.id.encode())
+        digest.update(str(trace.stats.starttime).encode())
+        digest.update(str(trace.stats.sampling_rate).encode())
+        digest.update(str(trace.data.dtype).encode())
+        digest.update(memoryview(np.ascontiguousarray(trace.data)).cast("B"))
+    return digest.hexdigest()
+
+
+# Cache key combining the processed stream content with the model identity and inference variant
+def phase_cache_key(stream, model_name, weights, variant=None):
+    digest = hashlib.sha256()
+    digest.update(stream_hash(stream).encode())
+    digest.update(f"{model_name}|{weights}|{variant}|{seisbench.__version__}".encode())
+    return digest.hexdigest()[:24]
+
+
+def phase_cache_prefix(station):
+    channel = "*Z*"
+    location = "*"
+    nslc = f"{station.network}.{station.code}.{location}.{channel}".replace("*", "")
+    return os.path.join(station.date_folder, f"{station.report_date.strftime('%Y-%m-%d')}_{nslc}.phases")
+
+
+def phase_cache_paths(station):
+    # One entry per day, the key of the stream and model it holds is kept with the picks
+    prefix = phase_cache_prefix(station)
+    return f"{prefix}.mseed", f"{prefix}.json"
+
+
+def save_phase_cache(station, key, picks, annotated_stream):
+    # Replaces the day's entry, so a change of preprocessing or chunking does not leave another annotated
+    # stream behind
+    annotated_path, picks_path = phase_cache_paths(station)
+    os.makedirs(station.date_folder, exist_ok=True)
+
+    # MiniSEED truncates channel codes to three characters, so keep the full names with the picks
+    channels = [tr.stats.channel for tr in annotated_stream]
+    encoding = 'FLOAT64' if annotated_stream[0].data.dtype == np.float64 else 'FLOAT32'
+    content = {
+        "key": key,
+        "channels": channels,
+        "picks": [{
+            "peak_time": UTCDateTime(pick['peak_time']).isoformat(),
+            "peak_confidence": float(pick['peak_confidence']),
+            "phase": pick['phase']
+        } for pick in picks]
+    }
+
+    suffix = f".{os.getpid()}.tmp"
+    annotated_stream.write(annotated_path + suffix, format='MSEED', encoding=encoding)
+    with open(picks_path + suffix, 'w') as file:
+        json.dump(content, file)
+    # The picks go last: without them there is no entry, so a stream is never read with another key's picks
+    if os.path.isfile(picks_path):
+        os.remove(picks_path)
+    os.replace(annotated_path + suffix, annotated_path)
+    os.replace(picks_path + suffix, picks_path)
+
+    # Entries of the earlier layout, one per key
+    for path in glob.glob(glob.escape(phase_cache_prefix(station)) + ".*.mseed") + \
+            glob.glob(glob.escape(phase_cache_prefix(station)) + ".*.json"):
+        if not path.endswith(".tmp"):
+            os.remove(path)
+    print(f"Phase picks cached to {picks_path}")
+
+
+def load_phase_cache(station, key):
+    annotated_path, picks_path = phase_cache_paths(station)
+    if not (os.path.isfile(annotated_path) and os.path.isfile(picks_path)):
+        return None
+
+    try:
+        with open(picks_path, 'r') as file:
+            content = json.load(file)
+        if content.get("key") != key:
+            return None  # Made from another stream or with another model or variant
+        annotated_stream = read(annotated_path)
+    except Exception as e:
+        print(f"Failed to read phase cache {picks_path}: {e}")
+        return None
+
+    if len(content.get("channels", [])) == len(annotated_stream):
+        for tr, channel in zip(annotated_stream, content["channels"]):
+            tr.stats.channel = channel
+
+    picks = [{
+        "peak_time": UTCDateTime(pick['peak_time']),
+        "peak_confidence": pick['peak_confidence'],
+        "phase": pick['phase']
+    } for pick in content["picks"]]
+    return picks, annotated_stream
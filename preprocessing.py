@@ -0,0 +1,392 @@
+import threading
+import time
+
+import numpy as np
+from obspy import Stream, Trace
+from scipy.signal import iirfilter, sosfilt, zpk2sos
+from scipy.signal.windows import hann
+
+# Stages walk the data in blocks of this many samples, so their temporaries stay small next to a day of data
+BLOCK_SIZE = 1 << 20
+
+
+def _blocks(n, block_size=BLOCK_SIZE):
+    for start in range(0, n, block_size):
+        yield slice(start, min(start + block_size, n))
+
+
+def _sorted_percentile(sorted_rows, q):
+    # np.percentile(row, q) for every row of an array sorted along its rows, with the same linear
+    # interpolation and rounding
+    virtual_index = (sorted_rows.shape[1] - 1) * (q / 100)
+    previous_index = int(np.floor(virtual_index))
+    next_index = min(previous_index + 1, sorted_rows.shape[1] - 1)
+    gamma = np.array([virtual_index - previous_index])
+
+    previous = sorted_rows[:, previous_index]
+    following = sorted_rows[:, next_index]
+    difference = following - previous
+    if gamma[0] >= 0.5:
+        return following - difference * (1 - gamma)
+    return previous + difference * gamma
+
+
+def _window_outlier(window_data, value, threshold_factor):
+    # Median of the window when value lies outside median -/+ threshold_factor * IQR, else None
+    median = np.median(window_data)
+    quartile1 = np.percentile(window_data, 25)
+    quartile3 = np.percentile(window_data, 75)
+    iqr = quartile3 - quartile1
+    if value < median - (threshold_factor * iqr) or value > median + (threshold_factor * iqr):
+        return median
+    return None
+
+
+def rolling_outliers(data, window_size=10, threshold_factor=1.5, block_size=1 << 14):
+    # In-place version of stream_processing.remove_outliers_window with the same result. Every full window is
+    # a row of a strided view of the data; a block of rows is sorted at a time and the median and quartiles
+    # are read from the sorted rows. Replacements are written one block late, once no window still to be
+    # read covers them, so every window sees the original data.
+    half = window_size // 2
+    length = 2 * half  # Full windows run from i - half to i + half - 1
+    n = len(data)
+    if half == 0:
+        return data
+    block_size = max(block_size, half)
+
+    # The few samples near the ends have shorter windows and are handled one by one, before any write
+    if n >= length:
+        edges = list(range(half)) + list(range(max(half, n - half + 1), n))
+    else:
+        edges = list(range(n))
+    edge_replacements = []
+    for i in edges:
+        median = _window_outlier(data[max(0, i - half):min(n, i + half)], data[i], threshold_factor)
+        if median is not None:
+            edge_replacements.append((i, median))
+
+    pending = None
+    if n >= length:
+        windows = np.lib.stride_tricks.sliding_window_view(data, length)
+        for start in range(0, len(windows), block_size):
+            block = np.sort(windows[start:start + block_size], axis=1)
+            centre = data[start + half:start + half + len(block)]
+
+            # np.median takes the mean of the two middle values
+            median = np.mean(block[:, half - 1:half + 1], axis=1)
+            iqr = _sorted_percentile(block, 75) - _sorted_percentile(block, 25)
+
+            # Boundaries in double precision, as the scalar arithmetic of remove_outliers_window gives
+            lower_bound = median.astype(np.float64) - threshold_factor * iqr
+            upper_bound = median.astype(np.float64) + threshold_factor * iqr
+            outliers = (centre < lower_bound) | (centre > upper_bound)
+
+            if pending is not None:
+                data[pending[0]] = pending[1]
+            pending = (start + half + np.flatnonzero(outliers), median[outliers])
+        if pending is not None:
+            data[pending[0]] = pending[1]
+
+    for i, median in edge_replacements:
+        data[i] = median
+    return data
+
+
+def design_bandpass(sampling_rate, freqmin, freqmax, corners):
+    # Butterworth second-order sections as obspy.signal.filter.bandpass designs them, including its fall back
+    # to a highpass when freqmax reaches the Nyquist frequency
+    fe = 0.5 * sampling_rate
+    low = freqmin / fe
+    high = freqmax / fe
+    if high - 1.0 > -1e-6:
+        print(f"Selected high corner frequency ({freqmax}) of bandpass is at or above Nyquist ({fe}). "
+              f"Applying a high-pass instead.")
+        if low > 1:
+            raise ValueError("Selected corner frequency is above Nyquist.")
+        z, p, k = iirfilter(corners, low, btype='highpass', ftype='butter', output='zpk')
+    else:
+        if low > 1:
+            raise ValueError("Selected low corner frequency is above Nyquist.")
+        z, p, k = iirfilter(corners, [low, high], btype='band', ftype='butter', output='zpk')
+    return zpk2sos(z, p, k)
+
+
+def sosfilt_state(sos, data, zi=None, block_size=BLOCK_SIZE):
+    # Forward pass of sosfilt_inplace continuing from the filter state zi (None for a filter at rest), returns
+    # the state after the last sample for the data that follows
+    if zi is None:
+        zi = np.zeros((sos.shape[0],) + data.shape[:-1] + (2,))
+    for block in _blocks(data.shape[-1], block_size):
+        data[..., block], zi = sosfilt(sos, data[..., block], axis=-1, zi=zi)
+    return zi
+
+
+def sosfilt_inplace(sos, data, zerophase=False, block_size=BLOCK_SIZE):
+    # Filters data in place along its last axis, every row in the same call. The data is filtered block by block,
+    # carrying the filter state, so only one block is ever held in double precision. zerophase runs a second pass
+    # backwards over the result, like the zerophase option of obspy.signal.filter.bandpass.
+    zi = sosfilt_state(sos, data, None, block_size)
+    if zerophase:
+        zi = np.zeros_like(zi)
+        for block in reversed(list(_blocks(data.shape[-1], block_size))):
+            backwards = data[..., block][..., ::-1]
+            backwards[...], zi = sosfilt(sos, backwards, axis=-1, zi=zi)
+    return data
+
+
+# Bandpass second-order sections by sampling rate, band, order and phase mode, designed once per process and
+# shared by every trace and day that needs the same filter
+class FilterBank:
+    def __init__(self):
+        self._sos = {}
+        self._lock = threading.Lock()
+
+    def sos(self, sampling_rate, freqmin, freqmax, corners, zerophase=False):
+        key = (float(sampling_rate), float(freqmin), float(freqmax), int(corners), bool(zerophase))
+        with self._lock:
+            sos = self._sos.get(key)
+        if sos is None:
+            sos = design_bandpass(sampling_rate, freqmin, freqmax, corners)
+            with self._lock:
+                sos = self._sos.setdefault(key, sos)
+        return sos
+
+    def filter(self, data, sampling_rate, freqmin=1.0, freqmax=40.0, corners=5, zerophase=False):
+        # data: one trace, or traces of the same sampling rate as the rows of a 2-D array
+        return sosfilt_inplace(self.sos(sampling_rate, freqmin, freqmax, corners, zerophase), data, zerophase)
+
+    def __len__(self):
+        return len(self._sos)
+
+    def __getstate__(self):
+        # Stages are sent to worker processes with their bank; the lock stays behind
+        return {"_sos": dict(self._sos)}
+
+    def __setstate__(self, state):
+        self._sos = state["_sos"]
+        self._lock = threading.Lock()
+
+
+filter_bank = FilterBank()
+
+
+# A preprocessing step. fit() derives what the step needs from the whole trace (a mean, a trend, filter
+# coefficients), apply() then changes the data in place. offset is the index of data[0] in the trace, for
+# steps that depend on the position in the trace. Batched stages only depend on the sampling rate and length
+# of a trace, and apply() also takes traces sharing those as the rows of a 2-D array.
+class Stage:
+    name = "stage"
+    batched = False
+
+    def fit(self, data, stats):
+        return {}
+
+    def apply(self, data, params, offset=0):
+        raise NotImplementedError
+
+
+class Demean(Stage):
+    name = "demean"
+
+    def fit(self, data, stats):
+        total = sum(float(np.sum(data[block], dtype=np.float64)) for block in _blocks(len(data)))
+        return {"mean": total / len(data) if len(data) else 0.0}
+
+    def apply(self, data, params, offset=0):
+        data -= data.dtype.type(params["mean"])
+
+
+class LinearDetrend(Stage):
+    # Least squares line over the sample index, like Trace.detrend("linear")
+    name = "linear"
+
+    def fit(self, data, stats):
+        n = len(data)
+        if n < 2:
+            return {"slope": 0.0, "intercept": float(data[0]) if n else 0.0}
+        x_mean = (n - 1) / 2
+        sum_y = 0.0
+        sum_xy = 0.0
+        for block in _blocks(n):
+            x = np.arange(block.start, block.stop, dtype=np.float64) - x_mean
+            y = data[block].astype(np.float64)
+            sum_y += float(y.sum())
+            sum_xy += float(np.dot(x, y))
+        sum_xx = n * (n * n - 1) / 12  # Sum of (x - x_mean) ** 2 over 0 .. n - 1
+        slope = sum_xy / sum_xx
+        return {"slope": slope, "intercept": sum_y / n - slope * x_mean}
+
+    def apply(self, data, params, offset=0):
+        for block in _blocks(len(data)):
+            trend = params["intercept"] + params["slope"] * np.arange(offset + block.start, offset + block.stop,
+                                                                      dtype=np.float64)
+            data[block] -= trend.astype(data.dtype)
+
+
+class RemoveOutliers(Stage):
+    # method: "threshold" (global mean and std), "iqr" (global median and IQR) or "rolling" (median and IQR of
+    # the window_size samples around each sample), as the functions of stream_processing
+    name = "outliers"
+
+    def __init__(self, method="threshold", threshold_factor=None, window_size=10):
+        if method not in ("threshold", "iqr", "rolling"):
+            raise ValueError(f"Unknown outlier method: {method}")
+        self.method = method
+        self.threshold_factor = threshold_factor if threshold_factor is not None else (
+            1.5 if method == "rolling" else 2)
+        self.window_size = window_size
+
+    def fit(self, data, stats):
+        if not len(data):
+            return {}  # Nothing to replace, apply does not look at the parameters of an empty trace
+        if self.method == "threshold":
+            n = len(data)
+            mean = sum(float(np.sum(data[block], dtype=np.float64)) for block in _blocks(n)) / n
+            variance = sum(float(np.sum((data[block].astype(np.float64) - mean) ** 2)) for block in _blocks(n)) / n
+            return {"centre": mean, "lower": mean - self.threshold_factor * np.sqrt(variance),
+                    "upper": mean + self.threshold_factor * np.sqrt(variance)}
+        if self.method == "iqr":
+            # The one full-size temporary of the pipeline: np.percentile partitions a copy of the trace, in its
+            # own dtype (about 35 MB for a day of float32 at 100 Hz), as exact global quantiles need the whole
+            # trace reordered and the trace itself must stay in time order. Use "rolling" where that matters.
+            quartile1, median, quartile3 = np.percentile(data, [25, 50, 75])
+            iqr = quartile3 - quartile1
+            return {"centre": median, "lower": median - self.threshold_factor * iqr,
+                    "upper": median + self.threshold_factor * iqr}
+        return {}
+
+    def apply(self, data, params, offset=0):
+        if self.method == "rolling":
+            rolling_outliers(data, self.window_size, self.threshold_factor)
+            return
+        for block in _blocks(len(data)):
+            values = data[block]
+            values[(values < params["lower"]) | (values > params["upper"])] = params["centre"]
+
+
+class Bandpass(Stage):
+    name = "bandpass"
+    batched = True
+
+    def __init__(self, freqmin=1.0, freqmax=40.0, corners=5, zerophase=False, bank=None):
+        self.freqmin = freqmin
+        self.freqmax = freqmax
+        self.corners = corners
+        self.zerophase = zerophase
+        self.bank = bank if bank is not None else filter_bank
+
+    def fit(self, data, stats):
+        return {"sos": self.bank.sos(stats.sampling_rate, self.freqmin, self.freqmax, self.corners, self.zerophase)}
+
+    def apply(self, data, params, offset=0):
+        sosfilt_inplace(params["sos"], data, self.zerophase)
+
+
+class Taper(Stage):
+    # Same window as Trace.taper on both sides, applied to the tapered ends only
+    name = "taper"
+    batched = True
+
+    def __init__(self, max_percentage=0.05, type="hann"):
+        if type != "hann":
+            raise ValueError(f"Unsupported taper type: {type}")
+        self.max_percentage = max_percentage
+        self.type = type
+
+    def fit(self, data, stats):
+        npts = data.shape[-1]
+        wlen = min(int(self.max_percentage * npts), int(npts / 2))
+        sides = hann(2 * wlen if 2 * wlen == npts else 2 * wlen + 1)
+        return {"npts": npts, "left": sides[:wlen], "right": sides[len(sides) - wlen:]}
+
+    def apply(self, data, params, offset=0):
+        wlen = len(params["left"])
+        if wlen == 0:
+            return
+        end = offset + data.shape[-1]
+        # Parts of the trace's first and last wlen samples that fall inside data
+        for first, weights in ((0, params["left"]), (params["npts"] - wlen, params["right"])):
+            lo = max(first, offset)
+            hi = min(first + wlen, end)
+            if lo < hi:
+                data[..., lo - offset:hi - offset] *= weights[lo - first:hi - first].astype(data.dtype)
+
+
+STAGES = {"demean": Demean, "linear": LinearDetrend, "outliers": RemoveOutliers, "bandpass": Bandpass,
+          "taper": Taper}
+
+
+def make_stage(spec):
+    # A stage from its config entry: a name, or a mapping with a name and the stage's arguments
+    if isinstance(spec, Stage):
+        return spec
+    if isinstance(spec, str):
+        spec = {"name": spec}
+    arguments = dict(spec)
+    name = arguments.pop("name")
+    if name not in STAGES:
+        raise ValueError(f"Unknown preprocessing stage: {name}")
+    return STAGES[name](**arguments)
+
+
+# Ordered preprocessing stages run on one float32 working copy of each trace. Every stage works in place, so
+# the day is copied once however many stages are enabled. Time spent per stage is summed in timings.
+class PreprocessingPipeline:
+    def __init__(self, stages):
+        self.stages = [make_stage(spec) for spec in stages]
+        self.timings = {}
+
+    @classmethod
+    def from_flags(cls, detrend_demean=True, detrend_linear=True, remove_outliers=True, apply_bandpass=True,
+                   taper=True, outlier_method="threshold", outlier_window=10, bandpass_options=None):
+        # The stages StreamData.process_stream has always run, in its order. bandpass_options are arguments of
+        # Bandpass (freqmin, freqmax, corners, zerophase).
+        stages = []
+        if detrend_demean:
+            stages.append(Demean())
+        if detrend_linear:
+            stages.append(LinearDetrend())
+        if remove_outliers:
+            stages.append(RemoveOutliers(outlier_method, window_size=outlier_window))
+        if apply_bandpass:
+            stages.append(Bandpass(**(bandpass_options or {})))
+        if taper:
+            stages.append(Taper())
+        return cls(stages)
+
+    def process(self, data, stats):
+        # data: one trace, or traces of the same length and sampling rate as the rows of a 2-D array with a list
+        # of their stats. Batched stages run once over all rows.
+        stats_list = stats if isinstance(stats, list) else [stats]
+        rows = data.reshape(len(stats_list), data.shape[-1])
+        for stage in self.stages:
+            start = time.perf_counter()
+            if stage.batched:
+                stage.apply(rows, stage.fit(rows[0], stats_list[0]))
+            else:
+                for row, row_stats in zip(rows, stats_list):
+                    stage.apply(row, stage.fit(row, row_stats))
+            self.timings[stage.name] = self.timings.get(stage.name, 0.0) + time.perf_counter() - start
+        return data
+
+    def run(self, stream):
+        # New stream with the processed data, the input stream is left untouched. Traces of the same length and
+        # sampling rate are copied into the rows of one float32 array, the working copy, and processed together.
+        groups = {}
+        for i, trace in enumerate(stream):
+            groups.setdefault((trace.stats.npts, trace.stats.sampling_rate), []).append(i)
+
+        processed_traces = [None] * len(stream)
+        for (npts, _), indices in groups.items():
+            data = np.empty((len(indices), npts), dtype=np.float32)
+            stats = []
+            for row, i in enumerate(indices):
+                data[row] = stream[i].data
+                stats.append(stream[i].stats.copy())
+            self.process(data, stats)
+            for row, i in enumerate(indices):
+                processed_traces[i] = Trace(data=data[row], header=stats[row])
+        return Stream(traces=processed_traces)
+
+    def timing_summary(self):
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items())
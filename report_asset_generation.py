@@ -1,4 +1,5 @@
 import base64
+import math
 import os
 from datetime import datetime
 
@@ -11,6 +12,15 @@ from matplotlib.legend_handler import HandlerLine2D
 from obspy import UTCDateTime
 
 import account_credentials as credentials
+from earthquake_table import summarize
+
+
+def format_time_error(error):
+    # Residuals are stored in seconds and only turned into text like '+1.25s' for display
+    if error is None or math.isnan(error):
+        return 'N/A'
+    sign = '+' if error > 0 else '-' if error < 0 else ''
+    return f"{sign}{abs(error):.2f}s"
 
 
 def create_png_plot(earthquakes, station, title, fill_map, show_detected, file_path, detected_count, undetected_count):
@@ -196,14 +206,15 @@ def html_catalogue_list(earthquakes, simplified=False):
 
 def html_overall_stats(earthquakes, simplified=False, p_only=False):
     # Calculate statistics
-    total_detected = len([eq for eq in earthquakes if eq.detected])
-    total_catalogued = len([eq for eq in earthquakes if eq.catalogued])
-    catalogued_detected = len([eq for eq in earthquakes if eq.catalogued and eq.detected])
+    summary = summarize(earthquakes)
+    total_detected = summary["total_detected"]
+    total_catalogued = summary["total_catalogued"]
+    catalogued_detected = summary["catalogued_detected"]
     not_in_catalogue = total_detected - catalogued_detected
 
     event_detected_rate = (catalogued_detected / total_catalogued * 100) if total_catalogued > 0 else 0
-    p_detected = len([eq for eq in earthquakes if eq.catalogued and eq.p_detected])
-    s_detected = len([eq for eq in earthquakes if eq.catalogued and eq.s_detected])
+    p_detected = summary["p_detected"]
+    s_detected = summary["s_detected"]
     p_detected_rate = (p_detected / total_catalogued * 100) if total_catalogued > 0 else 0
     s_detected_rate = (s_detected / total_catalogued * 100) if total_catalogued > 0 else 0
 
@@ -259,14 +270,14 @@ def html_event_detail(earthquakes, stream, annotated_stream, path, simplified=Fa
                     <tr><td>Epicentral Distance:</td><td>{eq.epi_distance} km</td></tr>
                     <tr><td>P Predicted Time:</td><td>{eq.p_predicted or 'N/A'}</td></tr>
                     <tr><td>P Detected Time:</td><td>{eq.p_detected or 'N/A'}</td></tr>
-                    <tr><td>P Time Error:</td><td>{getattr(eq, 'p_error', 'N/A')}</td></tr>
+                    <tr><td>P Time Error:</td><td>{format_time_error(eq.p_error)}</td></tr>
                     <tr><td>P Confidence:</td><td>{getattr(eq, 'p_confidence', 'N/A')}</td></tr>""")
 
             if not p_only:
                 parts.append(f"""
                     <tr><td>S Predicted Time:</td><td>{getattr(eq, 's_predicted', 'N/A')}</td></tr>
                     <tr><td>S Detected Time:</td><td>{getattr(eq, 's_detected', 'N/A')}</td></tr>
-                    <tr><td>S Time Error:</td><td>{getattr(eq, 's_error', 'N/A')}</td></tr>
+                    <tr><td>S Time Error:</td><td>{format_time_error(eq.s_error)}</td></tr>
                     <tr><td>S Confidence:</td><td>{getattr(eq, 's_confidence', 'N/A')}</td></tr>""")
 
             parts.append("</table></div><br><br>")
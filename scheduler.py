@@ -0,0 +1,251 @@
+import datetime
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from obspy import UTCDateTime, read
+
+from catalog import Catalog
+from catalog_cache import CatalogCache
+from main import bandpass_config, process_stream_logic, detect_phases_logic, match_events_logic
+from model_registry import warm_up_models
+from station import Station
+
+
+class RateLimiter:
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        # Callers queue on the lock, so requests to one provider are spaced by min_interval
+        with self._lock:
+            delay = self._next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_time = time.monotonic() + self.min_interval
+
+
+class ProviderRateLimits:
+    def __init__(self, intervals=None, default_interval=1.0):
+        self.intervals = intervals or {}
+        self.default_interval = default_interval
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def wait(self, provider):
+        with self._lock:
+            if provider not in self._limiters:
+                self._limiters[provider] = RateLimiter(self.intervals.get(provider, self.default_interval))
+            limiter = self._limiters[provider]
+        limiter.wait()
+
+
+# Completed stages of one date, kept in the date folder so an interrupted backfill resumes where it stopped
+class BackfillState:
+    def __init__(self, date_folder):
+        self.path = os.path.join(date_folder, "backfill_state.json")
+        self.data = {"completed": []}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as file:
+                    self.data = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable backfill state {self.path}: {e}")
+
+    def completed(self, stage):
+        return stage in self.data["completed"]
+
+    def mark(self, stage, **values):
+        if stage not in self.data["completed"]:
+            self.data["completed"].append(stage)
+        self.data.update(values)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as file:
+            json.dump(self.data, file)
+
+    def picks(self):
+        return [{
+            "peak_time": UTCDateTime(pick['peak_time']),
+            "peak_confidence": pick['peak_confidence'],
+            "phase": pick['phase']
+        } for pick in self.data.get("picks", [])]
+
+
+def serialize_picks(picks):
+    return [{
+        "peak_time": UTCDateTime(pick['peak_time']).isoformat(),
+        "peak_confidence": float(pick['peak_confidence']),
+        "phase": pick['phase']
+    } for pick in picks]
+
+
+def _chunk_settings(config):
+    chunk_length = config['chunk_length'] if config.get('streaming_inference') else None
+    return chunk_length, config.get('chunk_overlap', 120)
+
+
+# Model stage, run in a worker process. The stream is read back from the day file written by the download stage,
+# so the worker makes no requests of its own.
+def process_day(network, code, url, date_str, latitude, longitude, filepath, config):
+    station = Station(network, code, url, date_str, latitude=latitude, longitude=longitude)
+    station.stream.original_stream = read(filepath)
+
+    chunk_length, chunk_overlap = _chunk_settings(config)
+    process_stream_logic(station, config['detrend_demean'], config['detrend_linear'], config['remove_outliers'],
+                         config['apply_bandpass'], config['taper'], config['denoise'], config['save_processed'],
+                         chunk_length, chunk_overlap, config.get('outlier_method', 'threshold'),
+                         config.get('outlier_window', 10), config.get('preprocessing_stages') or None,
+                         bandpass_config(config), config.get('preprocessing_workers', 1))
+    picked_signals, _, p_count, s_count = detect_phases_logic(station, config['p_threshold'], config['s_threshold'],
+                                                              config['p_only'], config['save_annotated'],
+                                                              chunk_length=chunk_length, chunk_overlap=chunk_overlap)
+    print(f"{date_str}: P waves detected: {p_count}, S waves detected: {s_count}")
+    return picked_signals
+
+
+class BackfillScheduler:
+    def __init__(self, config, start_date, end_date, io_workers=4, model_workers=1, rate_limits=None,
+                 default_rate_interval=1.0, max_days_in_flight=None):
+        self.config = config
+        self.network = config['network']
+        self.code = config['station_code']
+        self.url = config['data_provider_url']
+        self.catalog_providers = config['catalog_providers']
+        if isinstance(self.catalog_providers, str):
+            self.catalog_providers = [provider.strip() for provider in self.catalog_providers.split(',')]
+
+        self.start_date = start_date
+        self.end_date = end_date
+        self.io_workers = io_workers
+        self.model_workers = model_workers
+        self.max_days_in_flight = max_days_in_flight or (io_workers + 2 * model_workers)
+        self.rate_limits = ProviderRateLimits(rate_limits, default_rate_interval)
+        # Backfilled dates are mostly settled, so their catalogues are downloaded once
+        self.catalog_cache = CatalogCache(ttl=config.get('catalog_cache_ttl', 3600),
+                                          settle_days=config.get('catalog_settle_days', 7)) \
+            if config.get('catalog_cache', True) else None
+
+        self.results = {}
+
+    def dates(self):
+        current_date = self.start_date
+        while current_date <= self.end_date:
+            yield current_date.strftime('%Y-%m-%d')
+            current_date += datetime.timedelta(days=1)
+
+    def date_folder(self, date_str):
+        return os.path.join(os.getcwd(), "data", f"{self.network}.{self.code}", date_str)
+
+    def download(self, date_str, state):
+        self.rate_limits.wait(self.url)
+        station = Station(self.network, self.code, self.url, date_str)
+        overwrite = self.config.get('overwrite', False) and not state.completed("download")
+        result = station.download_day_stream(overwrite=overwrite, parts=self.config.get('download_parts', 3),
+                                             max_retries=self.config.get('download_retries', 2))
+        if result['status'] == 'error':
+            raise RuntimeError(result['message'] or "No data downloaded.")
+
+        # The model stage reads the stream from the day file in its own process
+        station.stream.original_stream = None
+        return station, result['filepath']
+
+    def request_catalog(self, station):
+        catalog = Catalog(station, radmin=self.config['radmin'], radmax=self.config['radmax'],
+                          minmag=self.config['minmag'], maxmag=self.config['maxmag'],
+                          catalogue_providers=self.catalog_providers, rate_limiter=self.rate_limits,
+                          travel_time_mode=self.config.get('travel_time_mode', 'table'),
+                          catalogue_mode=self.config.get('catalog_mode', 'first'),
+                          provider_timeout=self.config.get('catalog_timeout', 60), catalog_cache=self.catalog_cache)
+        # A day without catalogued events is an answer too, only failed queries are retried on resume
+        if not catalog.request_catalogue():
+            raise RuntimeError("Failed to download catalog data.")
+        return catalog
+
+    def match(self, catalog, picks):
+        catalog.station.stream.picked_signals = picks
+        detected_catalogued, detected_not_catalogued = match_events_logic(
+            catalog, self.config['tolerance_p'], self.config['tolerance_s'], self.config['p_only'],
+            self.config['save_results'], self.config.get('merge_detections', False),
+            self.config.get('merge_strategy', 'sweep'), self.config.get('detected_merging_threshold', 3.0),
+            self.config.get('assignment_mode', 'greedy'))
+        return (f"{detected_catalogued} of {len(catalog.original_catalog_earthquakes)} catalogued events detected, "
+                f"{detected_not_catalogued} detected but not catalogued")
+
+    def run(self):
+        waiting = deque(self.dates())
+        days = {}
+        pending = {}
+
+        context = multiprocessing.get_context("spawn")
+        with ThreadPoolExecutor(max_workers=self.io_workers) as io_pool, \
+                ThreadPoolExecutor(max_workers=1) as match_pool, \
+                ProcessPoolExecutor(max_workers=self.model_workers, mp_context=context,
+                                    initializer=warm_up_models) as model_pool:
+
+            def start_next_days():
+                while waiting and len(days) < self.max_days_in_flight:
+                    date_str = waiting.popleft()
+                    state = BackfillState(self.date_folder(date_str))
+                    if state.completed("match"):
+                        print(f"{date_str}: already completed, skipping.")
+                        continue
+                    print(f"Processing data for {date_str}")
+                    days[date_str] = {"state": state}
+                    pending[io_pool.submit(self.download, date_str, state)] = ("download", date_str)
+
+            def finish_day(date_str, message):
+                self.results[date_str] = message
+                print(f"{date_str}: {message}")
+                days.pop(date_str, None)
+
+            start_next_days()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, date_str = pending.pop(future)
+                    day = days.get(date_str)
+                    if day is None:
+                        continue  # Another stage of this date already failed
+
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        finish_day(date_str, f"Failed at {stage} stage: {e}")
+                        continue
+
+                    state = day["state"]
+                    if stage == "download":
+                        state.mark("download")
+                        station, filepath = result
+                        day["station"] = station
+                        pending[io_pool.submit(self.request_catalog, station)] = ("catalog", date_str)
+                        if state.completed("process"):
+                            day["picks"] = state.picks()
+                        else:
+                            process_future = model_pool.submit(process_day, self.network, self.code, self.url,
+                                                               date_str, station.latitude, station.longitude,
+                                                               filepath, self.config)
+                            pending[process_future] = ("process", date_str)
+                    elif stage == "catalog":
+                        state.mark("catalog")
+                        day["catalog"] = result
+                    elif stage == "process":
+                        state.mark("process", picks=serialize_picks(result))
+                        day["picks"] = result
+                    elif stage == "match":
+                        state.mark("match")
+                        finish_day(date_str, result)
+                        continue
+
+                    if "catalog" in day and "picks" in day:
+                        pending[match_pool.submit(self.match, day["catalog"], day["picks"])] = ("match", date_str)
+
+                start_next_days()
+
+        return self.results
@@ -4,12 +4,15 @@ from obspy import UTCDateTime, read, Stream
 from obspy.clients.fdsn import Client
 from obspy.clients.fdsn.header import FDSNNoDataException
 
+from archive import WaveformArchive, covers
+from station_cache import station_cache
 from stream import StreamData
 import os
 import numpy as np
 from obspy import Stream, read
 from obspy.clients.fdsn import Client
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 class Station:
     def __init__(self, network, code, url, report_date=None,latitude=None, longitude=None,):
         self.network = network
@@ -27,7 +30,8 @@ class Station:
         self.stream = StreamData(self)
 
         self.generate_path(self.report_date)
-        self.fetch_coordinates()
+        if self.latitude is None or self.longitude is None:
+            self.fetch_coordinates()
 
     def __str__(self):
         return (f"Station {self.network}.{self.code} at {self.url}\n"
@@ -36,7 +40,14 @@ class Station:
                 f"Data Folder: {self.date_folder}\n"
                 f"Report Folder: {self.report_folder}\n")
 
-    def fetch_coordinates(self):
+    def fetch_coordinates(self, use_cache=True):
+        if use_cache:
+            cached = station_cache.get(self.network, self.code, self.url)
+            if cached is not None:
+                self.latitude = cached['latitude']
+                self.longitude = cached['longitude']
+                return
+
         retry_count = 1  # Set the number of retries
         while retry_count >= 0:
             try:
@@ -46,6 +57,8 @@ class Station:
                                                 level='station')
                 self.latitude = inventory[0][0].latitude
                 self.longitude = inventory[0][0].longitude
+                station_cache.put(self.network, self.code, self.url, latitude=self.latitude,
+                                  longitude=self.longitude, elevation=inventory[0][0].elevation)
                 print("Coordinates fetched successfully.")
                 break  # Break the loop if success
             except Exception as e:
@@ -81,7 +94,7 @@ class Station:
         os.makedirs(self.report_folder, exist_ok=True)
         #os.makedirs(self.monitoring_folder, exist_ok=True)
 
-    def download_day_stream(self, overwrite=True):
+    def download_day_stream(self, overwrite=True, parts=3, max_retries=2, retry_backoff=5, archive=None):
         channel = "*Z*"
         location = "*"
         date_str = self.report_date.strftime("%Y-%m-%d")
@@ -95,38 +108,58 @@ class Station:
         status = None
         message = ""
 
-        if os.path.isfile(filepath) and not overwrite:
-            self.stream.original_stream = read(filepath)  # Read and set the stream object
+        start_time = self.report_date - 300
+        end_time = self.report_date + 86700
+        existing = read(filepath) if os.path.isfile(filepath) and not overwrite else None
+
+        # A day file written before all of the day was available is completed from the archive and the provider
+        if existing is not None and covers(existing, start_time, end_time):
+            self.stream.original_stream = existing  # Set the stream object
             status = "exists"
             message = f"Data for {date_str} already exists."
         else:
-            client = Client(self.url)
-            start_time = self.report_date - 300
-            end_time = self.report_date + 86700
-            duration = int((end_time - start_time) / 3)
+            duration = int((end_time - start_time) / parts)
+
+            # Only the spans the local archive does not hold yet are requested, which includes the
+            # padding shared with neighbouring days and parts left over from an earlier failed attempt
+            archive = archive or WaveformArchive(os.path.join(os.path.dirname(self.station_folder), "archive"))
+            key = archive.make_key(self.network, self.code, location, channel)
+            gaps = [(start_time, end_time)] if overwrite else archive.missing(key, start_time, end_time)
+
+            requests = []
+            for gap_start, gap_end in gaps:
+                part_start = gap_start
+                while part_start < gap_end:
+                    part_end = min(part_start + duration, gap_end)
+                    requests.append((part_start, part_end))
+                    part_start = part_end
+
+            # Fetch all missing parts concurrently and store each one in the archive as it arrives
+            failed_parts = 0
+            if requests:
+                with ThreadPoolExecutor(max_workers=min(parts, len(requests))) as executor:
+                    futures = {executor.submit(self.download_part, location, channel, part_start, part_end,
+                                               max_retries, retry_backoff): (part_start, part_end)
+                               for part_start, part_end in requests}
+
+                    for future in as_completed(futures):
+                        part_start, part_end = futures[future]
+                        try:
+                            archive.add(future.result(), key, part_start, part_end)
+                            print(f"Part {part_start} - {part_end} downloaded for {date_str}.\n")
+                        except FDSNNoDataException:
+                            # An answer as well, e.g. after the station stopped: not asked again until it expires
+                            archive.add_no_data(key, part_start, part_end)
+                            print(f"No data for part {part_start} - {part_end} of {date_str}.\n")
+                        except Exception as e:
+                            message += f"Failed to download part {part_start} - {part_end} of the data: {e}\n"
+                            failed_parts += 1
+
             full_stream = Stream()
-            download_successful = True
-
-            for i in range(3):
-                part_start = start_time + i * duration
-                part_end = part_start + duration if i < 2 else end_time
-                try:
-                    partial_st = client.get_waveforms(self.network, self.code, location, channel, part_start, part_end,
-                                                      attach_response=True)
-                    partial_st.merge(method=0)  # Ensure no overlapping data, handle merging logic based on your data
-                    for tr in partial_st:
-                        if isinstance(tr.data, np.ma.masked_array):
-                            tr.data = tr.data.filled(
-                                fill_value=0)  # Fill masked values before adding to the full stream
-                    full_stream += partial_st
-                    # message += f"Part {i + 1} downloaded for {date_str}.\n"
-                    print(f"Part {i + 1} downloaded for {date_str}.\n")
-                except Exception as e:
-                    message += f"Failed to download part {i + 1} of the data: {e}\n"
-                    download_successful = False
-                    break
-
-            if download_successful and full_stream.count() > 0:
+            if not failed_parts:
+                full_stream = archive.get_waveforms(self.network, self.code, location, channel, start_time, end_time)
+
+            if not failed_parts and full_stream.count() > 0:
                 full_stream.merge(method=0)  # Final merge before writing
                 # Convert any remaining masked arrays if they exist
                 for tr in full_stream:
@@ -135,10 +168,34 @@ class Station:
                 os.makedirs(path, exist_ok=True)
                 full_stream.write(filepath)
                 self.stream.original_stream = full_stream
-                status = "success"
+                if requests:
+                    status = "success"
+                else:
+                    status = "exists"
+                    message = f"Data for {date_str} loaded from the local archive."
             else:
                 status = "error"
-                if full_stream.count() == 0:
+                if not failed_parts and full_stream.count() == 0:
                     message += f"No data available for {date_str}."
 
         return {"status": status, "message": message.strip(), "filepath": filepath if status != "error" else None}
+
+    def download_part(self, location, channel, part_start, part_end, max_retries=2, retry_backoff=5):
+        attempt = 0
+        while True:
+            try:
+                client = Client(self.url)
+                partial_st = client.get_waveforms(self.network, self.code, location, channel, part_start, part_end,
+                                                  attach_response=True)
+                break
+            except FDSNNoDataException:
+                raise
+            except Exception as e:
+                if attempt >= max_retries:
+                    raise
+                delay = retry_backoff * 2 ** attempt
+                print(f"Download of {part_start} - {part_end} failed: {e}. Retrying in {delay} seconds...")
+                time.sleep(delay)
+                attempt += 1
+
+        return partial_st
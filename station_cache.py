@@ -0,0 +1,54 @@
+import json
+import os
+import threading
+import time
+
+# Station coordinates hardly ever change, so a week old entry is still good
+STATION_CACHE_TTL = 7 * 24 * 3600
+
+_cache_lock = threading.Lock()
+
+
+# Persistent cache of station metadata from FDSN get_stations, keyed by provider, network and station
+class StationCache:
+    def __init__(self, path=None, ttl=STATION_CACHE_TTL):
+        self._path = path
+        self.ttl = ttl
+
+    @property
+    def path(self):
+        # Resolved on use, like the station folders, so it follows the working directory
+        return self._path or os.path.join(os.getcwd(), "data", "station_cache.json")
+
+    @staticmethod
+    def make_key(network, code, url):
+        return f"{url}|{network}.{code}"
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable station cache {self.path}: {e}")
+            return {}
+
+    def get(self, network, code, url):
+        entry = self.load().get(self.make_key(network, code, url))
+        if entry is None or time.time() - entry['fetched_at'] > self.ttl:
+            return None
+        return entry
+
+    def put(self, network, code, url, **metadata):
+        with _cache_lock:
+            entries = self.load()
+            entries[self.make_key(network, code, url)] = dict(metadata, fetched_at=time.time())
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as file:
+                json.dump(entries, file)
+            os.replace(temp_path, self.path)
+
+
+station_cache = StationCache()
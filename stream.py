@@ -1,9 +1,15 @@
-import numpy as np
-import seisbench.models as sbm
-import torch
 from Other.utils import *
+from obspy import Stream
 from obspy.core import AttribDict
-from obspy.signal.filter import bandpass
+
+from model_registry import get_model
+from parallel_preprocessing import ParallelPreprocessor
+from preprocessing import PreprocessingPipeline
+from phase_cache import phase_cache_key, load_phase_cache, save_phase_cache
+from stream_processing import remove_outliers_IQR, remove_outliers_rolling, remove_outliers_threshold
+
+# Pretrained model used for phase picking
+PHASE_MODEL = ("EQTransformer", "original")
 
 
 class StreamData:
@@ -12,59 +18,81 @@ class StreamData:
         self.original_stream = stream
         self.processed_stream = None
         self.annotated_stream = None
+        self.raw_picks = None
         self.picked_signals = None
+        self.preprocessing_timings = {}
 
     def process_stream(self, detrend_demean=True, detrend_linear=True, remove_outliers=True,
-                       apply_bandpass=True, taper=True, denoise=True):
+                       apply_bandpass=True, taper=True, denoise=True, chunk_length=None, chunk_overlap=120,
+                       outlier_method="threshold", outlier_window=10, stages=None,
+                       bandpass_options=None, workers=1):
         if self.original_stream is None:
             raise ValueError("Original stream is not set.")
 
-        # Create a copy of the original stream to process
-        stream_to_process = self.original_stream.copy()
-
-        if detrend_demean:
-            # Remove the mean from the data
-            stream_to_process.detrend("demean")
-
-        if detrend_linear:
-            # Remove the linear trend from the data
-            stream_to_process.detrend("linear")
-
-        for trace in stream_to_process:
-            if remove_outliers:
-                # Remove outliers from the trace
-                trace = self.remove_outliers(trace)
-
-            if apply_bandpass:
-                # Apply a bandpass filter to the trace data
-                freqmin = 1
-                freqmax = 40
-                corners = 5
-                df = trace.stats.sampling_rate
-                trace.data = bandpass(trace.data, freqmin=freqmin, freqmax=freqmax, df=df, corners=corners)
-
-        if taper:
-            for trace in stream_to_process:
-                trace.taper(max_percentage=0.05, type="hann")
+        # One float32 copy of the original stream goes through the preprocessing stages in place. stages, a
+        # list of stage names or {name: ..., arguments} mappings, replaces the flags when given. With more than
+        # one worker the traces are processed in segments by a pool of processes.
+        if stages:
+            pipeline = PreprocessingPipeline(stages)
+        else:
+            pipeline = PreprocessingPipeline.from_flags(detrend_demean, detrend_linear, remove_outliers,
+                                                        apply_bandpass, taper, outlier_method, outlier_window,
+                                                        bandpass_options)
+        stream_to_process = ParallelPreprocessor(pipeline, workers).run(self.original_stream)
+        self.preprocessing_timings = pipeline.timings
+        if pipeline.timings:
+            print(f"Preprocessing: {pipeline.timing_summary()}")
 
         if denoise:
-            stream_to_process = self.denoise(stream_to_process)
+            stream_to_process = self.denoise(stream_to_process, chunk_length, chunk_overlap)
 
         self.processed_stream = stream_to_process
 
-    def denoise(self, stream):
+    def denoise(self, stream, chunk_length=None, chunk_overlap=120):
+        if chunk_length:
+            return denoise_stream_chunked(stream, chunk_length, chunk_overlap)
         return denoise_stream(stream)
 
-    def remove_outliers(self, trace, threshold_factor=2):
-        return remove_outliers_threshold(trace, threshold_factor)
+    def remove_outliers(self, trace, threshold_factor=2, method="threshold", window_size=10):
+        if method == "threshold":
+            return remove_outliers_threshold(trace, threshold_factor)
+        if method == "iqr":
+            return remove_outliers_IQR(trace, threshold_factor)
+        if method == "rolling":
+            # Median and IQR of the window_size samples around each sample
+            return remove_outliers_rolling(trace, window_size)
+        raise ValueError(f"Unknown outlier method: {method}")
+
+    def predict_and_annotate(self, use_cache=True, chunk_length=None, chunk_overlap=120):
+        # Only station-level streams have a date folder to keep the cache in
+        use_cache = use_cache and getattr(self.station, 'date_folder', None) is not None
+
+        if use_cache:
+            variant = f"chunked-{chunk_length}-{chunk_overlap}" if chunk_length else None
+            key = phase_cache_key(self.processed_stream, *PHASE_MODEL, variant=variant)
+            cached = load_phase_cache(self.station, key)
+            if cached is not None:
+                print("Phase picks loaded from cache.")
+                self.raw_picks, self.annotated_stream = cached
+                self.picked_signals = list(self.raw_picks)
+                return
+
+        if chunk_length:
+            self.raw_picks, self.annotated_stream = predict_and_annotate_chunked(self.processed_stream, chunk_length,
+                                                                                 chunk_overlap)
+        else:
+            self.raw_picks, self.annotated_stream = predict_and_annotate(self.processed_stream)
+        self.picked_signals = list(self.raw_picks)
 
-    def predict_and_annotate(self):
-        self.picked_signals, self.annotated_stream = predict_and_annotate(self.processed_stream)
+        if use_cache:
+            save_phase_cache(self.station, key, self.raw_picks, self.annotated_stream)
 
     def filter_confidence(self, p_threshold, s_threshold):
-        # Filter detections based on threshold conditions
+        # Filter detections based on threshold conditions, starting from the unfiltered picks
+        # so the thresholds can be changed without running the model again
+        detections = self.raw_picks if self.raw_picks is not None else self.picked_signals
         self.picked_signals = [
-            detection for detection in self.picked_signals
+            detection for detection in detections
             if (detection['phase'] == "P" and detection['peak_confidence'] >= p_threshold) or
                (detection['phase'] == "S" and detection['peak_confidence'] >= s_threshold)
         ]
@@ -117,16 +145,8 @@ class StreamData:
 
 # Denoise stream with pretrained DeepDenoiser
 def denoise_stream(stream):
-    # Get pretrained model for denosing
-    model = sbm.DeepDenoiser.from_pretrained("original")
-
-    # Enable GPU processing if available
-    if torch.cuda.is_available():
-        torch.backends.cudnn.enabled = False
-        model.cuda()
-        print("CUDA available. Denosing using GPU")
-    else:
-        print("CUDA not available. Denosing using CPU")
+    # Get pretrained model for denosing, loaded once per process
+    model = get_model("DeepDenoiser", "original")
 
     # Save original channel names
     original_channels = [tr.stats.channel for tr in stream]
@@ -141,34 +161,26 @@ def denoise_stream(stream):
     return annotations
 
 
-def remove_outliers_threshold(trace, threshold_factor=2):
-    # Calculate global mean and standard deviation for the trace
-    global_mean = trace.data.mean()
-    global_std = trace.data.std()
+def predict_and_annotate(processed_stream):
+    # Get pretrained model for phase picking, loaded once per process
+    model = get_model(*PHASE_MODEL)
 
-    # Identify outliers as points beyond the threshold times the standard deviation from the mean
-    outliers = np.abs(trace.data - global_mean) > (threshold_factor * global_std)
-    trace.data[outliers] = global_mean  # Replace outliers with the global mean
-    return trace
+    # Run the network once and keep the probability traces, then extract picks from them.
+    # This is what model.classify does internally, without discarding the annotations.
+    argdict = model.default_args.copy()
+    stream_to_classify = model.classify_stream_pre(processed_stream, argdict)
+    annotated_stream = model.annotate(stream_to_classify, **argdict)
+    outputs = model.classify_aggregate(annotated_stream, argdict)
+    predictions = picks_to_predictions(outputs.picks)
 
+    rename_annotation_channels(annotated_stream)
 
-def predict_and_annotate(processed_stream):
-    # Get pretrained model for phase picking
-    model = sbm.EQTransformer.from_pretrained("original")
-
-    # Enable GPU processing if available
-    if torch.cuda.is_available():
-        torch.backends.cudnn.enabled = False
-        model.cuda()
-        print("CUDA available. Phase-picking using GPU")
-    else:
-        print("CUDA not available. Phase-picking using CPU")
-
-    # Perform classification to extract picks
-    outputs = model.classify(processed_stream)
-    predictions = []
+    return predictions, annotated_stream
 
-    for pick in outputs.picks:
+
+def picks_to_predictions(picks):
+    predictions = []
+    for pick in picks:
         pick_dict = pick.__dict__
         pick_data = {
             "peak_time": pick_dict["peak_time"],
@@ -176,66 +188,97 @@ def predict_and_annotate(processed_stream):
             "phase": pick_dict["phase"]
         }
         predictions.append(pick_data)
+    return predictions
 
-    # Perform annotation to visualize the picks within the stream
-    annotated_stream = model.annotate(processed_stream)
 
+def rename_annotation_channels(annotated_stream):
     # Adjust channel names in the annotated stream to include the original channel plus the model suffix
     for tr in annotated_stream:
         parts = tr.stats.channel.split('_')
         if len(parts) > 1:
             tr.stats.channel = '_' + '_'.join(parts[1:])  # Join parts starting from the first underscore
 
-    return predictions, annotated_stream
 
+# Split a stream into consecutive windows of window_length seconds, each padded by overlap seconds on
+# both sides. Slices share memory with the input stream, so no window is copied.
+def iter_stream_windows(stream, window_length, overlap):
+    if window_length <= 0 or overlap < 0:
+        raise ValueError("Window length must be positive and overlap must not be negative.")
+
+    starttime = min(tr.stats.starttime for tr in stream)
+    endtime = max(tr.stats.endtime for tr in stream)
+
+    window_start = starttime
+    while window_start < endtime:
+        window_end = min(window_start + window_length, endtime)
+        padded = stream.slice(window_start - overlap, window_end + overlap)
+        yield window_start, window_end, window_end >= endtime, padded
+        window_start = window_end
+
+
+def trim_to_window(stream, window_start, window_end, is_last):
+    # Keep [window_start, window_end) so neighbouring windows do not share samples
+    for tr in stream:
+        end = window_end if is_last else window_end - 0.5 * tr.stats.delta
+        tr.trim(window_start, end, nearest_sample=False)
+    return Stream([tr for tr in stream if tr.stats.npts > 0])
 
-# Methods for removing outliers
 
-def remove_outliers_IQR(trace, threshold_factor=2):
-    # Calculate outliers using the median and IQR
-    median = np.median(trace.data)
-    quartile1 = np.percentile(trace.data, 25)
-    quartile3 = np.percentile(trace.data, 75)
-    iqr = quartile3 - quartile1
-    lower_bound = median - (threshold_factor * iqr)
-    upper_bound = median + (threshold_factor * iqr)
+# Streaming phase picking: yields the picks and annotations of each window as soon as it is processed,
+# so memory stays bounded by the window size and downstream matching can start before the day is done
+def iter_predict_and_annotate(processed_stream, window_length=3600, overlap=120):
+    model = get_model(*PHASE_MODEL)
+    argdict = model.default_args.copy()
 
-    # Identify data points that are outside the boundaries
-    outliers = (trace.data < lower_bound) | (trace.data > upper_bound)
-    # Replace outliers with the median, or consider other replacement strategies
-    trace.data[outliers] = median
-    return trace
+    for window_start, window_end, is_last, window in iter_stream_windows(processed_stream, window_length,
+                                                                         overlap):
+        if not any(tr.stats.npts for tr in window):
+            continue
 
+        window = model.classify_stream_pre(window, argdict)
+        annotated = model.annotate(window, **argdict)
+        outputs = model.classify_aggregate(annotated, argdict)
+
+        # Picks are owned by the window their peak falls into, the overlap only provides context
+        predictions = [
+            prediction for prediction in picks_to_predictions(outputs.picks)
+            if window_start <= prediction['peak_time'] and (prediction['peak_time'] < window_end or is_last)
+        ]
+
+        annotated = trim_to_window(annotated, window_start, window_end, is_last)
+        rename_annotation_channels(annotated)
+
+        yield predictions, annotated
 
-def remove_outliers_window(trace, window_size=10, threshold_factor=1.5):
-    # Prepare an empty array to store the processed data
-    filtered_data = np.copy(trace.data)
 
-    # Iterate through the data, processing each window
-    for i in range(len(trace.data)):
-        # Calculate the start and end index for the window
-        start_index = max(0, i - window_size // 2)
-        end_index = min(len(trace.data), i + window_size // 2)
+def predict_and_annotate_chunked(processed_stream, window_length=3600, overlap=120):
+    predictions = []
+    annotated_stream = Stream()
+    for window_predictions, annotated in iter_predict_and_annotate(processed_stream, window_length, overlap):
+        predictions.extend(window_predictions)
+        annotated_stream += annotated
+
+    # Stitch the windows back into one trace per annotation channel
+    annotated_stream.merge(method=1)
+    return predictions, annotated_stream
 
-        # Extract data within the window
-        window_data = trace.data[start_index:end_index]
 
-        # Compute median and IQR within the window
-        median = np.median(window_data)
-        quartile1 = np.percentile(window_data, 25)
-        quartile3 = np.percentile(window_data, 75)
-        iqr = quartile3 - quartile1
+def denoise_stream_chunked(stream, window_length=3600, overlap=120):
+    model = get_model("DeepDenoiser", "original")
+    original_channels = {tr.id: tr.stats.channel for tr in stream}
 
-        # Calculate boundaries for outliers
-        lower_bound = median - (threshold_factor * iqr)
-        upper_bound = median + (threshold_factor * iqr)
+    denoised_stream = Stream()
+    for window_start, window_end, is_last, window in iter_stream_windows(stream, window_length, overlap):
+        if not any(tr.stats.npts for tr in window):
+            continue
 
-        # Check if the current point is an outlier and replace it if necessary
-        if trace.data[i] < lower_bound or trace.data[i] > upper_bound:
-            filtered_data[i] = median  # Replace outlier with window median
+        window_channels = [original_channels.get(tr.id, tr.stats.channel) for tr in window]
+        annotations = model.annotate(window)
+        for tr, channel in zip(annotations, window_channels):
+            tr.stats.channel = channel
 
-    # Update original data
-    trace.data = filtered_data
-    return trace
+        denoised_stream += trim_to_window(annotations, window_start, window_end, is_last)
 
+    denoised_stream.merge(method=1)
+    return denoised_stream
 
@@ -2,11 +2,12 @@ import bisect
 from collections import deque
 import os
 import numpy as np
-from obspy.signal.filter import bandpass
-import seisbench.models as sbm
 from Other.utils import *
 from obspy.core import AttribDict
 
+from model_registry import get_model
+from preprocessing import PreprocessingPipeline, rolling_outliers
+
 
 # Methods for removing outliers
 def remove_outliers_threshold(trace, threshold_factor=2):
@@ -109,27 +110,18 @@ def remove_outliers_window_optimized(trace, window_size=10, threshold_factor=1.5
     return trace
 
 
-# Apply conventional methods for signal cleaning
-def process_stream(stream, detrend_demean=True, detrend_linear=True, remove_outliers=True, bandpass_filter=True):
-    if detrend_demean:
-        # Remove the mean from the data
-        stream.detrend("demean")
-
-    if detrend_linear:
-        # Remove the linear trend from the data
-        stream.detrend("linear")
-
-    for trace in stream:
-        if remove_outliers:
-            # Remove outliers from the trace
-            trace = remove_outliers_threshold(trace)
+def remove_outliers_rolling(trace, window_size=10, threshold_factor=1.5):
+    # Same result as remove_outliers_window, vectorised over strided windows
+    trace.data = rolling_outliers(np.copy(trace.data), window_size, threshold_factor)
+    return trace
 
-        if bandpass_filter:
-            # Apply a bandpass filter to the trace data
-            trace.data = bandpass(trace.data, freqmin=1, freqmax=40, df=trace.stats.sampling_rate, corners=5)
 
-    # Return the processed stream
-    return stream
+# Apply conventional methods for signal cleaning
+def process_stream(stream, detrend_demean=True, detrend_linear=True, remove_outliers=True, bandpass_filter=True):
+    # Runs the same steps through the preprocessing pipeline, on one float32 copy of each trace
+    pipeline = PreprocessingPipeline.from_flags(detrend_demean, detrend_linear, remove_outliers, bandpass_filter,
+                                                taper=False)
+    return pipeline.run(stream)
 
 # Applies taper to stream to reduce edge effects
 def taper_stream(stream, max_percentage=0.05, type="hann"):
@@ -139,16 +131,8 @@ def taper_stream(stream, max_percentage=0.05, type="hann"):
 
 # Denoise stream with pretrained DeepDenoiser
 def denoise_stream(stream):
-    # Get pretrained model for denosing
-    model = sbm.DeepDenoiser.from_pretrained("original")
-
-    # Enable GPU processing if available
-    if torch.cuda.is_available():
-        torch.backends.cudnn.enabled = False
-        model.cuda()
-        print("CUDA available. Denosing using GPU")
-    else:
-        print("CUDA not available. Denosing using CPU")
+    # Get pretrained model for denosing, loaded once per process
+    model = get_model("DeepDenoiser", "original")
 
     # Save original channel names
     original_channels = [tr.stats.channel for tr in stream]
@@ -0,0 +1,277 @@
+import time
+
+import numpy as np
+from obspy import Trace
+from obspy.core import Stats
+from scipy.signal import lfilter
+from scipy.signal.windows import hann
+
+from preprocessing import (Bandpass, Demean, LinearDetrend, PreprocessingPipeline, RemoveOutliers, Taper,
+                           make_stage, rolling_outliers, sosfilt_state)
+
+# Seconds of data collected before the first output, the running mean and trend start from a fit on them
+STREAMING_WARMUP = 60.0
+# Time constant in seconds of the running mean and trend
+STREAMING_TREND_WINDOW = 600.0
+
+
+def _empty():
+    return np.empty(0, dtype=np.float32)
+
+
+# Streaming counterpart of a pipeline stage. process() takes the next chunk of the feed and returns the samples
+# that are final, in place where it can; stages that need data after a sample hold it back until flush().
+class StreamingStage:
+    def __init__(self, stage, stats):
+        self.stage = stage
+        self.stats = stats
+
+    def process(self, data):
+        return data
+
+    def flush(self):
+        return _empty()
+
+
+def _smoothing(window, sampling_rate):
+    # Weight of the newest sample in an exponentially weighted average with a time constant of window seconds
+    return 1.0 - np.exp(-1.0 / max(window * sampling_rate, 1.0))
+
+
+def _smooth(values, alpha, state):
+    # Exponentially weighted running average of values in double precision, starting from the average
+    # state before the first value. Returns the averages and the last one.
+    averages, _ = lfilter([alpha], [1.0, alpha - 1.0], values, zi=[(1.0 - alpha) * state])
+    return averages, averages[-1] if len(averages) else state
+
+
+class StreamingDemean(StreamingStage):
+    # Exponentially weighted running mean with a time constant of window seconds, starting from the mean of
+    # the warm-up. Every sample has the mean up to and including it removed; old samples count less and less,
+    # so the estimate follows a drifting offset and never extrapolates.
+    def __init__(self, stage, stats, window=STREAMING_TREND_WINDOW):
+        super().__init__(stage, stats)
+        self.alpha = _smoothing(window, stats.sampling_rate)
+        self.mean = None
+
+    def process(self, data):
+        if self.mean is None:
+            self.mean = float(np.mean(data, dtype=np.float64))
+        means, self.mean = _smooth(data.astype(np.float64), self.alpha, self.mean)
+        data -= means.astype(data.dtype)
+        return data
+
+
+class StreamingLinearDetrend(StreamingStage):
+    # Running linear trend by double exponential smoothing (Brown's method) with a time constant of window
+    # seconds, starting from the line fitted to the warm-up. Unlike a single running mean it follows a linear
+    # drift without lag; like it, it only weighs the recent window and is re-estimated with every sample.
+    def __init__(self, stage, stats, window=STREAMING_TREND_WINDOW):
+        super().__init__(stage, stats)
+        self.alpha = _smoothing(window, stats.sampling_rate)
+        self.single = None  # Running average of the samples
+        self.double = None  # Running average of the single average
+
+    def process(self, data):
+        if self.single is None:
+            # Line of the warm-up, continued back one sample, as the state of the smoothing in steady state
+            params = self.stage.fit(data, self.stats)
+            slope = params["slope"]
+            level = params["intercept"] - slope
+            lag = slope * (1.0 - self.alpha) / self.alpha
+            self.single, self.double = level - lag, level - 2 * lag
+        single, self.single = _smooth(data.astype(np.float64), self.alpha, self.single)
+        double, self.double = _smooth(single, self.alpha, self.double)
+        data -= (2 * single - double).astype(data.dtype)  # The level of the trend at every sample
+        return data
+
+
+class StreamingThresholdOutliers(StreamingStage):
+    # Mean and standard deviation of all samples so far, updated with every chunk before it is filtered
+    def __init__(self, stage, stats):
+        super().__init__(stage, stats)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared deviations from the mean
+
+    def process(self, data):
+        if not len(data):
+            return data
+        chunk = data.astype(np.float64)
+        chunk_mean = float(chunk.mean())
+        chunk_m2 = float(((chunk - chunk_mean) ** 2).sum())
+        count = self.count + len(chunk)
+        delta = chunk_mean - self.mean
+        self.m2 += chunk_m2 + delta ** 2 * self.count * len(chunk) / count
+        self.mean += delta * len(chunk) / count
+        self.count = count
+
+        spread = self.stage.threshold_factor * np.sqrt(self.m2 / self.count)
+        data[(data < self.mean - spread) | (data > self.mean + spread)] = self.mean
+        return data
+
+
+class StreamingRollingOutliers(StreamingStage):
+    # Holds back the last window_size // 2 samples, whose windows reach into the next chunk, and keeps the
+    # original values their windows need. Every sample sees the same window as in batch mode.
+    def __init__(self, stage, stats):
+        super().__init__(stage, stats)
+        self.half = stage.window_size // 2
+        self.history = _empty()  # Original values from half samples before the first sample not yet returned
+        self.returned = 0  # Samples returned so far
+        self.base = 0  # Index in the feed of history[0]
+
+    def _filter(self, data, last):
+        # Filtered data[first:last], first being the first sample not yet returned
+        filtered = rolling_outliers(data.copy(), self.stage.window_size, self.stage.threshold_factor)
+        return filtered[self.returned - self.base:last]
+
+    def process(self, data):
+        if self.half == 0:
+            return data
+        extended = np.concatenate([self.history, data])
+        # Samples up to len - half have their full window in extended
+        last = len(extended) - self.half + 1
+        if last <= self.returned - self.base or len(extended) < 2 * self.half:
+            self.history = extended
+            return _empty()
+        output = self._filter(extended, last)
+        self.returned += len(output)
+        keep_from = self.returned - self.half - self.base
+        self.history = extended[max(0, keep_from):]
+        self.base += max(0, keep_from)
+        return output
+
+    def flush(self):
+        if self.half == 0 or self.returned - self.base >= len(self.history):
+            return _empty()
+        # The end of the feed: the last samples get the shortened windows of the end of a trace
+        output = self._filter(self.history, len(self.history))
+        self.returned += len(output)
+        self.history = _empty()
+        return output
+
+
+class StreamingBandpass(StreamingStage):
+    # Carries the filter state from chunk to chunk, so the output is that of one pass over the whole feed
+    def __init__(self, stage, stats):
+        super().__init__(stage, stats)
+        if stage.zerophase:
+            raise ValueError("Zero-phase filtering needs the whole trace and cannot run on a feed.")
+        self.sos = stage.fit(None, stats)["sos"]
+        self.zi = None
+
+    def process(self, data):
+        self.zi = sosfilt_state(self.sos, data, self.zi)
+        return data
+
+
+class StreamingTaper(StreamingStage):
+    # A feed has no end, only its start is tapered, over max_percentage of the warm-up
+    def __init__(self, stage, stats):
+        super().__init__(stage, stats)
+        self.started = False
+
+    def process(self, data):
+        if not self.started:
+            self.started = True
+            wlen = min(int(self.stage.max_percentage * len(data)), int(len(data) / 2))
+            if wlen:
+                data[:wlen] *= hann(2 * wlen + 1)[:wlen].astype(data.dtype)
+        return data
+
+
+def make_streaming_stage(stage, stats, trend_window=STREAMING_TREND_WINDOW):
+    if isinstance(stage, Demean):
+        return StreamingDemean(stage, stats, trend_window)
+    if isinstance(stage, LinearDetrend):
+        return StreamingLinearDetrend(stage, stats, trend_window)
+    if isinstance(stage, RemoveOutliers):
+        if stage.method == "threshold":
+            return StreamingThresholdOutliers(stage, stats)
+        if stage.method == "rolling":
+            return StreamingRollingOutliers(stage, stats)
+        raise ValueError(f"Outlier method {stage.method} needs the whole trace and cannot run on a feed.")
+    if isinstance(stage, Bandpass):
+        return StreamingBandpass(stage, stats)
+    if isinstance(stage, Taper):
+        return StreamingTaper(stage, stats)
+    raise ValueError(f"No streaming version of preprocessing stage {stage.name}")
+
+
+# Preprocessing of a live feed of one channel, chunk by chunk, with the stages of a PreprocessingPipeline.
+# Nothing is returned until warmup seconds have arrived. The outlier statistics, the running mean and trend and
+# the filter state carry over from chunk to chunk; chunks are expected to follow each other without gaps. How
+# the output compares with the pipeline run on the whole trace, whatever the chunk sizes:
+# - rolling outliers and the bandpass (not zero-phase), alone or together: the same samples, bit for bit
+# - demean and/or linear detrend followed by the bandpass: the same within 1 / (2 pi freqmin trend_window) of
+#   the largest output, about 3e-4 with the defaults, once the filter has settled. The running estimates are
+#   low-pass filters of the feed and that fraction of the band leaks into them; their slow part, which separates
+#   them from the mean and trend of the whole trace, is removed by the bandpass.
+# - anything else differs by design: rolling outliers after demean or detrend (the running estimates shift
+#   within a window, so decisions at the bounds change), demean or detrend without the bandpass, threshold
+#   outliers (statistics of the data so far) and the taper (start of the feed only)
+class StreamingPreprocessor:
+    def __init__(self, stages, sampling_rate, warmup=STREAMING_WARMUP, trend_window=STREAMING_TREND_WINDOW):
+        self.stats = Stats({"sampling_rate": sampling_rate})
+        self.stages = [make_streaming_stage(make_stage(spec), self.stats, trend_window) for spec in stages]
+        self.warmup_samples = int(round(warmup * sampling_rate))
+        self.timings = {}
+
+        self._warmup = []
+        self._warmup_count = 0
+        self._started = False
+        self.returned = 0  # Samples returned so far
+        self.starttime = None  # Time of the first sample of the feed, set by process_trace
+
+    @classmethod
+    def from_flags(cls, sampling_rate, warmup=STREAMING_WARMUP, trend_window=STREAMING_TREND_WINDOW, **flags):
+        # Same stages as PreprocessingPipeline.from_flags, without the zero-phase option
+        return cls(PreprocessingPipeline.from_flags(**flags).stages, sampling_rate, warmup, trend_window)
+
+    def _run(self, data, flush=False):
+        for stage in self.stages:
+            start = time.perf_counter()
+            data = stage.process(data) if len(data) else data
+            if flush:
+                data = np.concatenate([data, stage.flush()])
+            name = stage.stage.name
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+        self.returned += len(data)
+        return data
+
+    def process(self, chunk):
+        # Processed samples that are final, as float32; they continue the samples returned before
+        data = np.array(chunk, dtype=np.float32)
+        if not self._started:
+            self._warmup.append(data)
+            self._warmup_count += len(data)
+            if self._warmup_count < self.warmup_samples:
+                return _empty()
+            data = np.concatenate(self._warmup)
+            self._warmup = []
+            self._started = True
+        return self._run(data)
+
+    def flush(self):
+        # The samples still held back, at the end of the feed
+        data = _empty()
+        if not self._started:
+            data = np.concatenate(self._warmup) if self._warmup else data
+            self._warmup = []
+            self._started = True
+        return self._run(data, flush=True)
+
+    def process_trace(self, trace):
+        # Trace version of process, the output starts where the previous output ended. None while nothing is
+        # final yet.
+        if self.starttime is None:
+            self.starttime = trace.stats.starttime
+        first = self.returned
+        data = self.process(trace.data)
+        if not len(data):
+            return None
+        stats = trace.stats.copy()
+        stats.starttime = self.starttime + first / self.stats.sampling_rate
+        stats.npts = len(data)
+        return Trace(data=data, header=stats)
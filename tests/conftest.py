@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fdsn_stand_in import EVENT_WADL, StandInEventService
+
+
+@pytest.fixture
+def event_service():
+    # Starts StandInEventService instances for a test and stops them after it
+    if not os.path.isfile(EVENT_WADL):
+        pytest.skip("ObsPy's test data with the FDSN event service description is not installed")
+    services = []
+
+    def start(events=(), **kwargs):
+        service = StandInEventService(events, **kwargs)
+        services.append(service)
+        return service
+
+    yield start
+    for service in services:
+        service.close()
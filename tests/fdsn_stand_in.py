@@ -0,0 +1,82 @@
+import io
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import obspy.clients.fdsn
+from obspy import UTCDateTime
+from obspy.core.event import Catalog as EventCatalog, Event, Magnitude, Origin, ResourceIdentifier
+
+# Service description of the IRIS event service, shipped with ObsPy's own tests
+EVENT_WADL = os.path.join(os.path.dirname(obspy.clients.fdsn.__file__), "tests", "data",
+                          "2014-01-07_iris_event.wadl")
+
+
+def quakeml(events, tag):
+    # events: (time, latitude, longitude, magnitude) tuples
+    catalog = EventCatalog()
+    for i, (time_, latitude, longitude, magnitude) in enumerate(events):
+        event = Event(resource_id=ResourceIdentifier(f"smi:{tag}/event/{i}"))
+        event.origins.append(Origin(time=UTCDateTime(time_), latitude=latitude, longitude=longitude, depth=10000.0))
+        event.magnitudes.append(Magnitude(mag=magnitude, magnitude_type="mb"))
+        catalog.events.append(event)
+    buffer = io.BytesIO()
+    catalog.write(buffer, format="QUAKEML")
+    return buffer.getvalue()
+
+
+# FDSN event web service on localhost answering every query with the same events, after delay seconds. An
+# empty event list answers 204 (no data), status other than 200 makes every query fail with that status.
+class StandInEventService:
+    def __init__(self, events=(), delay=0.0, status=200, tag="stand-in"):
+        self.events = list(events)
+        self.delay = delay
+        self.status = status
+        self.queries = 0
+        body = quakeml(self.events, tag) if self.events else b""
+        with open(EVENT_WADL, 'rb') as file:
+            wadl = file.read()
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body=b""):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if not path.startswith("/fdsnws/event/1/"):
+                    self.reply(404)  # Only an event service
+                elif path.endswith("application.wadl"):
+                    self.reply(200, wadl)
+                elif path.endswith("version"):
+                    self.reply(200, b"1.2.0")
+                elif path.endswith("query"):
+                    service.queries += 1
+                    time.sleep(service.delay)
+                    if service.status != 200:
+                        self.reply(service.status)
+                    else:
+                        self.reply(200 if body else 204, body)
+                else:
+                    self.reply(404)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
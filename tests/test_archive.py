@@ -0,0 +1,47 @@
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+
+from archive import WaveformArchive, covers
+
+START = UTCDateTime("2024-04-23T00:00:00")
+
+
+def make_trace(starttime, seconds, sampling_rate=100.0):
+    trace = Trace(data=np.arange(int(seconds * sampling_rate), dtype=np.int32))
+    trace.stats.update({"network": "AM", "station": "R0000", "channel": "EHZ", "sampling_rate": sampling_rate,
+                        "starttime": starttime})
+    return trace
+
+
+def test_partial_answer_leaves_the_rest_missing(tmp_path):
+    archive = WaveformArchive(str(tmp_path))
+    key = archive.make_key("AM", "R0000", "*", "*Z*")
+    # The provider only had the first six hours of the requested day
+    archive.add(Stream([make_trace(START, 6 * 3600)]), key, START, START + 86400)
+
+    assert archive.missing(key, START, START + 86400) == [(START + 6 * 3600, START + 86400)]
+    stored = archive.get_waveforms("AM", "R0000", "*", "*Z*", START, START + 86400)
+    assert not covers(stored, START, START + 86400)
+
+    archive.add(Stream([make_trace(START + 6 * 3600, 18 * 3600)]), key, START + 6 * 3600, START + 86400)
+    assert archive.missing(key, START, START + 86400) == []
+    assert covers(archive.get_waveforms("AM", "R0000", "*", "*Z*", START, START + 86400), START, START + 86400)
+
+
+def test_sample_alignment_is_not_a_gap(tmp_path):
+    archive = WaveformArchive(str(tmp_path))
+    key = archive.make_key("AM", "R0000", "*", "*Z*")
+    archive.add(Stream([make_trace(START + 0.004, 3600)]), key, START, START + 3600)
+    assert archive.missing(key, START, START + 3600) == []
+
+
+def test_no_data_answers_of_recent_spans_expire(tmp_path):
+    key = WaveformArchive.make_key("AM", "R0000", "*", "*Z*")
+    now = UTCDateTime()
+    WaveformArchive(str(tmp_path)).add_no_data(key, START, START + 3600)
+    WaveformArchive(str(tmp_path)).add_no_data(key, now - 3600, now)
+
+    # A settled span stays answered, a recent one is asked again once the TTL has passed
+    assert WaveformArchive(str(tmp_path), no_data_ttl=0).missing(key, START, START + 3600) == []
+    assert WaveformArchive(str(tmp_path)).missing(key, now - 3600, now) == []
+    assert len(WaveformArchive(str(tmp_path), no_data_ttl=0).missing(key, now - 3600, now)) == 1
@@ -0,0 +1,74 @@
+import pytest
+from obspy import UTCDateTime
+
+catalog_module = pytest.importorskip("catalog")
+
+from catalog_poller import CatalogPoller
+
+
+class StandInStation:
+    latitude = 51.5
+    longitude = -0.1
+    report_date = UTCDateTime("2024-04-23")
+
+
+def make_poller(providers, look_back=60):
+    catalog = catalog_module.Catalog(StandInStation(), 0, 180, 0, 10, providers, travel_time_mode="exact",
+                                     provider_timeout=5)
+    return CatalogPoller(catalog, look_back=look_back)
+
+
+def recent(minutes_ago, latitude=40.0, longitude=20.0, magnitude=5.0):
+    return (str(UTCDateTime() - minutes_ago * 60), latitude, longitude, magnitude)
+
+
+def drain(poller):
+    events = []
+    while not poller.events.empty():
+        events.append(poller.events.get())
+    return events
+
+
+def test_earthquake_reported_by_two_providers_is_put_once(event_service):
+    quake = recent(20)
+    first = event_service([quake], tag="first")
+    # The same earthquake a few seconds and kilometres apart, and one only the second provider has
+    second = event_service([(str(UTCDateTime(quake[0]) + 4), 40.1, 20.1, 5.2), recent(10, -10.0, 120.0)],
+                           tag="second")
+    poller = make_poller([first.url, second.url])
+
+    assert poller.poll(first.url) == 1
+    assert poller.poll(second.url) == 1
+    assert [earthquake.provider for earthquake in drain(poller)] == [first.url, second.url]
+    # Polled again, neither provider has anything new
+    assert poller.poll(first.url) == 0
+    assert poller.poll(second.url) == 0
+
+
+def test_events_leaving_the_look_back_are_forgotten(event_service):
+    service = event_service([recent(30)])
+    poller = make_poller([service.url])
+    assert poller.poll(service.url) == 1
+    assert len(poller.seen) == 1
+
+    poller.look_back = 10
+    poller.poll(event_service().url)
+    assert poller.seen == {}
+
+
+def test_failed_processing_leaves_events_to_the_next_poll(event_service, monkeypatch):
+    service = event_service([recent(15)])
+    poller = make_poller([service.url])
+
+    def fail(*args):
+        raise RuntimeError("travel times unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(poller.catalog, "process_catalogue", fail)
+        with pytest.raises(RuntimeError):
+            poller.poll(service.url)
+    assert poller.seen == {}
+    assert service.url not in poller.high_water
+
+    assert poller.poll(service.url) == 1
+    assert len(drain(poller)) == 1
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+from obspy import UTCDateTime
+
+from catalog_providers import fetch_events
+
+DAY = UTCDateTime("2024-04-23")
+QUERY = dict(starttime=DAY, endtime=DAY + 86400)
+FIRST = ("2024-04-23T05:00:00", 40.0, 20.0, 5.1)
+SECOND = ("2024-04-23T09:00:00", -10.0, 120.0, 6.0)
+THIRD = ("2024-04-23T17:00:00", 35.0, 140.0, 5.5)
+
+
+def origin_times(results):
+    return [str(event.origins[0].time) for _, event in results]
+
+
+def test_first_provider_with_events_wins(event_service):
+    slow = event_service([FIRST], delay=2.0)
+    empty = event_service()
+    fast = event_service([SECOND, THIRD], delay=0.2)
+
+    started = time.monotonic()
+    results, failed = fetch_events([slow.url, empty.url, fast.url], QUERY, "first", timeout=10)
+    assert time.monotonic() - started < 2.0
+    # The empty answer came first but does not win
+    assert {provider for provider, _ in results} == {fast.url}
+    assert len(results) == 2
+    assert failed == []
+
+
+def test_merge_drops_events_reported_twice(event_service):
+    preferred = event_service([FIRST, SECOND], tag="preferred")
+    # The same earthquake as FIRST, three seconds and a few kilometres apart, and one event of its own
+    other = event_service([("2024-04-23T05:00:03", 40.05, 20.05, 5.3), THIRD], tag="other")
+
+    results, failed = fetch_events([preferred.url, other.url], QUERY, "merge", timeout=10)
+    assert failed == []
+    assert origin_times(results) == [str(UTCDateTime(event[0])) for event in (FIRST, SECOND, THIRD)]
+    assert [provider for provider, _ in results] == [preferred.url, preferred.url, other.url]
+
+
+def test_provider_without_an_answer_in_time_is_failed(event_service):
+    slow = event_service([FIRST], delay=3.0)
+    fast = event_service([SECOND])
+
+    started = time.monotonic()
+    results, failed = fetch_events([slow.url, fast.url], QUERY, "merge", timeout=1)
+    assert time.monotonic() - started < 3.0
+    assert failed == [slow.url]
+    assert origin_times(results) == [str(UTCDateTime(SECOND[0]))]
+
+
+def test_all_providers_failing_is_reported_without_waiting(event_service):
+    catalog_module = pytest.importorskip("catalog")
+
+    class StandInStation:
+        latitude = 51.5
+        longitude = -0.1
+        report_date = DAY
+
+    services = [event_service(status=500), event_service(status=503)]
+    catalog = catalog_module.Catalog(StandInStation(), 0, 90, 0, 10, [service.url for service in services],
+                                     provider_timeout=5, catalog_cache=None)
+
+    started = time.monotonic()
+    assert catalog.request_catalogue() is False
+    assert time.monotonic() - started < 5
+    assert [service.queries for service in services] == [1, 1]
+
+
+def test_answer_with_a_failed_provider_is_not_cached(event_service, tmp_path):
+    catalog_module = pytest.importorskip("catalog")
+    from catalog_cache import CatalogCache
+
+    class StandInStation:
+        latitude = 51.5
+        longitude = -0.1
+        report_date = DAY - 30 * 86400  # Settled, a complete answer would be kept for good
+
+    working = event_service([FIRST])
+    broken = event_service(status=500)
+    cache = CatalogCache(path=str(tmp_path))
+
+    def request(providers):
+        catalog = catalog_module.Catalog(StandInStation(), 0, 90, 0, 10, providers, travel_time_mode="exact",
+                                         catalogue_mode="merge", provider_timeout=5, catalog_cache=cache)
+        assert catalog.request_catalogue()
+
+    request([working.url, broken.url])
+    request([working.url, broken.url])
+    assert working.queries == 2
+
+    request([working.url])
+    request([working.url])
+    assert working.queries == 3
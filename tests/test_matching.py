@@ -0,0 +1,44 @@
+import numpy as np
+from obspy import UTCDateTime
+from scipy.optimize import linear_sum_assignment
+
+from matching import optimal_match
+
+START = UTCDateTime("2024-04-23T00:00:00")
+UNASSIGNED = 1e6
+
+
+def dense_sequence(n_events=400, n_picks=1500, duration=600, seed=0):
+    # Events every second and a half or so, so the tolerance windows overlap into a few large groups
+    rng = np.random.default_rng(seed)
+    origins = np.sort(rng.uniform(0, duration, n_events))
+    times = np.concatenate([origins[rng.integers(0, n_events, n_picks // 2)] + rng.normal(0, 3, n_picks // 2),
+                            rng.uniform(0, duration, n_picks - n_picks // 2)])
+    detections = [{"peak_time": START + float(np.round(t, 2)), "peak_confidence": float(np.round(c, 2)),
+                   "phase": "P"} for t, c in zip(times, rng.uniform(0.05, 1, n_picks))]
+    return [START + float(t) for t in origins], detections
+
+
+def cost_matrix(predicted, detections, tolerance):
+    # The costs optimal_match minimises, for every event and pick
+    residuals = np.abs(np.array([[UTCDateTime(d['peak_time']) - p for d in detections] for p in predicted]))
+    confidences = np.array([d['peak_confidence'] for d in detections])
+    return np.where(residuals <= tolerance, residuals / tolerance + 1 - confidences, UNASSIGNED)
+
+
+def test_sparse_matching_finds_the_dense_optimum():
+    predicted, detections = dense_sequence()
+    costs = cost_matrix(predicted, detections, 10.0)
+    rows, cols = linear_sum_assignment(costs)
+    matched = costs[rows, cols] < UNASSIGNED
+    expected = costs[rows, cols][matched].sum() + UNASSIGNED * (len(predicted) - matched.sum())
+
+    assignments, unmatched = optimal_match(predicted, [None] * len(predicted), detections, 10.0, 20.0, p_only=True)
+    picks = [p for p, _ in assignments]
+    total = sum(UNASSIGNED if pick is None else costs[event, pick] for event, pick in enumerate(picks))
+    assigned = [pick for pick in picks if pick is not None]
+
+    assert len(set(assigned)) == len(assigned)
+    assert all(costs[event, pick] < UNASSIGNED for event, pick in enumerate(picks) if pick is not None)
+    assert np.isclose(total, expected)
+    assert sorted(unmatched + assigned) == list(range(len(detections)))
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+from obspy import Stream, Trace
+
+from parallel_preprocessing import ParallelPreprocessor, get_pool, stage_context
+from preprocessing import Bandpass, PreprocessingPipeline, RemoveOutliers
+
+SAMPLING_RATE = 50.0
+
+
+def noisy_stream(hours=6, seed=0):
+    rng = np.random.default_rng(seed)
+    npts = int(hours * 3600 * SAMPLING_RATE)
+    data = (rng.normal(0, 1, npts) + np.sin(2 * np.pi * 0.02 * np.arange(npts) / SAMPLING_RATE)).astype(np.float32)
+    data[::997] *= 50
+    return Stream([Trace(data, header={"sampling_rate": SAMPLING_RATE})])
+
+
+def low_band_stages():
+    # The transient of this band lasts minutes, far longer than at the default 1 Hz
+    return [RemoveOutliers("rolling"), Bandpass(freqmin=0.05, freqmax=1.0, corners=4)]
+
+
+def test_low_frequency_bandpass_matches_serial():
+    stream = noisy_stream()
+    expected = PreprocessingPipeline(low_band_stages()).run(stream)[0].data
+    preprocessor = ParallelPreprocessor(low_band_stages(), workers=2)
+    assert len(preprocessor.segments(len(expected), stage_context(low_band_stages()[1], SAMPLING_RATE)[0])) == 2
+    processed = preprocessor.run(stream)[0].data
+    np.testing.assert_allclose(processed, expected, rtol=0, atol=1e-6 * np.abs(expected).max())
+
+    # A fixed minute of overlap is far too short for this band
+    short = ParallelPreprocessor(low_band_stages(), workers=2, overlap=60.0).run(stream)[0].data
+    assert np.abs(short - expected).max() > 1e-4 * np.abs(expected).max()
+
+
+def test_broken_pool_is_replaced():
+    stream = noisy_stream(hours=1)
+    expected = PreprocessingPipeline(low_band_stages()).run(stream)[0].data
+
+    pool = get_pool(2)
+    pool.submit(os._exit, 1).exception()  # A worker dies, the pool refuses new work from now on
+    processed = ParallelPreprocessor(low_band_stages(), workers=2, overlap=600.0).run(stream)[0].data
+    np.testing.assert_allclose(processed, expected, rtol=0, atol=1e-6 * np.abs(expected).max())
+    assert get_pool(2) is not pool
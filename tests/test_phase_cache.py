@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime
+
+from phase_cache import load_phase_cache, save_phase_cache
+
+
+class StandInStation:
+    network = "AM"
+    code = "R0000"
+    report_date = UTCDateTime("2024-04-23")
+
+    def __init__(self, date_folder):
+        self.date_folder = date_folder
+
+
+def annotations(value):
+    trace = Trace(np.full(100, value, dtype=np.float32))
+    trace.stats.update({"network": "AM", "station": "R0000", "channel": "EHZ", "sampling_rate": 100.0,
+                        "starttime": StandInStation.report_date})
+    return Stream([trace])
+
+
+def picks(confidence):
+    return [{"peak_time": StandInStation.report_date + 60, "peak_confidence": confidence, "phase": "P"}]
+
+
+def test_one_entry_per_day_replaces_the_last(tmp_path):
+    station = StandInStation(str(tmp_path))
+    # An entry of the earlier layout, named by its key
+    for extension in ("mseed", "json"):
+        open(os.path.join(station.date_folder, f"2024-04-23_AM.R0000..Z.phases.old.{extension}"), 'w').close()
+
+    save_phase_cache(station, "first", picks(0.5), annotations(0.5))
+    save_phase_cache(station, "second", picks(0.9), annotations(0.9))
+    assert sorted(os.listdir(station.date_folder)) == ["2024-04-23_AM.R0000..Z.phases.json",
+                                                       "2024-04-23_AM.R0000..Z.phases.mseed"]
+
+    assert load_phase_cache(station, "first") is None
+    cached_picks, cached_stream = load_phase_cache(station, "second")
+    assert cached_picks[0]["peak_confidence"] == 0.9
+    assert cached_stream[0].stats.channel == "EHZ"
+    assert cached_stream[0].data[0] == np.float32(0.9)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from obspy import Stream, Trace
+
+from preprocessing import PreprocessingPipeline, RemoveOutliers
+
+
+@pytest.mark.parametrize("method", ["threshold", "iqr", "rolling"])
+def test_empty_trace_passes_through(method):
+    stream = Stream([Trace(np.zeros(0, dtype=np.float32), header={"sampling_rate": 100.0})])
+    processed = PreprocessingPipeline.from_flags(outlier_method=method).run(stream)
+    assert len(processed[0].data) == 0
+
+
+@pytest.mark.parametrize("method", ["threshold", "iqr"])
+def test_global_outliers_are_replaced_by_the_centre(method):
+    data = np.random.default_rng(0).normal(0, 1, 10000).astype(np.float32)
+    data[[10, 5000]] = [40.0, -40.0]
+    if method == "threshold":
+        centre, spread = data.astype(np.float64).mean(), 2 * data.astype(np.float64).std()
+        lower, upper = centre - spread, centre + spread
+    else:
+        quartile1, centre, quartile3 = np.percentile(data, [25, 50, 75])
+        lower, upper = centre - 2 * (quartile3 - quartile1), centre + 2 * (quartile3 - quartile1)
+    expected = np.where((data < lower) | (data > upper), np.float32(centre), data)
+
+    stage = RemoveOutliers(method)
+    processed = data.copy()
+    stage.apply(processed, stage.fit(processed, None))
+    np.testing.assert_allclose(processed, expected, rtol=0, atol=1e-6)
+    assert processed[10] != 40.0 and processed[5000] != -40.0
@@ -0,0 +1,129 @@
+import datetime
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from obspy import UTCDateTime
+
+scheduler = pytest.importorskip("scheduler")
+
+
+class StandInStream:
+    picked_signals = []
+
+
+class StandInStation:
+    latitude = 51.5
+    longitude = -0.1
+    report_date = UTCDateTime("2024-04-23")
+    stream = StandInStream()
+
+
+def make_scheduler(providers):
+    config = {
+        'network': "AM", 'station_code': "R0000", 'data_provider_url': "http://127.0.0.1:1",
+        'catalog_providers': providers, 'radmin': 0, 'radmax': 90, 'minmag': 0, 'maxmag': 10,
+        'travel_time_mode': 'exact', 'catalog_mode': 'first', 'catalog_timeout': 5, 'catalog_cache': False,
+        'tolerance_p': 10, 'tolerance_s': 10, 'p_only': True, 'save_results': False,
+    }
+    return scheduler.BackfillScheduler(config, None, None, default_rate_interval=0.0)
+
+
+def test_catalog_stage_loads_events(event_service):
+    service = event_service([("2024-04-23T05:00:00", 40.0, 20.0, 5.1), ("2024-04-23T09:00:00", -10.0, 120.0, 6.0)])
+    catalog = make_scheduler([service.url]).request_catalog(StandInStation())
+    assert len(catalog.original_catalog_earthquakes) == 2
+    assert catalog.provider == service.url
+
+
+def test_day_without_catalogued_events_is_not_a_failure(event_service):
+    backfill = make_scheduler([event_service().url])
+    catalog = backfill.request_catalog(StandInStation())
+    assert catalog.original_catalog_earthquakes == []
+
+    picks = [{"peak_time": UTCDateTime("2024-04-23T05:00:00"), "peak_confidence": 0.9, "phase": "P"}]
+    assert backfill.match(catalog, picks).startswith("0 of 0 catalogued events detected, 1 detected")
+
+
+
+class StageCalls:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def record(self, stage, date_str):
+        with self.lock:
+            self.calls.append((stage, date_str))
+
+    def stages(self, date_str):
+        return [stage for stage, date in self.calls if date == date_str]
+
+
+class StagedScheduler(scheduler.BackfillScheduler):
+    # Stages that record their calls instead of reaching the network
+    def __init__(self, calls, failing=()):
+        config = {'network': "AM", 'station_code': "R0000", 'data_provider_url': "http://127.0.0.1:1",
+                  'catalog_providers': [], 'catalog_cache': False}
+        super().__init__(config, datetime.date(2024, 4, 22), datetime.date(2024, 4, 24), io_workers=2,
+                         default_rate_interval=0.0)
+        self.calls = calls
+        self.failing = failing
+
+    def download(self, date_str, state):
+        self.calls.record("download", date_str)
+        if date_str in self.failing:
+            raise RuntimeError("No data downloaded.")
+        station = StandInStation()
+        station.report_date = date_str
+        return station, f"{date_str}.mseed"
+
+    def request_catalog(self, station):
+        self.calls.record("catalog", station.report_date)
+        return station
+
+    def match(self, catalog, picks):
+        self.calls.record("match", catalog.report_date)
+        return f"{len(picks)} picks matched"
+
+
+@pytest.fixture
+def stage_calls(tmp_path, monkeypatch):
+    # Dates are kept under ./data, and the model stage runs on threads so its stand-in applies there too
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(scheduler, "ProcessPoolExecutor",
+                        lambda max_workers, mp_context, initializer: ThreadPoolExecutor(max_workers))
+    calls = StageCalls()
+
+    def process_day(network, code, url, date_str, latitude, longitude, filepath, config):
+        assert filepath == f"{date_str}.mseed"
+        calls.record("process", date_str)
+        return [{"peak_time": UTCDateTime(date_str) + 60, "peak_confidence": 0.9, "phase": "P"}]
+
+    monkeypatch.setattr(scheduler, "process_day", process_day)
+    return calls
+
+
+def test_run_orders_stages_skips_failed_days_and_resumes(stage_calls):
+    # The last date was interrupted after its model stage
+    state = scheduler.BackfillState(os.path.join(os.getcwd(), "data", "AM.R0000", "2024-04-24"))
+    state.mark("download")
+    state.mark("process", picks=scheduler.serialize_picks(
+        [{"peak_time": UTCDateTime("2024-04-24T01:00:00"), "peak_confidence": 0.8, "phase": "S"}] * 2))
+
+    results = StagedScheduler(stage_calls, failing=("2024-04-23",)).run()
+    assert results == {"2024-04-22": "1 picks matched",
+                       "2024-04-23": "Failed at download stage: No data downloaded.",
+                       "2024-04-24": "2 picks matched"}
+    first = stage_calls.stages("2024-04-22")
+    assert first[0] == "download" and first[-1] == "match" and sorted(first[1:3]) == ["catalog", "process"]
+    assert stage_calls.stages("2024-04-23") == ["download"]
+    assert stage_calls.stages("2024-04-24") == ["download", "catalog", "match"]
+
+    # Run again: completed dates are skipped and the failed one is processed from the start
+    stage_calls.calls = []
+    results = StagedScheduler(stage_calls).run()
+    assert results == {"2024-04-23": "1 picks matched"}
+    assert stage_calls.stages("2024-04-23")[0] == "download"
+    assert sorted(stage_calls.stages("2024-04-23")) == ["catalog", "download", "match", "process"]
+    assert {date for _, date in stage_calls.calls} == {"2024-04-23"}
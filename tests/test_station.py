@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from obspy import Stream, Trace, UTCDateTime
+from obspy.clients.fdsn.header import FDSNNoDataException
+
+from archive import WaveformArchive
+
+station_module = pytest.importorskip("station")
+
+DAY = UTCDateTime("2024-04-23")
+# The station stopped recording at 23:00
+DATA_END = DAY + 23 * 3600
+
+
+class StandInProvider:
+    def __init__(self):
+        self.requests = []
+        trace = Trace(np.arange(int(DATA_END - DAY + 300), dtype=np.int32))
+        trace.stats.update({"network": "AM", "station": "R0000", "channel": "EHZ", "sampling_rate": 1.0,
+                            "starttime": DAY - 300})
+        self.trace = trace
+
+    def download_part(self, location, channel, part_start, part_end, max_retries=2, retry_backoff=5):
+        self.requests.append((part_start, part_end))
+        if part_start >= DATA_END:
+            raise FDSNNoDataException("No data available for request.")
+        return Stream([self.trace.slice(part_start, min(part_end, DATA_END) - 1)])
+
+
+def test_day_ending_before_the_window_downloads_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    archive = WaveformArchive(str(tmp_path / "archive"))
+    provider = StandInProvider()
+
+    results = []
+    for _ in range(3):
+        station = station_module.Station("AM", "R0000", "http://127.0.0.1:1", "2024-04-23", latitude=51.5,
+                                         longitude=-0.1)
+        station.download_part = provider.download_part
+        results.append(station.download_day_stream(overwrite=False, archive=archive))
+        assert station.stream.original_stream[0].stats.endtime == DATA_END - 1
+
+    assert [result["status"] for result in results] == ["success", "success", "exists"]
+    # The second run asks for the missing tail once, and the answer of no data is kept
+    assert provider.requests[3:] == [(DATA_END, DAY + 86700)]
@@ -0,0 +1,20 @@
+import pytest
+
+stream = pytest.importorskip("stream")
+benchmark = pytest.importorskip("benchmark")
+from model_registry import get_model
+
+
+@pytest.fixture(scope="module")
+def phase_model():
+    try:
+        return get_model(*stream.PHASE_MODEL)
+    except Exception as e:
+        pytest.skip(f"Model weights for {stream.PHASE_MODEL} are not available: {e}")
+
+
+def test_single_pass_matches_classify_and_annotate(phase_model):
+    # Two minutes are enough for a few EQTransformer windows
+    result = benchmark.compare_single_pass(benchmark.synthetic_stream(duration=120), atol=1e-5)
+    assert result["annotations_match"]
+    assert result["picks_match"]
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from obspy import Stream, Trace
+
+from preprocessing import Bandpass, PreprocessingPipeline
+from streaming_preprocessing import STREAMING_TREND_WINDOW, StreamingPreprocessor
+
+SAMPLING_RATE = 100.0
+
+
+def drifting_trace(duration=3600, seed=0):
+    # Noise on a large offset with a linear and a slow periodic drift, and a few spikes
+    rng = np.random.default_rng(seed)
+    seconds = np.arange(int(duration * SAMPLING_RATE)) / SAMPLING_RATE
+    data = rng.normal(0, 1, len(seconds)) + 500 + 0.02 * seconds + 30 * np.sin(2 * np.pi * seconds / 5000)
+    data[::997] *= 50
+    return data.astype(np.float32)
+
+
+def batch(data, stages):
+    trace = Trace(data.copy(), header={"sampling_rate": SAMPLING_RATE})
+    return PreprocessingPipeline(stages).run(Stream([trace]))[0].data
+
+
+def streamed(data, stages, chunk_sizes):
+    preprocessor = StreamingPreprocessor(stages, SAMPLING_RATE)
+    output = []
+    start = 0
+    while start < len(data):
+        size = chunk_sizes[len(output) % len(chunk_sizes)]
+        output.append(preprocessor.process(data[start:start + size]))
+        start += size
+    output.append(preprocessor.flush())
+    return np.concatenate(output)
+
+
+@pytest.mark.parametrize("chunk_sizes", [[500], [37, 1200, 3]])
+def test_rolling_outliers_and_bandpass_match_the_whole_trace(chunk_sizes):
+    data = drifting_trace()
+    stages = [{"name": "outliers", "method": "rolling"}, "bandpass"]
+    np.testing.assert_array_equal(streamed(data, stages, chunk_sizes), batch(data, stages))
+
+
+@pytest.mark.parametrize("stages", [["demean", "bandpass"], ["linear", "bandpass"], ["demean", "linear", "bandpass"]])
+def test_running_mean_and_trend_before_the_bandpass_match_once_settled(stages):
+    data = drifting_trace()
+    expected = batch(data, stages)
+    output = streamed(data, stages, [500])
+    settled = slice(int(600 * SAMPLING_RATE), None)
+    bound = 1 / (2 * np.pi * Bandpass().freqmin * STREAMING_TREND_WINDOW)
+    assert np.abs(output[settled] - expected[settled]).max() < bound * np.abs(expected[settled]).max()
+
+
+@pytest.mark.parametrize("stage", ["demean", "linear"])
+def test_running_estimates_follow_a_change_of_drift(stage):
+    # A ramp during the warm-up and the first minutes, then a constant level: a trend fitted once would keep
+    # climbing away from the data
+    seconds = np.arange(int(7200 * SAMPLING_RATE)) / SAMPLING_RATE
+    data = (1000 + np.minimum(seconds, 600.0)).astype(np.float32)
+    output = streamed(data, [stage], [1000])
+    assert np.abs(output[-int(60 * SAMPLING_RATE):]).max() < 10.0
@@ -0,0 +1,77 @@
+import itertools
+
+import pytest
+from obspy import UTCDateTime
+
+catalog_module = pytest.importorskip("catalog")
+
+from threshold_sweep import sweep_thresholds
+
+DAY = UTCDateTime("2024-04-23")
+P_THRESHOLDS = [0.2, 0.5, 0.85]
+S_THRESHOLDS = [0.25, 0.6]
+TOLERANCES_P = [0.5, 3.0, 6.0]
+TOLERANCES_S = [1.5, 4.0]
+
+
+class StandInStation:
+    latitude = 51.5
+    longitude = -0.1
+    report_date = DAY
+
+
+def earthquakes():
+    # The first two events are close enough for one P pick and one S pick to fall in both windows
+    predicted = [(100, 160), (104, 163), (400, 460)]
+    return [catalog_module.Earthquake(f"2024-04-23_{i + 1:02d}", "test", str(i), DAY + p - 60, 40.0, 20.0, 5.0,
+                                      "mb", 10.0, 30.0, p_predicted=DAY + p, s_predicted=DAY + s)
+            for i, (p, s) in enumerate(predicted)]
+
+
+def pick(seconds, confidence, phase):
+    return {"peak_time": DAY + seconds, "peak_confidence": confidence, "phase": phase}
+
+
+def day_picks(shared_time=False):
+    picks = [pick(102, 0.9, "P"), pick(106.5, 0.4, "P"), pick(401, 0.6, "P"), pick(800, 0.7, "P"),
+             pick(161.5, 0.8, "S"), pick(164, 0.3, "S"), pick(465, 0.5, "S"), pick(402, 0.9, "P")]
+    if shared_time:
+        # An S pick at the time of a P pick leaves the unmatched list with it
+        picks.append(pick(102, 0.65, "S"))
+    return picks
+
+
+def match_and_merge_summary(picks, p_threshold, s_threshold, tolerance_p, tolerance_s, p_only):
+    catalog = catalog_module.Catalog(StandInStation(), 0, 180, 0, 10, [], travel_time_mode="exact")
+    catalog.original_catalog_earthquakes = earthquakes()
+    detections = [detection for detection in picks
+                  if (detection['phase'] == "P" and detection['peak_confidence'] >= p_threshold) or
+                  (detection['phase'] == "S" and detection['peak_confidence'] >= s_threshold)]
+    catalog.match_and_merge(detections, tolerance_p, tolerance_s, p_only)
+    return catalog.print_summary()
+
+
+@pytest.mark.parametrize("p_only", [False, True])
+@pytest.mark.parametrize("shared_time", [False, True])
+def test_sweep_matches_match_and_merge(shared_time, p_only):
+    picks = day_picks(shared_time)
+    results = sweep_thresholds([(picks, earthquakes())], P_THRESHOLDS, S_THRESHOLDS, TOLERANCES_P, TOLERANCES_S,
+                               p_only=p_only)
+    assert len(results) == len(P_THRESHOLDS) * len(S_THRESHOLDS) * len(TOLERANCES_P) * len(TOLERANCES_S)
+
+    for p_threshold, s_threshold, tolerance_p, tolerance_s in itertools.product(P_THRESHOLDS, S_THRESHOLDS,
+                                                                                TOLERANCES_P, TOLERANCES_S):
+        row = results[(results.p_threshold == p_threshold) & (results.s_threshold == s_threshold) &
+                      (results.tolerance_p == tolerance_p) & (results.tolerance_s == tolerance_s)].iloc[0]
+        detected, false_detections = match_and_merge_summary(picks, p_threshold, s_threshold, tolerance_p,
+                                                             tolerance_s, p_only)
+        assert (row.detected, row.false_detections) == (detected, false_detections), \
+            (p_threshold, s_threshold, tolerance_p, tolerance_s)
+
+
+def test_shared_pick_detects_one_event():
+    # Only the P pick at 102 s is above the threshold and within 3 s of both of the first two events
+    picks = [pick(102, 0.9, "P")]
+    results = sweep_thresholds([(picks, earthquakes())], [0.5], [0.5], [3.0], [1.0], p_only=True)
+    assert results.loc[0, "detected"] == 1
+    assert results.loc[0, "false_detections"] == 0
@@ -0,0 +1,127 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from matching import _ns, greedy_match
+
+
+# Greedy matches of one phase at every (tolerance, threshold) pair: whether each event took a pick, and how
+# many picks of the phase left the unmatched list, those sharing the time of a taken pick included
+def _phase_matches(picks, predicted, thresholds, tolerances, phase):
+    selected = [pick for pick in picks if pick['phase'] == phase]
+    missing = [None] * len(predicted)
+    detected = np.zeros((len(tolerances), len(thresholds), len(predicted)), dtype=bool)
+    consumed = np.zeros((len(tolerances), len(thresholds)))
+    for (i, tolerance), (j, threshold) in itertools.product(enumerate(tolerances), enumerate(thresholds)):
+        kept = [pick for pick in selected if pick['peak_confidence'] >= threshold]
+        if phase == "P":
+            assignments, unmatched = greedy_match(predicted, missing, kept, tolerance, 0.0, p_only=True)
+        else:
+            assignments, unmatched = greedy_match(missing, predicted, kept, 0.0, tolerance)
+        detected[i, j] = [best_p is not None or best_s is not None for best_p, best_s in assignments]
+        consumed[i, j] = len(kept) - len(unmatched)
+    return detected, consumed
+
+
+def _shares_times(picks):
+    # greedy_match drops every pick at a taken time whatever its phase, so a P and an S pick at the same
+    # time tie the two phases together
+    p_keys = {round(_ns(pick['peak_time']), -3) for pick in picks if pick['phase'] == "P"}
+    return any(round(_ns(pick['peak_time']), -3) in p_keys for pick in picks if pick['phase'] == "S")
+
+
+# Evaluate one day on the full grid with the greedy matching of Catalog.match_and_merge, so each pick
+# detects at most one event. Without P and S picks at a shared time the phases match independently and
+# are combined on the grid; otherwise every grid point is matched in full.
+def _sweep_day(picks, earthquakes, p_thresholds, s_thresholds, tolerances_p, tolerances_s, p_only):
+    catalogued = [eq for eq in earthquakes if eq.catalogued]
+    p_predicted = [eq.p_predicted for eq in catalogued]
+    s_predicted = [eq.s_predicted for eq in catalogued]
+    rows = list(itertools.product(tolerances_p, p_thresholds))
+    cols = list(itertools.product(tolerances_s, s_thresholds))
+
+    if _shares_times(picks):
+        detected = np.zeros((len(rows), len(cols)))
+        false_detections = np.zeros((len(rows), len(cols)))
+        for (i, (tolerance_p, p_threshold)), (j, (tolerance_s, s_threshold)) in itertools.product(
+                enumerate(rows), enumerate(cols)):
+            # The detections StreamData.filter_confidence keeps
+            kept = [pick for pick in picks
+                    if (pick['phase'] == "P" and pick['peak_confidence'] >= p_threshold) or
+                    (pick['phase'] == "S" and pick['peak_confidence'] >= s_threshold)]
+            assignments, unmatched = greedy_match(p_predicted, s_predicted, kept, tolerance_p, tolerance_s, p_only)
+            detected[i, j] = sum(best_p is not None or best_s is not None for best_p, best_s in assignments)
+            false_detections[i, j] = len(unmatched)
+        return len(catalogued), detected, false_detections
+
+    # Detection matrices of shape (tolerance, threshold, event)
+    detected_p, consumed_p = _phase_matches(picks, p_predicted, p_thresholds, tolerances_p, "P")
+    if p_only:
+        detected_s = np.zeros((len(tolerances_s), len(s_thresholds), len(catalogued)), dtype=bool)
+        consumed_s = np.zeros((len(tolerances_s), len(s_thresholds)))
+    else:
+        detected_s, consumed_s = _phase_matches(picks, s_predicted, s_thresholds, tolerances_s, "S")
+
+    flat_p = detected_p.reshape(len(rows), len(catalogued)).astype(np.float32)
+    flat_s = detected_s.reshape(len(cols), len(catalogued)).astype(np.float32)
+    count_p = flat_p.sum(axis=1)
+    count_s = flat_s.sum(axis=1)
+    count_both = flat_p @ flat_s.T
+    detected = count_p[:, None] + count_s[None, :] - count_both
+
+    # Picks surviving the confidence filter for each threshold, less those the matching took
+    p_confidences = np.sort([pick['peak_confidence'] for pick in picks if pick['phase'] == "P"])
+    s_confidences = np.sort([pick['peak_confidence'] for pick in picks if pick['phase'] == "S"])
+    p_above = len(p_confidences) - np.searchsorted(p_confidences, p_thresholds, side='left')
+    s_above = len(s_confidences) - np.searchsorted(s_confidences, s_thresholds, side='left')
+    false_p = np.tile(p_above, len(tolerances_p)) - consumed_p.ravel()
+    false_s = np.tile(s_above, len(tolerances_s)) - consumed_s.ravel()
+    false_detections = false_p[:, None] + false_s[None, :]
+
+    return len(catalogued), detected, false_detections
+
+
+def sweep_thresholds(days, p_thresholds, s_thresholds, tolerances_p, tolerances_s, p_only=False):
+    # days: iterable of (picks, earthquakes) pairs, e.g. StreamData.raw_picks and
+    # Catalog.original_catalog_earthquakes for each day
+    p_thresholds = np.asarray(p_thresholds, dtype=float)
+    s_thresholds = np.asarray(s_thresholds, dtype=float)
+    tolerances_p = np.asarray(tolerances_p, dtype=float)
+    tolerances_s = np.asarray(tolerances_s, dtype=float)
+
+    total_catalogued = 0
+    total_detected = np.zeros((len(tolerances_p) * len(p_thresholds), len(tolerances_s) * len(s_thresholds)))
+    total_false = np.zeros_like(total_detected)
+
+    for picks, earthquakes in days:
+        catalogued, detected, false_detections = _sweep_day(picks, earthquakes, p_thresholds, s_thresholds,
+                                                             tolerances_p, tolerances_s, p_only)
+        total_catalogued += catalogued
+        total_detected += detected
+        total_false += false_detections
+
+    # Rows follow the (tolerance_p, p_threshold) x (tolerance_s, s_threshold) layout of the matrices
+    grid = np.array(list(itertools.product(tolerances_p, p_thresholds, tolerances_s, s_thresholds))).reshape(-1, 4)
+    results = pd.DataFrame({
+        "p_threshold": grid[:, 1],
+        "s_threshold": grid[:, 3],
+        "tolerance_p": grid[:, 0],
+        "tolerance_s": grid[:, 2],
+        "catalogued": total_catalogued,
+        "detected": total_detected.ravel().astype(int),
+        "false_detections": total_false.ravel().astype(int),
+    })
+    results["detection_rate"] = results["detected"] / total_catalogued if total_catalogued else 0.0
+
+    return results.sort_values(by=["detection_rate", "false_detections"], ascending=[False, True],
+                               ignore_index=True)
+
+
+# Sweep a single processed day using the picks kept (or loaded from cache) by StreamData
+def sweep_catalog(catalog, p_thresholds, s_thresholds, tolerances_p, tolerances_s, p_only=False):
+    stream = catalog.station.stream
+    if stream.raw_picks is None:
+        stream.predict_and_annotate()
+    return sweep_thresholds([(stream.raw_picks, catalog.original_catalog_earthquakes)], p_thresholds,
+                            s_thresholds, tolerances_p, tolerances_s, p_only)
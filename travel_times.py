@@ -0,0 +1,205 @@
+import os
+import threading
+
+import numpy as np
+from obspy import UTCDateTime
+from obspy.geodetics import gps2dist_azimuth
+from obspy.taup import TauPyModel
+
+# Grid of the precomputed table. Depths are denser near the surface where travel times change fastest.
+TABLE_DISTANCES = np.arange(0.0, 180.5, 0.5)
+TABLE_DEPTHS = np.array([0.0, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 15.0, 20.0, 30.0, 40.0, 50.0, 75.0, 100.0, 150.0,
+                         200.0, 300.0, 400.0, 500.0, 600.0, 700.0])
+
+_taup_models = {}
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_taup_model(model_name="iasp91"):
+    # Building a TauPyModel reads the model file, so keep one per process
+    if model_name not in _taup_models:
+        _taup_models[model_name] = TauPyModel(model=model_name)
+    return _taup_models[model_name]
+
+
+def taup_arrivals(distance_deg, depth_km, model_name="iasp91"):
+    return get_taup_model(model_name).get_travel_times(source_depth_in_km=depth_km, distance_in_degree=distance_deg,
+                                                       phase_list=["P", "S"])
+
+
+def exact_travel_times(distance_deg, depth_km, model_name="iasp91"):
+    # P and S travel times from TauP, None where the phase does not exist. When a phase has several
+    # branches the last arrival is used, like predict_arrivals always did.
+    p_time, s_time = None, None
+    for arrival in taup_arrivals(distance_deg, depth_km, model_name):
+        if arrival.name == "P":
+            p_time = arrival.time
+        elif arrival.name == "S":
+            s_time = arrival.time
+    return p_time, s_time
+
+
+def table_path(model_name="iasp91"):
+    return os.path.join(os.getcwd(), "data", f"travel_times_{model_name}.npz")
+
+
+def build_travel_time_table(model_name="iasp91", distances=TABLE_DISTANCES, depths=TABLE_DEPTHS, path=None):
+    print(f"Building {model_name} travel time table, this only happens once...")
+    p_times = np.full((len(depths), len(distances)), np.nan)
+    s_times = np.full((len(depths), len(distances)), np.nan)
+    # Number of branches of each phase, where it changes the last arrival jumps between branches
+    p_branches = np.zeros((len(depths), len(distances)), dtype=np.int16)
+    s_branches = np.zeros((len(depths), len(distances)), dtype=np.int16)
+    for i, depth in enumerate(depths):
+        for j, distance in enumerate(distances):
+            for arrival in taup_arrivals(distance, depth, model_name):
+                if arrival.name == "P":
+                    p_times[i, j] = arrival.time
+                    p_branches[i, j] += 1
+                elif arrival.name == "S":
+                    s_times[i, j] = arrival.time
+                    s_branches[i, j] += 1
+
+    path = path or table_path(model_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written next to the table and renamed, so other processes never load a half written file
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as file:
+        np.savez(file, distances=distances, depths=depths, p_times=p_times, s_times=s_times, p_branches=p_branches,
+                 s_branches=s_branches)
+    os.replace(temp_path, path)
+    print(f"Travel time table saved to {path}")
+    return TravelTimeTable(distances, depths, p_times, s_times, p_branches, s_branches)
+
+
+def load_travel_time_table(model_name="iasp91", path=None):
+    path = path or table_path(model_name)
+    # Threads matching at the same time wait for one build instead of each running TauP over the whole grid
+    with _tables_lock:
+        if path in _tables:
+            return _tables[path]
+        if os.path.isfile(path):
+            with np.load(path) as content:
+                _tables[path] = TravelTimeTable(content['distances'], content['depths'], content['p_times'],
+                                                content['s_times'], content['p_branches'], content['s_branches'])
+        else:
+            _tables[path] = build_travel_time_table(model_name, path=path)
+        return _tables[path]
+
+
+class TravelTimeTable:
+    def __init__(self, distances, depths, p_times, s_times, p_branches, s_branches):
+        self.distances = np.asarray(distances, dtype=float)
+        self.depths = np.asarray(depths, dtype=float)
+        self.p_times = np.asarray(p_times, dtype=float)
+        self.s_times = np.asarray(s_times, dtype=float)
+        self.p_branches = np.asarray(p_branches)
+        self.s_branches = np.asarray(s_branches)
+
+    def interpolate(self, distances_deg, depths_km):
+        # Bilinear interpolation for arrays of events. Also returns which queries the table resolved: not
+        # those outside the grid or whose neighbouring grid points lie on different branches (triplications,
+        # edge of the shadow zone), so the caller can fall back to TauP there. A resolved NaN means the
+        # phase does not exist at that distance.
+        distances_deg = np.atleast_1d(np.asarray(distances_deg, dtype=float))
+        depths_km = np.atleast_1d(np.asarray(depths_km, dtype=float))
+
+        inside = ((distances_deg >= self.distances[0]) & (distances_deg <= self.distances[-1]) &
+                  (depths_km >= self.depths[0]) & (depths_km <= self.depths[-1]))
+
+        j = np.clip(np.searchsorted(self.distances, distances_deg, side='right') - 1, 0, len(self.distances) - 2)
+        i = np.clip(np.searchsorted(self.depths, depths_km, side='right') - 1, 0, len(self.depths) - 2)
+        wx = (distances_deg - self.distances[j]) / (self.distances[j + 1] - self.distances[j])
+        wz = (depths_km - self.depths[i]) / (self.depths[i + 1] - self.depths[i])
+
+        results = []
+        resolved = inside
+        for times, branches in ((self.p_times, self.p_branches), (self.s_times, self.s_branches)):
+            interpolated = ((1 - wz) * ((1 - wx) * times[i, j] + wx * times[i, j + 1]) +
+                            wz * ((1 - wx) * times[i + 1, j] + wx * times[i + 1, j + 1]))
+            same_branch = ((branches[i, j] == branches[i, j + 1]) & (branches[i, j] == branches[i + 1, j]) &
+                           (branches[i, j] == branches[i + 1, j + 1]))
+            interpolated[~inside | ~same_branch] = np.nan
+            results.append(interpolated)
+            resolved = resolved & same_branch
+        return results[0], results[1], resolved
+
+
+def epicentral_distances(lats, longs, station_latitude, station_longitude):
+    # Same conversion as predict_arrivals: geodesic distance divided by the length of a degree
+    return np.array([gps2dist_azimuth(lat, long, station_latitude, station_longitude)[0] / 1000.0 / 111.195
+                     for lat, long in zip(lats, longs)], dtype=float)
+
+
+def distances_and_azimuths(lats, longs, station_latitude, station_longitude):
+    # Great circle distance in degrees and azimuth from the station in degrees for arrays of events, on the
+    # sphere like locations2degrees. Events without coordinates get NaN.
+    lat1 = np.radians(station_latitude)
+    lat2 = np.radians(np.asarray(lats, dtype=float))
+    delta_long = np.radians(np.asarray(longs, dtype=float) - station_longitude)
+
+    distances = np.degrees(np.arctan2(
+        np.sqrt((np.cos(lat2) * np.sin(delta_long)) ** 2 +
+                (np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(delta_long)) ** 2),
+        np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) * np.cos(delta_long)))
+    azimuths = np.degrees(np.arctan2(
+        np.sin(delta_long) * np.cos(lat2),
+        np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(delta_long))) % 360.0
+    return distances, azimuths
+
+
+def predict_arrivals_batch(lats, longs, depths, times, station_latitude, station_longitude, mode="table",
+                           model_name="iasp91"):
+    # Predicted P and S arrival times (UTCDateTime or None) for many events at once. Depths are passed the
+    # way predict_arrivals receives them. In "table" mode events the table cannot answer are computed
+    # exactly; "exact" mode uses TauP for every event.
+    distances = epicentral_distances(lats, longs, station_latitude, station_longitude)
+    source_depths = np.asarray(depths, dtype=float) / 1000.0
+
+    if mode == "exact":
+        p_offsets = np.full(len(distances), np.nan)
+        s_offsets = np.full(len(distances), np.nan)
+        fallback = np.ones(len(distances), dtype=bool)
+    elif mode == "table":
+        p_offsets, s_offsets, resolved = load_travel_time_table(model_name).interpolate(distances, source_depths)
+        fallback = ~resolved
+    else:
+        raise ValueError(f"Unknown travel time mode: {mode}")
+
+    for k in np.flatnonzero(fallback):
+        p_time, s_time = exact_travel_times(distances[k], source_depths[k], model_name)
+        p_offsets[k] = np.nan if p_time is None else p_time
+        s_offsets[k] = np.nan if s_time is None else s_time
+
+    p_arrivals = [None if np.isnan(offset) else UTCDateTime(time) + float(offset)
+                  for time, offset in zip(times, p_offsets)]
+    s_arrivals = [None if np.isnan(offset) else UTCDateTime(time) + float(offset)
+                  for time, offset in zip(times, s_offsets)]
+    return p_arrivals, s_arrivals
+
+
+# Compare the table against TauP for random events and report the error in seconds
+def accuracy_report(n_events=500, model_name="iasp91", max_distance=180.0, max_depth=700.0, seed=0):
+    rng = np.random.default_rng(seed)
+    distances = rng.uniform(0, max_distance, n_events)
+    depths = rng.uniform(0, max_depth, n_events)
+    table = load_travel_time_table(model_name)
+    p_table, s_table, resolved = table.interpolate(distances, depths)
+
+    report = {}
+    for phase, interpolated, index in (("P", p_table, 0), ("S", s_table, 1)):
+        exact = np.array([exact_travel_times(distance, depth, model_name)[index] for distance, depth in
+                          zip(distances, depths)], dtype=float)
+        both = ~np.isnan(exact) & ~np.isnan(interpolated)
+        errors = np.abs(interpolated[both] - exact[both])
+        report[phase] = {
+            "compared": int(both.sum()),
+            "mean_error": float(errors.mean()) if len(errors) else np.nan,
+            "p95_error": float(np.percentile(errors, 95)) if len(errors) else np.nan,
+            "max_error": float(errors.max()) if len(errors) else np.nan,
+            "fallback": int((~resolved).sum()),
+            # Resolved as missing by the table although TauP has an arrival
+            "missed": int((resolved & np.isnan(interpolated) & ~np.isnan(exact)).sum()),
+        }
+    return report